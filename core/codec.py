@@ -0,0 +1,344 @@
+"""
+Компактный двоичный формат определений ПРФ.
+
+Определение записывается в прямом порядке обхода (узел, затем его дочерние
+узлы): код операции и параметры - целые числа в формате varint (LEB128).
+Повторяющиеся составные поддеревья записываются один раз, а дальше -
+обратной ссылкой на номер уже записанного узла. Кодирование и
+декодирование выполняются без рекурсии, поэтому глубина дерева ограничена
+только памятью.
+
+Формат:
+    заголовок   b"PRF" + версия (1 байт)
+    узел        код [параметры] [дочерние узлы]
+    zero        0
+    successor   1
+    constant    2 значение арность
+    projection  3 n i
+    composition 4 k f g_1 ... g_k
+    recursion   5 g h
+    reference   6 флаги [длина имя] [длина хэш] [арность]
+    backref     7 номер
+
+Номера получают только составные узлы (composition и recursion) в порядке
+их начала в потоке.
+"""
+
+from typing import Any, Callable, Dict, List, Tuple
+
+from core.prf import (
+    PrimitiveFunction, Composition, PrimitiveRecursion, LazyFunction, definition_children,
+    definition_params, definition_from_parts, function_from_dict
+)
+
+
+MAGIC = b"PRF"
+VERSION = 1
+
+OP_ZERO = 0
+OP_SUCCESSOR = 1
+OP_CONSTANT = 2
+OP_PROJECTION = 3
+OP_COMPOSITION = 4
+OP_RECURSION = 5
+OP_REFERENCE = 6
+OP_BACKREF = 7
+
+# Флаги полей ссылки
+_REF_NAME = 1
+_REF_HASH = 2
+_REF_ARITY = 4
+
+
+class CodecError(ValueError):
+    """Ошибка кодирования или декодирования двоичного определения."""
+    pass
+
+
+def write_varint(out: bytearray, value: int) -> None:
+    """Записывает неотрицательное целое число в формате LEB128."""
+    if value < 0:
+        raise CodecError(f"Cannot encode negative value {value}")
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def write_bytes(out: bytearray, data: bytes) -> None:
+    """Записывает строку байтов с длиной."""
+    write_varint(out, len(data))
+    out += data
+
+
+class ByteReader:
+    """Последовательное чтение буфера."""
+
+    def __init__(self, data: bytes, pos: int = 0):
+        self.data = data
+        self.pos = pos
+
+    def varint(self) -> int:
+        data = self.data
+        result = 0
+        shift = 0
+        while True:
+            if self.pos >= len(data):
+                raise CodecError("Unexpected end of data")
+            byte = data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def bytes(self) -> bytes:
+        length = self.varint()
+        end = self.pos + length
+        if end > len(self.data):
+            raise CodecError("Unexpected end of data")
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+
+def _object_parts(function: PrimitiveFunction) -> Tuple[Dict[str, Any], List[PrimitiveFunction]]:
+    """Параметры и дочерние узлы объекта функции (ссылки не раскрываются)."""
+    if isinstance(function, LazyFunction):
+        function = function.resolve()
+    if isinstance(function, Composition):
+        return {"type": "composition"}, [function.f] + list(function.g_list)
+    if isinstance(function, PrimitiveRecursion):
+        return {"type": "primitive_recursion"}, [function.g, function.h]
+    return function.to_dict(), []
+
+
+def _definition_parts(data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """Параметры и дочерние узлы словаря определения."""
+    return definition_params(data), definition_children(data)
+
+
+def _write_leaf(out: bytearray, params: Dict[str, Any]) -> None:
+    """Записывает лист дерева."""
+    func_type = params.get("type")
+    if func_type == "zero":
+        write_varint(out, OP_ZERO)
+    elif func_type == "successor":
+        write_varint(out, OP_SUCCESSOR)
+    elif func_type == "constant":
+        write_varint(out, OP_CONSTANT)
+        write_varint(out, params["value"])
+        write_varint(out, params.get("arity", 0))
+    elif func_type == "projection":
+        write_varint(out, OP_PROJECTION)
+        write_varint(out, params["n"])
+        write_varint(out, params["i"])
+    elif func_type == "reference":
+        name, ref_hash, arity = params.get("name"), params.get("hash"), params.get("arity")
+        flags = ((_REF_NAME if name is not None else 0) | (_REF_HASH if ref_hash is not None else 0)
+                 | (_REF_ARITY if arity is not None else 0))
+        write_varint(out, OP_REFERENCE)
+        write_varint(out, flags)
+        if name is not None:
+            write_bytes(out, name.encode("utf-8"))
+        if ref_hash is not None:
+            write_bytes(out, ref_hash.encode("ascii"))
+        if arity is not None:
+            write_varint(out, arity)
+    else:
+        raise CodecError(f"Unknown function type: {func_type}")
+
+
+def _encode(root: Any, parts: Callable[[Any], Tuple[Dict[str, Any], List[Any]]]) -> bytes:
+    """Кодирует дерево (словари или объекты) в двоичный формат."""
+    # Первый проход (снизу вверх): одинаковые поддеревья получают общий класс
+    node_parts: Dict[int, Tuple[Dict[str, Any], List[Any]]] = {}
+    node_class: Dict[int, int] = {}
+    classes: Dict[tuple, int] = {}
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in node_class:
+            continue
+        if id(node) not in node_parts:
+            node_parts[id(node)] = parts(node)
+        params, children = node_parts[id(node)]
+        if children and not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+            continue
+        try:
+            own = tuple(sorted(params.items()))
+        except TypeError:
+            own = (id(node),)
+        key = (own, tuple(node_class[id(child)] for child in children))
+        node_class[id(node)] = classes.setdefault(key, len(classes))
+
+    # Второй проход: запись в прямом порядке с обратными ссылками
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    written: Dict[int, int] = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        params, children = node_parts[id(node)]
+        if not children:
+            _write_leaf(out, params)
+            continue
+        node_cls = node_class[id(node)]
+        if node_cls in written:
+            write_varint(out, OP_BACKREF)
+            write_varint(out, written[node_cls])
+            continue
+        written[node_cls] = len(written)
+        if params["type"] == "composition":
+            write_varint(out, OP_COMPOSITION)
+            write_varint(out, len(children) - 1)
+        else:
+            write_varint(out, OP_RECURSION)
+        stack.extend(reversed(children))
+    return bytes(out)
+
+
+def _read_header(data: bytes) -> ByteReader:
+    """Проверяет заголовок и возвращает читатель тела."""
+    if data[:len(MAGIC)] != MAGIC or len(data) <= len(MAGIC):
+        raise CodecError("Not a binary PRF definition")
+    version = data[len(MAGIC)]
+    if version != VERSION:
+        raise CodecError(f"Unsupported binary format version {version}")
+    return ByteReader(data, len(MAGIC) + 1)
+
+
+def _decode(data: bytes, leaf: Callable[[Dict[str, Any]], Any],
+            build: Callable[[Dict[str, Any], List[Any]], Any]) -> Any:
+    """Декодирует двоичный формат, собирая узлы функциями leaf и build."""
+    reader = _read_header(data)
+    table: List[Any] = []
+    # Кадр: [параметры, сколько дочерних узлов нужно, дочерние узлы, номер]
+    stack: List[list] = []
+    result = None
+    done = False
+    while not done:
+        op = reader.varint()
+        if op == OP_COMPOSITION:
+            stack.append([{"type": "composition"}, reader.varint() + 1, [], len(table)])
+            table.append(None)
+            continue
+        if op == OP_RECURSION:
+            stack.append([{"type": "primitive_recursion"}, 2, [], len(table)])
+            table.append(None)
+            continue
+        if op == OP_BACKREF:
+            index = reader.varint()
+            if index >= len(table) or table[index] is None:
+                raise CodecError(f"Invalid back-reference {index}")
+            value = table[index]
+        elif op == OP_ZERO:
+            value = leaf({"type": "zero"})
+        elif op == OP_SUCCESSOR:
+            value = leaf({"type": "successor"})
+        elif op == OP_CONSTANT:
+            constant = reader.varint()
+            value = leaf({"type": "constant", "value": constant, "arity": reader.varint()})
+        elif op == OP_PROJECTION:
+            n = reader.varint()
+            value = leaf({"type": "projection", "n": n, "i": reader.varint()})
+        elif op == OP_REFERENCE:
+            flags = reader.varint()
+            params: Dict[str, Any] = {"type": "reference"}
+            if flags & _REF_NAME:
+                params["name"] = reader.bytes().decode("utf-8")
+            if flags & _REF_HASH:
+                params["hash"] = reader.bytes().decode("ascii")
+            if flags & _REF_ARITY:
+                params["arity"] = reader.varint()
+            value = leaf(params)
+        else:
+            raise CodecError(f"Unknown opcode {op}")
+
+        # Поднимаемся по стеку, пока узлы получают все дочерние узлы
+        while True:
+            if not stack:
+                result = value
+                done = True
+                break
+            frame = stack[-1]
+            frame[2].append(value)
+            if len(frame[2]) < frame[1]:
+                break
+            stack.pop()
+            value = build(frame[0], frame[2])
+            table[frame[3]] = value
+
+    if reader.pos != len(data):
+        raise CodecError("Trailing data after definition")
+    return result
+
+
+def _build_function(params: Dict[str, Any], children: List[PrimitiveFunction]) -> PrimitiveFunction:
+    """Собирает объект составной функции."""
+    if params["type"] == "composition":
+        return Composition(children[0], children[1:])
+    return PrimitiveRecursion(children[0], children[1])
+
+
+def encode_definition(data: Dict[str, Any]) -> bytes:
+    """
+    Кодирует определение функции (словарь) в двоичный формат.
+
+    Args:
+        data: Определение функции
+
+    Returns:
+        Двоичное представление
+    """
+    return _encode(data, _definition_parts)
+
+
+def decode_definition(data: bytes) -> Dict[str, Any]:
+    """
+    Декодирует двоичное представление в определение (словарь).
+
+    Общие поддеревья возвращаются одним и тем же словарем.
+
+    Args:
+        data: Двоичное представление
+
+    Returns:
+        Определение функции
+    """
+    return _decode(data, dict, definition_from_parts)
+
+
+def encode_function(function: PrimitiveFunction) -> bytes:
+    """
+    Кодирует функцию в двоичный формат (ссылки записываются как ссылки).
+
+    Args:
+        function: Функция
+
+    Returns:
+        Двоичное представление
+    """
+    return _encode(function, _object_parts)
+
+
+def decode_function(data: bytes) -> PrimitiveFunction:
+    """
+    Декодирует двоичное представление в функцию.
+
+    Общие поддеревья становятся общими объектами.
+
+    Args:
+        data: Двоичное представление
+
+    Returns:
+        Функция
+    """
+    return _decode(data, function_from_dict, _build_function)
+
+
+def is_binary_definition(data: Any) -> bool:
+    """Проверяет, является ли значение двоичным определением."""
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(MAGIC)]) == MAGIC
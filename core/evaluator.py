@@ -5,8 +5,14 @@
 """
 
 import sys
-from typing import List, Dict, Any, Optional
-from core.prf import PrimitiveFunction
+import time
+import threading
+import tracemalloc
+from typing import List, Dict, Any, Optional, Callable
+from core.prf import (
+    PrimitiveFunction, Zero, Successor, Constant, Projection, Composition, PrimitiveRecursion,
+    Reference, LazyFunction, function_node_hashes, function_hash
+)
 
 # Увеличиваем лимит рекурсии Python для вычисления больших факториалов
 # Это необходимо, так как примитивная рекурсия создает очень глубокую вложенность
@@ -15,6 +21,45 @@ if sys.getrecursionlimit() < 300000:
     sys.setrecursionlimit(300000)
 
 
+# События, на которые можно подписаться через Evaluator.add_hook
+HOOK_EVENTS = ("enter_node", "exit_node", "recursion_iteration", "cache_hit", "limit_exceeded")
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Вычисление прервано из-за превышения бюджета памяти."""
+    pass
+
+
+class EvaluationCancelled(Exception):
+    """Вычисление отменено через токен отмены."""
+    pass
+
+
+class EvaluationTimeout(EvaluationCancelled):
+    """Вычисление прервано по истечении срока."""
+    pass
+
+
+class CancellationToken:
+    """
+    Токен кооперативной отмены вычисления.
+    
+    Может передаваться между потоками: cancel() вызывается из GUI или
+    веб-обработчика, а вычислитель проверяет токен периодически.
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+    
+    def cancel(self) -> None:
+        """Запрашивает отмену вычисления."""
+        self._event.set()
+    
+    def is_cancelled(self) -> bool:
+        """Проверяет, запрошена ли отмена."""
+        return self._event.is_set()
+
+
 class EvaluationStep:
     """Представляет один шаг вычисления."""
     
@@ -34,20 +79,98 @@ class EvaluationStep:
 class Evaluator:
     """Вычислитель примитивно-рекурсивных функций с пошаговым отслеживанием."""
     
-    def __init__(self, max_depth: int = 300000, max_steps: int = 100000000):
+    def __init__(self, max_depth: int = 300000, max_steps: int = 100000000,
+                 slow_log: Optional[Any] = None,
+                 slow_steps_threshold: Optional[int] = None,
+                 slow_time_threshold: Optional[float] = None,
+                 track_memory: bool = False,
+                 memory_budget: Optional[int] = None,
+                 memory_check_interval: int = 1000,
+                 check_interval: int = 10000,
+                 checkpoint_store: Optional[Any] = None,
+                 checkpoint_interval: int = 100000,
+                 result_cache: Optional[Any] = None,
+                 value_tables: Optional[Any] = None):
         """
         Args:
-            max_depth: Максимальная глубина рекурсии
+            max_depth: Максимальная глубина вложенности узлов. Без отслеживания
+                шагов итерации примитивной рекурсии выполняются циклом и
+                глубину не увеличивают (их число ограничивает max_steps); при
+                отслеживании шагов рекурсия спускается от x к 0, и каждый
+                уровень увеличивает глубину
             max_steps: Максимальное количество шагов
+            slow_log: Журнал медленных вычислений (например, DatabaseManager),
+                предоставляющий метод save_slow_evaluation
+            slow_steps_threshold: Порог по количеству шагов для журнала
+            slow_time_threshold: Порог по времени (в секундах) для журнала
+            track_memory: Если True, учитывает память через tracemalloc
+            memory_budget: Жесткий лимит памяти в байтах (включает учет памяти)
+            memory_check_interval: Через сколько шагов проверять бюджет памяти
+            check_interval: Через сколько шагов проверять отмену, срок
+                и сообщать о прогрессе
+            checkpoint_store: Хранилище контрольных точек (например, DatabaseManager),
+                предоставляющее save_checkpoint, load_checkpoint и delete_checkpoints
+            checkpoint_interval: Через сколько итераций рекурсии сохранять
+                контрольную точку
+            result_cache: Кэш результатов (например, DatabaseManager), предоставляющий
+                get_cached_result и save_cached_result; ключ - структурный
+                хэш функции и аргументы
+            value_tables: Предвычисленные таблицы значений (например,
+                core.tables.ValueTableSet), предоставляющие lookup(хэш функции,
+                аргументы); вне области таблиц функция вычисляется
         """
         self.max_depth = max_depth
         self.max_steps = max_steps
+        self.slow_log = slow_log
+        self.slow_steps_threshold = slow_steps_threshold
+        self.slow_time_threshold = slow_time_threshold
+        self.track_memory = track_memory or memory_budget is not None
+        self.memory_budget = memory_budget
+        self.memory_check_interval = memory_check_interval
+        self.check_interval = check_interval
+        self._cancel_token: Optional[CancellationToken] = None
+        self._deadline: Optional[float] = None
+        self._progress_callback: Optional[Callable[[int, int, Optional[float]], None]] = None
+        self._current_depth = 0
+        self._outer_total: Optional[int] = None
+        self._outer_done = 0
+        self.checkpoint_store = checkpoint_store
+        self.checkpoint_interval = checkpoint_interval
+        self._checkpointing = False
+        self._checkpoint_key: Optional[tuple] = None
+        self._node_hashes: Dict[int, str] = {}
+        self._active_frames: List[list] = []
+        self._resume_frames: Dict[tuple, tuple] = {}
+        self._iterations = 0
+        self.resumed_from: Optional[int] = None
+        self.result_cache = result_cache
+        self.value_tables = value_tables
+        self.cache_hit = False
+        self._hash_memo: Optional[tuple] = None
+        self.peak_memory = 0
+        self.trace_memory = 0
+        self.largest_int = 0
+        self._memory_baseline = 0
+        self._next_check = 0
+        self._eval = self._evaluate_simple
+        self._eval_base = self._evaluate_simple
+        self._iterate = self._iterate_plain
+        self._track = self._track_node
+        self._hooks: Dict[str, List[Callable]] = {event: [] for event in HOOK_EVENTS}
         self.step_counter = 0
+        self.peak_depth = 0
+        self.elapsed = 0.0
+        self.engine = "simple"
         self.steps: List[EvaluationStep] = []
         self.warnings: List[str] = []
     
     def evaluate(self, function: PrimitiveFunction, args: List[int], 
-                 track_steps: bool = False) -> int:
+                 track_steps: bool = False,
+                 function_id: Optional[int] = None,
+                 cancel_token: Optional[CancellationToken] = None,
+                 deadline: Optional[float] = None,
+                 progress_callback: Optional[Callable[[int, int, Optional[float]], None]] = None
+                 ) -> int:
         """
         Вычисляет значение функции на заданных аргументах.
         
@@ -55,6 +178,12 @@ class Evaluator:
             function: Функция для вычисления
             args: Аргументы функции
             track_steps: Если True, отслеживает шаги вычисления
+            function_id: ID функции в базе данных (для журнала медленных вычислений)
+            cancel_token: Токен отмены, проверяемый каждые check_interval шагов
+            deadline: Момент time.monotonic(), после которого вычисление прерывается
+            progress_callback: Вызывается каждые check_interval шагов с аргументами
+                (выполнено шагов, текущая глубина, доля пройденной внешней
+                рекурсии или None)
             
         Returns:
             Результат вычисления
@@ -62,6 +191,13 @@ class Evaluator:
         Raises:
             ValueError: Если аргументы некорректны
             RecursionError: Если превышена максимальная глубина рекурсии
+            EvaluationCancelled: Если вычисление отменено через токен
+            EvaluationTimeout: Если истек срок вычисления
+        
+        Если задано хранилище контрольных точек, состояние активных рекурсий
+        периодически сохраняется, а повторный запуск той же функции на тех же
+        аргументах продолжается с последней контрольной точки (только без
+        отслеживания шагов).
         """
         # Проверка арности
         if len(args) != function.arity():
@@ -74,30 +210,360 @@ class Evaluator:
             self.warnings.append("Large arguments detected, computation may be slow")
         
         self.step_counter = 0
+        self.peak_depth = 0
+        self.elapsed = 0.0
+        self.engine = "tracking" if track_steps else "simple"
+        self.cache_hit = False
         self.steps = []
         self.warnings = []
+        self.peak_memory = 0
+        self.trace_memory = 0
+        self.largest_int = max((abs(a) for a in args), default=0)
+        self._cancel_token = cancel_token
+        self._deadline = deadline
+        self._progress_callback = progress_callback
+        self._current_depth = 0
+        self._outer_total = None
+        self._outer_done = 0
+        self._configure_dispatch()
+        # Контрольные точки готовятся только если результата нет в кэше
+        self._checkpointing = False
+        
+        started_tracing = False
+        if self.track_memory:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._memory_baseline = tracemalloc.get_traced_memory()[0]
+        self._schedule_next_check()
         
-        if track_steps:
-            result = self._evaluate_with_tracking(function, args, depth=0)
+        error: Optional[str] = None
+        start = time.perf_counter()
+        use_cache = self.result_cache is not None and not track_steps
+        try:
+            cached = None
+            if self.value_tables is not None and not track_steps:
+                cached = self._lookup_table_value(function, args)
+            if cached is None and use_cache:
+                cached = self._lookup_cached_result(function, args)
+            if cached is not None:
+                result = cached
+            elif track_steps:
+                result = self._evaluate_with_tracking(function, args, depth=0)
+            else:
+                if self.checkpoint_store is not None:
+                    self._checkpointing = True
+                    self._prepare_checkpointing(function, args)
+                result = self._eval(function, args, 0)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, MemoryBudgetExceeded):
+                # Освобождаем трассу, чтобы прерванное вычисление не удерживало память
+                self.steps = []
+            raise
         else:
-            result = self._evaluate_simple(function, args, depth=0)
+            if self._checkpointing:
+                self.checkpoint_store.delete_checkpoints(*self._checkpoint_key)
+            if use_cache and not self.cache_hit:
+                self._store_cached_result(function, args, result)
+        finally:
+            self.elapsed = time.perf_counter() - start
+            if self.track_memory:
+                self._finish_memory_accounting(started_tracing)
+            self._log_if_slow(function_id, args, error)
         
         return result
     
+    def _function_hash(self, function: PrimitiveFunction) -> str:
+        """Возвращает структурный хэш функции, запоминая его для повторных вызовов."""
+        if self._hash_memo is None or self._hash_memo[0] is not function:
+            self._hash_memo = (function, function_hash(function))
+        return self._hash_memo[1]
+    
+    def _lookup_cached_result(self, function: PrimitiveFunction,
+                              args: List[int]) -> Optional[int]:
+        """Ищет результат в кэше; при попадании отмечает вычисление как взятое из кэша."""
+        try:
+            result = self.result_cache.get_cached_result(self._function_hash(function), args)
+        except Exception as e:
+            self.warnings.append(f"Failed to read result cache: {e}")
+            return None
+        if result is not None:
+            self.cache_hit = True
+            self.engine = "cache"
+            self._notify_cache_hit(function, args, result, "result_cache")
+        return result
+    
+    def _lookup_table_value(self, function: PrimitiveFunction,
+                            args: List[int]) -> Optional[int]:
+        """Ищет значение в предвычисленных таблицах; при попадании отмечает вычисление."""
+        try:
+            result = self.value_tables.lookup(self._function_hash(function), args)
+        except Exception as e:
+            self.warnings.append(f"Failed to read value table: {e}")
+            return None
+        if result is not None:
+            self.cache_hit = True
+            self.engine = "table"
+            self._notify_cache_hit(function, args, result, "value_table")
+        return result
+    
+    def _store_cached_result(self, function: PrimitiveFunction, args: List[int],
+                             result: int) -> None:
+        """Сохраняет результат вычисления в кэш."""
+        try:
+            self.result_cache.save_cached_result(self._function_hash(function), args, result)
+        except Exception as e:
+            self.warnings.append(f"Failed to write result cache: {e}")
+    
+    def add_hook(self, event: str, callback: Callable) -> None:
+        """
+        Подписывает обработчик на событие вычисления.
+        
+        Сигнатуры обработчиков:
+            enter_node(function, args, depth)
+            exit_node(function, args, result, depth)
+            recursion_iteration(function, iteration, total, accumulator, depth)
+                (total равен None в режиме отслеживания шагов)
+            cache_hit(function, args, result, source)
+            limit_exceeded(kind, message)
+        
+        Args:
+            event: Имя события из HOOK_EVENTS
+            callback: Обработчик события
+        """
+        if event not in self._hooks:
+            raise ValueError(f"Unknown hook event: {event}")
+        self._hooks[event].append(callback)
+    
+    def remove_hook(self, event: str, callback: Callable) -> None:
+        """Отписывает обработчик от события."""
+        if event in self._hooks and callback in self._hooks[event]:
+            self._hooks[event].remove(callback)
+    
+    def add_sink(self, sink: Any) -> None:
+        """
+        Подписывает приемник событий: каждый его метод on_<событие>
+        регистрируется как обработчик соответствующего события.
+        """
+        for event in HOOK_EVENTS:
+            callback = getattr(sink, f"on_{event}", None)
+            if callback is not None:
+                self.add_hook(event, callback)
+    
+    def remove_sink(self, sink: Any) -> None:
+        """Отписывает все обработчики приемника событий."""
+        for event in HOOK_EVENTS:
+            callback = getattr(sink, f"on_{event}", None)
+            if callback is not None:
+                self.remove_hook(event, callback)
+    
+    def _configure_dispatch(self) -> None:
+        """
+        Выбирает реализацию шага вычисления перед запуском.
+        
+        Обертки для учета памяти и обработчиков событий подключаются только
+        если они нужны, поэтому без подписчиков шаг не делает лишних проверок.
+        """
+        self._eval_base = self._evaluate_measured if self.track_memory else self._evaluate_simple
+        hooked = bool(self._hooks["enter_node"] or self._hooks["exit_node"])
+        self._eval = self._evaluate_hooked if hooked else self._eval_base
+        self._iterate = (self._iterate_hooked if self._hooks["recursion_iteration"]
+                         else self._iterate_plain)
+        self._track = (self._track_hooked if hooked or self._hooks["recursion_iteration"]
+                       else self._track_node)
+    
+    def _raise_limit(self, kind: str, error: Exception) -> None:
+        """Сообщает подписчикам о превышении лимита и прерывает вычисление."""
+        for callback in self._hooks["limit_exceeded"]:
+            callback(kind, str(error))
+        raise error
+    
+    def _notify_cache_hit(self, function: PrimitiveFunction, args: List[int],
+                          result: int, source: str) -> None:
+        """Сообщает подписчикам о результате, взятом из кэша."""
+        for callback in self._hooks["cache_hit"]:
+            callback(function, args, result, source)
+    
+    def _schedule_next_check(self) -> None:
+        """Назначает шаг следующей периодической проверки лимитов."""
+        next_check = self.max_steps + 1
+        if self.memory_budget is not None:
+            next_check = min(next_check, self.step_counter + self.memory_check_interval)
+        if (self._cancel_token is not None or self._deadline is not None
+                or self._progress_callback is not None):
+            next_check = min(next_check, self.step_counter + self.check_interval)
+        self._next_check = next_check
+    
+    def _prepare_checkpointing(self, function: PrimitiveFunction, args: List[int]) -> None:
+        """Загружает последнюю контрольную точку вычисления, если она есть."""
+        # Хэши узлов рекурсии вычисляются при первом входе в них (см. _enter_frame),
+        # поэтому ленивые поддеревья строятся только по мере вычисления
+        self._node_hashes = {}
+        self._checkpoint_key = (self._function_hash(function), list(args))
+        self._active_frames = []
+        self._resume_frames = {}
+        self._iterations = 0
+        self.resumed_from = None
+        
+        state = self.checkpoint_store.load_checkpoint(*self._checkpoint_key)
+        if not state:
+            return
+        for frame in state["frames"]:
+            key = (frame["node"], tuple(frame["args"]))
+            self._resume_frames[key] = (frame["i"], int(frame["acc"], 16))
+        self.step_counter = state.get("steps", 0)
+        self.resumed_from = self.step_counter
+        self._schedule_next_check()
+    
+    def _enter_frame(self, rec: PrimitiveRecursion, args: List[int]) -> list:
+        """
+        Регистрирует активную рекурсию для контрольных точек.
+        
+        Returns:
+            Кадр [хэш узла, аргументы, выполнено итераций, аккумулятор];
+            для возобновленной рекурсии заполнен данными контрольной точки
+        """
+        node_hash = self._node_hashes.get(id(rec))
+        if node_hash is None:
+            # Заодно запоминаются хэши узлов поддерева, кроме непостроенных ленивых
+            self._node_hashes.update(function_node_hashes(rec))
+            node_hash = self._node_hashes[id(rec)]
+        resumed = self._resume_frames.pop((node_hash, tuple(args)), None)
+        frame = [node_hash, list(args), 0, None]
+        if resumed is not None:
+            frame[2], frame[3] = resumed
+        self._active_frames.append(frame)
+        return frame
+    
+    def _checkpoint_tick(self) -> None:
+        """Учитывает итерацию рекурсии и периодически сохраняет контрольную точку."""
+        self._iterations += 1
+        if self._iterations % self.checkpoint_interval == 0:
+            state = {
+                "frames": [
+                    {"node": node, "args": frame_args, "i": i, "acc": hex(acc)}
+                    for node, frame_args, i, acc in self._active_frames
+                    if acc is not None  # g этой рекурсии еще вычисляется
+                ],
+                "steps": self.step_counter
+            }
+            self.checkpoint_store.save_checkpoint(*self._checkpoint_key, state)
+    
+    def get_progress(self) -> Optional[float]:
+        """
+        Возвращает долю пройденных итераций внешней рекурсии.
+        
+        Returns:
+            Число от 0 до 1 или None, если внешняя рекурсия не выполняется
+        """
+        if not self._outer_total:
+            return None
+        return self._outer_done / self._outer_total
+    
+    def _periodic_check(self) -> None:
+        """
+        Проверяет лимиты вычисления.
+        
+        Вызывается не на каждом шаге, а только когда счетчик шагов достигает
+        назначенной отметки, поэтому не замедляет основной цикл.
+        """
+        if self.step_counter > self.max_steps:
+            self._raise_limit("steps", RecursionError(f"Maximum steps {self.max_steps} exceeded"))
+        
+        if self.memory_budget is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            used = max(current, peak) - self._memory_baseline
+            if used > self.memory_budget:
+                self._raise_limit("memory", MemoryBudgetExceeded(
+                    f"Memory budget {self.memory_budget} bytes exceeded ({used} bytes used)"
+                ))
+        
+        if self._cancel_token is not None and self._cancel_token.is_cancelled():
+            self._raise_limit("cancelled", EvaluationCancelled("Evaluation cancelled"))
+        
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self._raise_limit("deadline", EvaluationTimeout("Evaluation deadline exceeded"))
+        
+        if self._progress_callback is not None:
+            self._progress_callback(self.step_counter, self._current_depth, self.get_progress())
+        
+        self._schedule_next_check()
+    
+    def _finish_memory_accounting(self, stop_tracing: bool) -> None:
+        """Фиксирует статистику памяти по завершении вычисления."""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_memory = max(peak - self._memory_baseline, 0)
+        self.trace_memory = max(current - self._memory_baseline, 0)
+        if self.steps:
+            self.largest_int = max(self.largest_int, max(abs(s.result) for s in self.steps))
+        if stop_tracing:
+            tracemalloc.stop()
+    
+    def is_slow(self) -> bool:
+        """Проверяет, превысило ли последнее вычисление пороги журнала."""
+        if self.slow_steps_threshold is not None and self.step_counter > self.slow_steps_threshold:
+            return True
+        if self.slow_time_threshold is not None and self.elapsed > self.slow_time_threshold:
+            return True
+        return False
+    
+    def _log_if_slow(self, function_id: Optional[int], args: List[int],
+                     error: Optional[str]) -> None:
+        """Записывает последнее вычисление в журнал, если оно превысило пороги."""
+        if self.slow_log is None or not self.is_slow():
+            return
+        try:
+            memory = {}
+            if self.track_memory:
+                memory = {
+                    "peak_memory": self.peak_memory,
+                    "trace_memory": self.trace_memory,
+                    "largest_int_bits": self.largest_int.bit_length()
+                }
+            self.slow_log.save_slow_evaluation(
+                function_id, args, self.step_counter, self.peak_depth,
+                self.elapsed, self.engine, error, **memory
+            )
+        except Exception as e:
+            self.warnings.append(f"Failed to write slow log: {e}")
+    
+    def _evaluate_hooked(self, function: PrimitiveFunction, args: List[int],
+                         depth: int) -> int:
+        """Вычисление с вызовом обработчиков входа в узел и выхода из него."""
+        for callback in self._hooks["enter_node"]:
+            callback(function, args, depth)
+        result = self._eval_base(function, args, depth)
+        for callback in self._hooks["exit_node"]:
+            callback(function, args, result, depth)
+        return result
+    
+    def _evaluate_measured(self, function: PrimitiveFunction, args: List[int],
+                           depth: int) -> int:
+        """Простое вычисление с учетом наибольшего промежуточного значения."""
+        result = self._evaluate_simple(function, args, depth)
+        if result > self.largest_int:
+            self.largest_int = result
+        return result
+    
     def _evaluate_simple(self, function: PrimitiveFunction, args: List[int], 
                         depth: int) -> int:
         """Простое вычисление без отслеживания шагов."""
         if depth > self.max_depth:
-            raise RecursionError(f"Maximum recursion depth {self.max_depth} exceeded")
+            self._raise_limit(
+                "depth", RecursionError(f"Maximum recursion depth {self.max_depth} exceeded")
+            )
         
-        if self.step_counter > self.max_steps:
-            raise RecursionError(f"Maximum steps {self.max_steps} exceeded")
+        if self.step_counter >= self._next_check:
+            self._current_depth = depth
+            self._periodic_check()
         
         self.step_counter += 1
+        if depth > self.peak_depth:
+            self.peak_depth = depth
         
         # Прямое вычисление в зависимости от типа функции
-        from core.prf import Zero, Successor, Constant, Projection, Composition, PrimitiveRecursion
-        
         if isinstance(function, (Zero, Successor, Constant, Projection)):
             # Базовые функции вычисляются напрямую
             return function.evaluate(args)
@@ -107,45 +573,141 @@ class Evaluator:
             comp = function
             g_results = []
             for g in comp.g_list:
-                g_result = self._evaluate_simple(g, args, depth + 1)
+                g_result = self._eval(g, args, depth + 1)
                 g_results.append(g_result)
-            return self._evaluate_simple(comp.f, g_results, depth + 1)
+            return self._eval(comp.f, g_results, depth + 1)
         
         elif isinstance(function, PrimitiveRecursion):
-            # Примитивная рекурсия
-            rec = function
-            x = args[0]
-            y_args = args[1:]
-            
-            if x == 0:
-                return self._evaluate_simple(rec.g, y_args, depth + 1)
-            else:
-                # Проверяем глубину перед рекурсивным вызовом
-                if depth + 1 > self.max_depth:
-                    raise RecursionError(f"Maximum recursion depth {self.max_depth} exceeded")
-                prev_result = self._evaluate_simple(rec, [x - 1] + y_args, depth + 1)
-                h_args = [x - 1, prev_result] + y_args
-                return self._evaluate_simple(rec.h, h_args, depth + 1)
+            return self._evaluate_recursion(function, args, depth)
+        
+        elif isinstance(function, (Reference, LazyFunction)):
+            # Ссылка и ленивый узел не являются отдельным шагом: вычисляется целевая функция
+            self.step_counter -= 1
+            return self._eval(function.resolve(), args, depth)
         
         else:
             # Общий случай
             return function.evaluate(args)
     
+    def _evaluate_recursion(self, rec: PrimitiveRecursion, args: List[int], depth: int) -> int:
+        """
+        Вычисляет примитивную рекурсию итеративно снизу вверх (без отслеживания шагов).
+        
+        f(0, y) = g(y), f(i+1, y) = h(i, f(i, y), y). В отличие от спуска
+        от x к 0 (как в режиме отслеживания), цикл не расходует стек Python
+        на каждую итерацию, поэтому большие x не упираются в лимит рекурсии
+        интерпретатора, а вычисление заметно быстрее. Количество шагов то
+        же: каждая итерация считается шагом, как вызов f(i+1, y).
+        
+        Итерации выполняются на глубине узла рекурсии (g и h - на depth + 1),
+        поэтому max_depth ограничивает вложенность узлов, а количество
+        итераций ограничено только max_steps. Номер итерации и аккумулятор
+        известны на каждом шаге, на них опираются оценка прогресса,
+        контрольные точки и событие recursion_iteration.
+        """
+        x = args[0]
+        y_args = args[1:]
+        # Самая внешняя активная рекурсия задает оценку прогресса
+        outer = self._outer_total is None
+        if outer:
+            self._outer_total = x
+            self._outer_done = 0
+        
+        frame = self._enter_frame(rec, args) if self._checkpointing else None
+        if frame is not None and frame[3] is not None:
+            # Возобновление с контрольной точки
+            start, acc = frame[2], frame[3]
+            if outer:
+                self._outer_done = start
+        else:
+            start, acc = 0, self._eval(rec.g, y_args, depth + 1)
+            if frame is not None:
+                frame[3] = acc
+        acc = self._iterate(rec, start, x, acc, y_args, depth, outer, frame)
+        if outer:
+            self._outer_total = None
+        if frame is not None:
+            self._active_frames.pop()
+        return acc
+    
+    def _iterate_plain(self, rec: PrimitiveRecursion, start: int, x: int, acc: int,
+                       y_args: List[int], depth: int, outer: bool,
+                       frame: Optional[list]) -> int:
+        """Итерации примитивной рекурсии с start до x (без обработчиков итераций)."""
+        for i in range(start, x):
+            # Каждая итерация считается шагом, как вызов f(i+1, y)
+            if self.step_counter >= self._next_check:
+                self._current_depth = depth
+                self._periodic_check()
+            self.step_counter += 1
+            acc = self._eval(rec.h, [i, acc] + y_args, depth + 1)
+            if outer:
+                self._outer_done = i + 1
+            if frame is not None:
+                frame[2], frame[3] = i + 1, acc
+                self._checkpoint_tick()
+        return acc
+    
+    def _iterate_hooked(self, rec: PrimitiveRecursion, start: int, x: int, acc: int,
+                        y_args: List[int], depth: int, outer: bool,
+                        frame: Optional[list]) -> int:
+        """Итерации примитивной рекурсии с вызовом обработчиков recursion_iteration."""
+        iteration_hooks = self._hooks["recursion_iteration"]
+        for i in range(start, x):
+            if self.step_counter >= self._next_check:
+                self._current_depth = depth
+                self._periodic_check()
+            self.step_counter += 1
+            acc = self._eval(rec.h, [i, acc] + y_args, depth + 1)
+            if outer:
+                self._outer_done = i + 1
+            if frame is not None:
+                frame[2], frame[3] = i + 1, acc
+                self._checkpoint_tick()
+            for callback in iteration_hooks:
+                callback(rec, i + 1, x, acc, depth)
+        return acc
+    
     def _evaluate_with_tracking(self, function: PrimitiveFunction, args: List[int], 
                                 depth: int) -> int:
         """Вычисление с отслеживанием шагов."""
         if depth > self.max_depth:
-            raise RecursionError(f"Maximum recursion depth {self.max_depth} exceeded")
+            self._raise_limit(
+                "depth", RecursionError(f"Maximum recursion depth {self.max_depth} exceeded")
+            )
         
-        if self.step_counter > self.max_steps:
-            raise RecursionError(f"Maximum steps {self.max_steps} exceeded")
+        if self.step_counter >= self._next_check:
+            self._current_depth = depth
+            self._periodic_check()
         
         self.step_counter += 1
         step_num = self.step_counter
+        if depth > self.peak_depth:
+            self.peak_depth = depth
         
-        # Вычисляем результат
-        from core.prf import Zero, Successor, Constant, Projection, Composition, PrimitiveRecursion
-        
+        return self._track(function, args, depth, step_num)
+    
+    def _track_hooked(self, function: PrimitiveFunction, args: List[int],
+                      depth: int, step_num: int) -> int:
+        """Шаг отслеживания с вызовом обработчиков событий узла."""
+        for callback in self._hooks["enter_node"]:
+            callback(function, args, depth)
+        result = self._track_node(function, args, depth, step_num)
+        node = function
+        while isinstance(node, (Reference, LazyFunction)):
+            node = node.resolve()
+        if isinstance(node, PrimitiveRecursion) and args[0] > 0:
+            # В режиме отслеживания рекурсия спускается от x к 0,
+            # поэтому общее число итераций заранее неизвестно
+            for callback in self._hooks["recursion_iteration"]:
+                callback(node, args[0], None, result, depth)
+        for callback in self._hooks["exit_node"]:
+            callback(function, args, result, depth)
+        return result
+    
+    def _track_node(self, function: PrimitiveFunction, args: List[int],
+                    depth: int, step_num: int) -> int:
+        """Вычисляет один узел в режиме отслеживания шагов."""
         if isinstance(function, (Zero, Successor, Constant, Projection)):
             result = function.evaluate(args)
             step = EvaluationStep(function, args, result, depth, step_num)
@@ -184,6 +746,10 @@ class Evaluator:
             self.steps.append(step)
             return result
         
+        elif isinstance(function, (Reference, LazyFunction)):
+            # Шаг ссылки или ленивого узла - это шаг целевой функции
+            return self._track_node(function.resolve(), args, depth, step_num)
+        
         else:
             result = function.evaluate(args)
             step = EvaluationStep(function, args, result, depth, step_num)
@@ -200,9 +766,17 @@ class Evaluator:
     
     def get_statistics(self) -> Dict[str, Any]:
         """Возвращает статистику вычисления."""
-        return {
+        stats = {
             "total_steps": self.step_counter,
-            "max_depth": max((s.depth for s in self.steps), default=0),
+            "max_depth": self.peak_depth,
+            "elapsed": self.elapsed,
+            "engine": self.engine,
+            "cache_hit": self.cache_hit,
             "warnings": len(self.warnings)
         }
+        if self.track_memory:
+            stats["peak_memory"] = self.peak_memory
+            stats["trace_memory"] = self.trace_memory
+            stats["largest_int_bits"] = self.largest_int.bit_length()
+        return stats
 
@@ -0,0 +1,176 @@
+"""
+Канонический хэш и поведенческий отпечаток функций для поиска дубликатов.
+
+Канонический хэш - структурный хэш определения после упрощений, не
+меняющих функцию:
+    Z                                    -> C_0 арности 1
+    Comp(P^n_i, g_1, ..., g_n)           -> g_i
+    Comp(f, P^n_1, ..., P^n_n)           -> f          (f арности n)
+    Comp(C_c арности n, g_1, ..., g_n)   -> C_c арности g_1
+Связанные ссылки раскрываются, поэтому функция со ссылками и функция со
+встроенными копиями получают один хэш.
+
+Поведенческий отпечаток - хэш значений функции на фиксированном наборе
+проб с ограничением шагов: функции с одинаковым отпечатком совпадают на
+всех пробах (вероятные дубликаты), с одинаковым префиксом - на первых
+PREFIX_PROBES пробах с малыми аргументами (близкие функции). Если проба не
+вычислена в пределах ограничения, хэш, в который она входит, не
+вычисляется: совпадение на вычисленных пробах ничего не говорит о
+совпадении функций.
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.prf import (
+    PrimitiveFunction, node_hash, function_children, function_params
+)
+from core.evaluator import Evaluator
+
+
+# Количество проб и сколько первых проб входит в префикс отпечатка
+PROBE_COUNT = 16
+PREFIX_PROBES = 4
+# Аргументы псевдослучайных проб берутся из 0..PROBE_MAX-1
+PROBE_MAX = 6
+# Ограничение шагов на одну пробу
+PROBE_STEPS = 5000
+
+# Значение пробы, не вычисленной в пределах ограничения
+UNKNOWN = "?"
+
+
+def _canonical_leaf(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Приводит параметры листа к канонической форме."""
+    if params.get("type") == "zero":
+        return {"type": "constant", "value": 0, "arity": 1}
+    return params
+
+
+def canonical_hash(function: PrimitiveFunction) -> str:
+    """
+    Вычисляет канонический хэш функции без рекурсии.
+
+    Args:
+        function: Функция (связанные ссылки раскрываются)
+
+    Returns:
+        Шестнадцатеричная строка SHA-256
+    """
+    # id(узел) -> (хэш, параметры канонического листа или None)
+    canon: Dict[int, Tuple[str, Optional[Dict[str, Any]]]] = {}
+    stack = [(function, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in canon:
+            continue
+        children = function_children(node)
+        if children and not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+            continue
+        if not children:
+            leaf = _canonical_leaf(function_params(node))
+            canon[id(node)] = (node_hash(leaf, []), leaf)
+            continue
+        params = function_params(node)
+        child_canon = [canon[id(child)] for child in children]
+        canon[id(node)] = _canonical_node(params, children, child_canon)
+    return canon[id(function)][0]
+
+
+def _canonical_node(params: Dict[str, Any], children: List[PrimitiveFunction],
+                    child_canon: List[Tuple[str, Optional[Dict[str, Any]]]]
+                    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Канонический хэш составного узла по каноническим формам дочерних узлов."""
+    if params["type"] == "composition":
+        f_leaf = child_canon[0][1]
+        g_canon = child_canon[1:]
+        k = len(g_canon)
+        if f_leaf is not None and f_leaf["type"] == "projection" and f_leaf["n"] == k:
+            return g_canon[f_leaf["i"] - 1]
+        if f_leaf is not None and f_leaf["type"] == "constant" and f_leaf.get("arity") == k and k:
+            leaf = {"type": "constant", "value": f_leaf["value"], "arity": children[1].arity()}
+            return node_hash(leaf, []), leaf
+        if all(leaf is not None and leaf["type"] == "projection" and leaf["n"] == k
+               and leaf["i"] == position
+               for position, (_, leaf) in enumerate(g_canon, start=1)):
+            if children[0].arity() == k:
+                return child_canon[0]
+    return node_hash(params, [digest for digest, _ in child_canon]), None
+
+
+def probe_arguments(arity: int, count: int = PROBE_COUNT) -> List[List[int]]:
+    """
+    Возвращает фиксированный набор проб для функции данной арности.
+
+    Первые пробы - постоянные векторы 0, 1, 2, ...; остальные -
+    псевдослучайные, детерминированные по арности. Для арности 1 пробы -
+    числа 0..count-1, для арности 0 - единственная пустая проба.
+    """
+    if arity == 0:
+        return [[]]
+    if arity == 1:
+        return [[value] for value in range(count)]
+    probes: List[List[int]] = [[value] * arity for value in range(PREFIX_PROBES)]
+    seen = {tuple(probe) for probe in probes}
+    index = 0
+    while len(probes) < count and index < 4 * count:
+        data = hashlib.shake_128(f"{arity}:{index}".encode("ascii")).digest(arity)
+        probe = [byte % PROBE_MAX for byte in data]
+        index += 1
+        if tuple(probe) not in seen:
+            seen.add(tuple(probe))
+            probes.append(probe)
+    return probes
+
+
+def probe_values(function: PrimitiveFunction, step_budget: int = PROBE_STEPS,
+                 count: int = PROBE_COUNT) -> List[str]:
+    """
+    Вычисляет функцию на пробах.
+
+    Returns:
+        Значения проб в виде строк; UNKNOWN - проба не вычислена в пределах
+        step_budget шагов
+    """
+    evaluator = Evaluator(max_steps=step_budget)
+    values = []
+    for args in probe_arguments(function.arity(), count):
+        try:
+            values.append(str(evaluator.evaluate(function, args)))
+        except (RecursionError, ArithmeticError, MemoryError):
+            values.append(UNKNOWN)
+    return values
+
+
+def _values_digest(arity: int, values: List[str]) -> str:
+    """Хэш арности и значений проб."""
+    payload = json.dumps([arity, values], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("ascii")).hexdigest()
+
+
+def behaviour_fingerprint(function: PrimitiveFunction, step_budget: int = PROBE_STEPS,
+                          count: int = PROBE_COUNT) -> Dict[str, Any]:
+    """
+    Вычисляет поведенческий отпечаток функции.
+
+    Args:
+        function: Функция (ссылки должны быть связаны)
+        step_budget: Ограничение шагов на одну пробу
+        count: Количество проб
+
+    Returns:
+        Словарь с ключами fingerprint (хэш всех проб), prefix (хэш первых
+        PREFIX_PROBES проб) и values (значения проб); хэш равен None, если
+        среди его проб есть невычисленные (UNKNOWN)
+    """
+    arity = function.arity()
+    values = probe_values(function, step_budget, count)
+    prefix = values[:PREFIX_PROBES]
+    return {
+        "fingerprint": None if UNKNOWN in values else _values_digest(arity, values),
+        "prefix": None if UNKNOWN in prefix else _values_digest(arity, prefix),
+        "values": values,
+    }
@@ -0,0 +1,136 @@
+"""
+Приемники событий вычисления для внешней инструментации.
+
+Приемник подключается через Evaluator.add_sink: каждый его метод
+on_<событие> становится обработчиком соответствующего события.
+"""
+
+import json
+import time
+from typing import List, Dict, Any, Optional, TextIO
+
+from core.prf import PrimitiveFunction
+from core.evaluator import HOOK_EVENTS
+
+
+class JsonLinesSink:
+    """Записывает каждое событие вычисления отдельной строкой JSON."""
+
+    def __init__(self, target: Any, events: Optional[List[str]] = None):
+        """
+        Args:
+            target: Путь к файлу или открытый текстовый поток
+            events: Записываемые события (None - все события)
+        """
+        if isinstance(target, str):
+            self.stream: TextIO = open(target, 'a', encoding='utf-8')
+            self._owns_stream = True
+        else:
+            self.stream = target
+            self._owns_stream = False
+
+        # Отключаем методы неинтересных событий, чтобы они не регистрировались
+        if events is not None:
+            for event in HOOK_EVENTS:
+                if event not in events:
+                    setattr(self, f"on_{event}", None)
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        """Записывает одну запись."""
+        record["time"] = time.time()
+        self.stream.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def on_enter_node(self, function: PrimitiveFunction, args: List[int], depth: int) -> None:
+        self._write({"event": "enter_node", "node": type(function).__name__,
+                     "args": args, "depth": depth})
+
+    def on_exit_node(self, function: PrimitiveFunction, args: List[int], result: int,
+                     depth: int) -> None:
+        self._write({"event": "exit_node", "node": type(function).__name__,
+                     "args": args, "result": result, "depth": depth})
+
+    def on_recursion_iteration(self, function: PrimitiveFunction, iteration: int,
+                               total: Optional[int], accumulator: int, depth: int) -> None:
+        self._write({"event": "recursion_iteration", "iteration": iteration,
+                     "total": total, "depth": depth})
+
+    def on_cache_hit(self, function: PrimitiveFunction, args: List[int], result: int,
+                     source: str) -> None:
+        self._write({"event": "cache_hit", "node": type(function).__name__,
+                     "args": args, "source": source})
+
+    def on_limit_exceeded(self, kind: str, message: str) -> None:
+        self._write({"event": "limit_exceeded", "kind": kind, "message": message})
+
+    def close(self) -> None:
+        """Закрывает файл, если приемник открыл его сам."""
+        if self._owns_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class HistogramSink:
+    """
+    Собирает в памяти гистограммы событий.
+
+    Считает события по типам узлов и распределение времени вычисления
+    узлов по корзинам-степеням двойки (в микросекундах).
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.durations: Dict[str, Dict[int, int]] = {}
+        self.limits: Dict[str, int] = {}
+        self._starts: List[float] = []
+
+    def _count(self, event: str, key: str) -> None:
+        bucket = self.counts.setdefault(event, {})
+        bucket[key] = bucket.get(key, 0) + 1
+
+    def on_enter_node(self, function: PrimitiveFunction, args: List[int], depth: int) -> None:
+        self._count("enter_node", type(function).__name__)
+        self._starts.append(time.perf_counter())
+
+    def on_exit_node(self, function: PrimitiveFunction, args: List[int], result: int,
+                     depth: int) -> None:
+        node = type(function).__name__
+        self._count("exit_node", node)
+        if self._starts:
+            micros = int((time.perf_counter() - self._starts.pop()) * 1e6)
+            bucket = micros.bit_length()  # корзина [2^(b-1), 2^b) микросекунд
+            histogram = self.durations.setdefault(node, {})
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def on_recursion_iteration(self, function: PrimitiveFunction, iteration: int,
+                               total: Optional[int], accumulator: int, depth: int) -> None:
+        self._count("recursion_iteration", type(function).__name__)
+
+    def on_cache_hit(self, function: PrimitiveFunction, args: List[int], result: int,
+                     source: str) -> None:
+        self._count("cache_hit", source)
+
+    def on_limit_exceeded(self, kind: str, message: str) -> None:
+        self.limits[kind] = self.limits.get(kind, 0) + 1
+        # Прерванные узлы так и не получат событие выхода
+        self._starts.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Возвращает собранную статистику.
+
+        Returns:
+            Словарь с количеством событий, гистограммами времени и лимитами
+        """
+        return {
+            "counts": {event: dict(keys) for event, keys in self.counts.items()},
+            "durations": {node: dict(sorted(h.items())) for node, h in self.durations.items()},
+            "limits": dict(self.limits)
+        }
+
+    def reset(self) -> None:
+        """Очищает собранную статистику."""
+        self.counts.clear()
+        self.durations.clear()
+        self.limits.clear()
+        self._starts.clear()
@@ -5,7 +5,8 @@
 """
 
 import json
-from typing import List, Any, Optional, Dict
+import hashlib
+from typing import List, Any, Optional, Dict, Callable, Tuple
 
 
 class PrimitiveFunction:
@@ -184,6 +185,7 @@ class Composition(PrimitiveFunction):
             raise ValueError(f"Composition requires {f.arity()} functions, got {len(g_list)}")
         self.f = f
         self.g_list = g_list
+        self._cached_arity = _cacheable_arity(self)
     
     def evaluate(self, args: List[int]) -> int:
         """Вычисляет f(g₁(args), ..., gₙ(args))."""
@@ -193,22 +195,16 @@ class Composition(PrimitiveFunction):
         return self.f.evaluate(g_results)
     
     def arity(self) -> int:
-        if not self.g_list:
-            return 0
-        return self.g_list[0].arity()
+        if self._cached_arity is not None:
+            return self._cached_arity
+        return _chain_arity(self)[0]
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
-            "type": "composition",
-            "f": self.f.to_dict(),
-            "g_list": [g.to_dict() for g in self.g_list]
-        }
+        return function_to_dict(self)
     
     @staticmethod
     def from_dict(data: Dict[str, Any]) -> 'Composition':
-        f = function_from_dict(data["f"])
-        g_list = [function_from_dict(g) for g in data["g_list"]]
-        return Composition(f, g_list)
+        return function_from_dict({**data, "type": "composition"})
     
     def __repr__(self) -> str:
         return f"Composition({self.f}, [{', '.join(str(g) for g in self.g_list)}])"
@@ -231,6 +227,7 @@ class PrimitiveRecursion(PrimitiveFunction):
             )
         self.g = g
         self.h = h
+        self._cached_arity = _cacheable_arity(self)
     
     def evaluate(self, args: List[int]) -> int:
         """
@@ -257,44 +254,734 @@ class PrimitiveRecursion(PrimitiveFunction):
         return self.h.evaluate(h_args)
     
     def arity(self) -> int:
-        return self.g.arity() + 1
+        if self._cached_arity is not None:
+            return self._cached_arity
+        return _chain_arity(self)[0]
     
     def to_dict(self) -> Dict[str, Any]:
-        return {
-            "type": "primitive_recursion",
-            "g": self.g.to_dict(),
-            "h": self.h.to_dict()
-        }
+        return function_to_dict(self)
     
     @staticmethod
     def from_dict(data: Dict[str, Any]) -> 'PrimitiveRecursion':
-        g = function_from_dict(data["g"])
-        h = function_from_dict(data["h"])
-        return PrimitiveRecursion(g, h)
+        return function_from_dict({**data, "type": "primitive_recursion"})
     
     def __repr__(self) -> str:
         return f"PrimitiveRecursion({self.g}, {self.h})"
 
 
+class Reference(PrimitiveFunction):
+    """
+    Ссылка на другую сохраненную функцию по имени или структурному хэшу.
+    
+    Ссылка по имени следует за последней версией функции, ссылка по хэшу
+    закрепляет конкретное определение. До связывания (link) ссылку нельзя
+    вычислить, но ее арность известна из определения.
+    """
+    
+    def __init__(self, name: Optional[str] = None, hash: Optional[str] = None,
+                 arity: Optional[int] = None, target: Optional[PrimitiveFunction] = None):
+        """
+        Args:
+            name: Имя функции
+            hash: Структурный хэш определения функции
+            arity: Арность функции (если целевая функция еще не связана)
+            target: Целевая функция
+        """
+        if name is None and hash is None:
+            raise ValueError("Reference requires a function name or hash")
+        self.name = name
+        self.hash = hash
+        self.arity_value = arity
+        self.target: Optional[PrimitiveFunction] = None
+        if target is not None:
+            self.link(target)
+    
+    def label(self) -> str:
+        """Возвращает имя функции или сокращенный хэш."""
+        return self.name if self.name is not None else f"#{self.hash[:12]}"
+    
+    def link(self, target: PrimitiveFunction) -> None:
+        """
+        Связывает ссылку с целевой функцией.
+        
+        Raises:
+            ValueError: Если арность функции не совпадает с арностью ссылки
+        """
+        if self.arity_value is not None and target.arity() != self.arity_value:
+            raise ValueError(
+                f"Reference {self.label()}: expected arity {self.arity_value}, "
+                f"got {target.arity()}"
+            )
+        self.target = target
+    
+    def resolve(self) -> PrimitiveFunction:
+        """Возвращает целевую функцию."""
+        if self.target is None:
+            raise ValueError(f"Reference {self.label()} is not linked")
+        return self.target
+    
+    def evaluate(self, args: List[int]) -> int:
+        return self.resolve().evaluate(args)
+    
+    def arity(self) -> int:
+        if self.target is not None:
+            return self.target.arity()
+        if self.arity_value is None:
+            raise ValueError(f"Reference {self.label()} has unknown arity")
+        return self.arity_value
+    
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"type": "reference"}
+        if self.name is not None:
+            data["name"] = self.name
+        if self.hash is not None:
+            data["hash"] = self.hash
+        if self.target is not None or self.arity_value is not None:
+            data["arity"] = self.arity()
+        return data
+    
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'Reference':
+        return Reference(data.get("name"), data.get("hash"), data.get("arity"))
+    
+    def __repr__(self) -> str:
+        return f"Reference({self.label()})"
+
+
+# Фрагмент определения, хранящий только структурный хэш узла:
+# {"type": NODE_TYPE, "hash": ...}; узел читается загрузчиком по хэшу
+NODE_TYPE = "node"
+
+# Загрузчик узлов: хэш -> (параметры узла, хэши дочерних узлов)
+NodeLoader = Callable[[str], Tuple[Dict[str, Any], List[str]]]
+
+
+def load_definition(root_hash: str, loader: NodeLoader) -> Dict[str, Any]:
+    """
+    Собирает полное определение по хэшу корня без рекурсии.
+    
+    Каждый узел читается загрузчиком один раз, одинаковые поддеревья разделяются.
+    """
+    parts: Dict[str, Tuple[Dict[str, Any], List[str]]] = {}
+    built: Dict[str, Dict[str, Any]] = {}
+    stack = [(root_hash, False)]
+    while stack:
+        node_hash, expanded = stack.pop()
+        if node_hash in built:
+            continue
+        if node_hash not in parts:
+            parts[node_hash] = loader(node_hash)
+        params, children = parts[node_hash]
+        if children and not expanded:
+            stack.append((node_hash, True))
+            stack.extend((child, False) for child in children)
+            continue
+        built[node_hash] = definition_from_parts(params, [built[child] for child in children])
+    return built[root_hash]
+
+
+class LazyFunction(PrimitiveFunction):
+    """
+    Ленивый узел: хранит фрагмент определения и строит объект функции
+    только при первом обращении к вычислению или дочерним узлам.
+    
+    Дочерние узлы построенного узла - тоже ленивые, поэтому строится только
+    та часть дерева, которая действительно используется. Как и связанная
+    ссылка, ленивый узел прозрачен для хэширования и вычислителя.
+    
+    Фрагмент {"type": NODE_TYPE, "hash": ...} читается загрузчиком только
+    при построении узла. Если структурный хэш узла известен (known_hash),
+    хэширование использует его и не строит узел.
+    """
+    
+    def __init__(self, data: Dict[str, Any],
+                 resolver: Optional[Callable[['Reference'], PrimitiveFunction]] = None,
+                 arity: Optional[int] = None, loader: Optional[NodeLoader] = None,
+                 known_hash: Optional[str] = None, node_hashes: bool = False):
+        """
+        Args:
+            data: Фрагмент определения (словарь)
+            resolver: Возвращает целевую функцию для ссылок фрагмента
+            arity: Арность, если уже известна
+            loader: Загрузчик узлов для фрагментов NODE_TYPE
+            known_hash: Структурный хэш узла (со связанными ссылками), если известен
+            node_hashes: Если True, хэши фрагментов NODE_TYPE дочерних узлов
+                совпадают с их структурными хэшами (в поддереве нет ссылок)
+        """
+        self.data = data
+        self.resolver = resolver
+        self.arity_value = arity
+        self.loader = loader
+        self.known_hash = known_hash
+        self.node_hashes = node_hashes
+        self._function: Optional[PrimitiveFunction] = None
+    
+    @property
+    def target(self) -> PrimitiveFunction:
+        """Построенный узел (строится при первом обращении)."""
+        return self.resolve()
+    
+    def is_built(self) -> bool:
+        """Проверяет, построен ли уже узел."""
+        return self._function is not None
+    
+    def _child(self, data: Dict[str, Any], arity: Optional[int]) -> 'LazyFunction':
+        """Ленивый дочерний узел с теми же загрузчиками."""
+        known = data["hash"] if self.node_hashes and data.get("type") == NODE_TYPE else None
+        return LazyFunction(data, self.resolver, arity, self.loader, known, self.node_hashes)
+    
+    def _load(self) -> Dict[str, Any]:
+        """Фрагмент определения узла с дочерними узлами - фрагментами NODE_TYPE."""
+        data = self.data
+        if data.get("type") != NODE_TYPE:
+            return data
+        if self.loader is None:
+            raise ValueError(f"Node {data['hash'][:12]} requires a loader")
+        params, children = self.loader(data["hash"])
+        return definition_from_parts(params, [{"type": NODE_TYPE, "hash": child}
+                                              for child in children])
+    
+    def resolve(self) -> PrimitiveFunction:
+        """Строит узел, оставляя дочерние узлы ленивыми."""
+        if self._function is None:
+            data = self._load()
+            func_type = data.get("type")
+            arity = self.arity_value
+            if func_type == "composition":
+                # Арности дочерних узлов следуют из арности композиции
+                g_list = [self._child(g, arity) for g in data["g_list"]]
+                f = self._child(data["f"], len(g_list))
+                self._function = Composition(f, g_list)
+            elif func_type == "primitive_recursion":
+                self._function = PrimitiveRecursion(
+                    self._child(data["g"], None if arity is None else arity - 1),
+                    self._child(data["h"], None if arity is None else arity + 1)
+                )
+            elif func_type == "reference" and self.resolver is not None:
+                reference = Reference.from_dict(data)
+                reference.link(self.resolver(reference))
+                self._function = reference
+            else:
+                self._function = function_from_dict(data)
+        return self._function
+    
+    def evaluate(self, args: List[int]) -> int:
+        return self.resolve().evaluate(args)
+    
+    def arity(self) -> int:
+        if self.arity_value is None:
+            if self._function is not None:
+                return self._function.arity()
+            try:
+                self.arity_value = definition_arity(self.data)
+            except ValueError:
+                # Ссылка без арности - арность известна после связывания
+                return self.resolve().arity()
+        return self.arity_value
+    
+    def to_dict(self) -> Dict[str, Any]:
+        if self.data.get("type") == NODE_TYPE:
+            if self.loader is None:
+                raise ValueError(f"Node {self.data['hash'][:12]} requires a loader")
+            return load_definition(self.data["hash"], self.loader)
+        return self.data
+    
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> 'LazyFunction':
+        return LazyFunction(data)
+    
+    def __repr__(self) -> str:
+        if self._function is not None:
+            return repr(self._function)
+        return f"LazyFunction({self.data.get('type')})"
+
+
+def _chain_arity(function: PrimitiveFunction) -> tuple:
+    """
+    Вычисляет арность без рекурсии, спускаясь по цепочке узлов, определяющих
+    арность (первая подставляемая функция композиции, база рекурсии).
+    
+    Returns:
+        (арность, можно ли ее запомнить): арность, полученная через ссылку,
+        не запоминается - ссылку могут связать с другой функцией
+    """
+    extra = 0
+    cacheable = True
+    node = function
+    while True:
+        if isinstance(node, (Composition, PrimitiveRecursion)) and node is not function:
+            cached = getattr(node, "_cached_arity", None)
+            if cached is not None:
+                return extra + cached, cacheable
+        if isinstance(node, Composition):
+            if not node.g_list:
+                return extra, cacheable
+            node = node.g_list[0]
+        elif isinstance(node, PrimitiveRecursion):
+            extra += 1
+            node = node.g
+        elif isinstance(node, Reference):
+            cacheable = False
+            if node.target is None:
+                return extra + node.arity(), cacheable
+            node = node.target
+        else:
+            return extra + node.arity(), cacheable
+
+
+def _cacheable_arity(function: PrimitiveFunction) -> Optional[int]:
+    """Арность составного узла для кэширования при создании (None - не кэшируется)."""
+    try:
+        arity, cacheable = _chain_arity(function)
+    except ValueError:
+        # Ссылка с неизвестной арностью еще не связана
+        return None
+    return arity if cacheable else None
+
+
+def _own_children(function: PrimitiveFunction) -> List[PrimitiveFunction]:
+    """Дочерние функции узла (ссылки не раскрываются)."""
+    if isinstance(function, Composition):
+        return [function.f] + list(function.g_list)
+    if isinstance(function, PrimitiveRecursion):
+        return [function.g, function.h]
+    return []
+
+
+def function_to_dict(function: PrimitiveFunction) -> Dict[str, Any]:
+    """
+    Преобразует функцию в словарь без рекурсии.
+    
+    Общие поддеревья функции становятся общими словарями.
+    """
+    built: Dict[int, Dict[str, Any]] = {}
+    stack = [(function, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in built:
+            continue
+        children = _own_children(node)
+        if not children:
+            built[id(node)] = node.to_dict()
+        elif expanded:
+            child_dicts = [built[id(child)] for child in children]
+            if isinstance(node, Composition):
+                built[id(node)] = {"type": "composition", "f": child_dicts[0],
+                                   "g_list": child_dicts[1:]}
+            else:
+                built[id(node)] = {"type": "primitive_recursion", "g": child_dicts[0],
+                                   "h": child_dicts[1]}
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in children)
+    return built[id(function)]
+
+
 # Фабрика для создания функций из словаря
 def function_from_dict(data: Dict[str, Any]) -> PrimitiveFunction:
-    """Создает функцию из словаря."""
+    """
+    Создает функцию из словаря.
+    
+    Дерево обходится без рекурсии, поэтому глубина определения ограничена
+    только памятью. Общие поддеревья определения становятся общими объектами.
+    """
+    built: Dict[int, PrimitiveFunction] = {}
+    stack = [(data, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in built:
+            continue
+        func_type = node.get("type")
+        if func_type in _CHILD_KEYS:
+            children = definition_children(node)
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+                continue
+            functions = [built[id(child)] for child in children]
+            if func_type == "composition":
+                built[id(node)] = Composition(functions[0], functions[1:])
+            else:
+                built[id(node)] = PrimitiveRecursion(functions[0], functions[1])
+        elif func_type == "zero":
+            built[id(node)] = Zero.from_dict(node)
+        elif func_type == "successor":
+            built[id(node)] = Successor.from_dict(node)
+        elif func_type == "constant":
+            built[id(node)] = Constant.from_dict(node)
+        elif func_type == "projection":
+            built[id(node)] = Projection.from_dict(node)
+        elif func_type == "reference":
+            built[id(node)] = Reference.from_dict(node)
+        else:
+            raise ValueError(f"Unknown function type: {func_type}")
+    return built[id(data)]
+
+
+# Поля определений, содержащие дочерние узлы
+_CHILD_KEYS = {
+    "composition": ("f", "g_list"),
+    "primitive_recursion": ("g", "h"),
+}
+
+
+def definition_children(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Возвращает дочерние узлы определения в порядке f, g_list / g, h."""
     func_type = data.get("type")
+    if func_type == "composition":
+        return [data["f"]] + list(data["g_list"])
+    if func_type == "primitive_recursion":
+        return [data["g"], data["h"]]
+    return []
+
+
+def definition_params(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Возвращает собственные параметры узла определения (без дочерних узлов)."""
+    child_keys = _CHILD_KEYS.get(data.get("type"), ())
+    return {key: value for key, value in data.items() if key not in child_keys}
+
+
+def definition_from_parts(params: Dict[str, Any],
+                          children: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Собирает узел определения из параметров и дочерних узлов (обратно definition_children)."""
+    func_type = params.get("type")
+    if func_type == "composition":
+        return {**params, "f": children[0], "g_list": list(children[1:])}
+    if func_type == "primitive_recursion":
+        return {**params, "g": children[0], "h": children[1]}
+    return dict(params)
+
+
+def definition_arity(data: Dict[str, Any]) -> int:
+    """
+    Вычисляет арность определения без построения функции.
+    
+    Проходит только по цепочке узлов, определяющих арность
+    (первая подставляемая функция композиции, база рекурсии).
+    """
+    extra = 0
+    node = data
+    while True:
+        func_type = node.get("type")
+        if func_type in ("zero", "successor"):
+            return extra + 1
+        if func_type == "constant":
+            return extra + node.get("arity", 0)
+        if func_type == "projection":
+            return extra + node["n"]
+        if func_type == "composition":
+            if not node["g_list"]:
+                return extra
+            node = node["g_list"][0]
+        elif func_type == "primitive_recursion":
+            extra += 1
+            node = node["g"]
+        elif "arity" in node:
+            return extra + node["arity"]
+        else:
+            raise ValueError(f"Unknown function type: {func_type}")
+
+
+def definition_node_count(data: Dict[str, Any]) -> int:
+    """Подсчитывает количество узлов в дереве определения без рекурсии."""
+    count = 0
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(definition_children(node))
+    return count
+
+
+def render_definition(data: Dict[str, Any], max_length: Optional[int] = None) -> str:
+    """
+    Строит текстовую запись определения, например
+    recursion(projection[1/1], composition(successor, projection[2/3])).
+    
+    Args:
+        data: Определение функции (словарь)
+        max_length: Максимальная длина записи (None - без ограничения)
+        
+    Returns:
+        Текстовая запись определения
+    """
+    names = {"composition": "composition", "primitive_recursion": "recursion"}
+    parts: List[str] = []
+    length = 0
+    # В стеке лежат узлы и строки-разделители, которые нужно вывести
+    stack: List[Any] = [data]
+    while stack and (max_length is None or length < max_length):
+        item = stack.pop()
+        if isinstance(item, str):
+            text = item
+        else:
+            func_type = item.get("type")
+            children = definition_children(item)
+            if func_type == "projection":
+                text = f"projection[{item['i']}/{item['n']}]"
+            elif func_type == "constant":
+                text = f"constant[{item['value']}/{item.get('arity', 0)}]"
+            elif func_type == "reference":
+                text = f"reference[{item.get('name') or item.get('hash')}]"
+            elif func_type in names:
+                text = f"{names[func_type]}("
+                stack.append(")")
+                for index in range(len(children) - 1, -1, -1):
+                    stack.append(children[index])
+                    if index > 0:
+                        stack.append(", ")
+            else:
+                text = str(func_type)
+        parts.append(text)
+        length += len(text)
+    rendered = "".join(parts)
+    return rendered if max_length is None else rendered[:max_length]
+
+
+def _linked(function: PrimitiveFunction) -> PrimitiveFunction:
+    """Возвращает функцию, на которую указывает связанная ссылка или ленивый узел (или саму функцию)."""
+    while isinstance(function, (Reference, LazyFunction)) and function.target is not None:
+        function = function.target
+    return function
+
+
+def function_children(function: PrimitiveFunction) -> List[PrimitiveFunction]:
+    """
+    Возвращает дочерние функции узла в том же порядке, что и definition_children.
+    
+    Связанная ссылка прозрачна: ее узел совпадает с узлом целевой функции,
+    поэтому функция со ссылками имеет тот же структурный хэш, что и
+    функция со встроенными копиями.
+    """
+    function = _linked(function)
+    if isinstance(function, Composition):
+        return [function.f] + list(function.g_list)
+    if isinstance(function, PrimitiveRecursion):
+        return [function.g, function.h]
+    return []
+
+
+def function_params(function: PrimitiveFunction) -> Dict[str, Any]:
+    """Возвращает собственные параметры узла функции (без дочерних узлов)."""
+    function = _linked(function)
+    if isinstance(function, Composition):
+        return {"type": "composition"}
+    if isinstance(function, PrimitiveRecursion):
+        return {"type": "primitive_recursion"}
+    return function.to_dict()
+
+
+# Кодировщик канонического представления узла (то же, что json.dumps с этими параметрами)
+_DIGEST_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+# Кэш хэшей узлов: одни и те же проекции и поддеревья встречаются во многих функциях
+_DIGEST_CACHE: Dict[tuple, str] = {}
+_DIGEST_CACHE_SIZE = 65536
+
+
+def _node_digest(params: Dict[str, Any], child_hashes: List[str]) -> str:
+    """Хэш узла по его параметрам и хэшам дочерних узлов."""
+    try:
+        key = (tuple(sorted(params.items())), tuple(child_hashes))
+        digest = _DIGEST_CACHE.get(key)
+    except TypeError:
+        # Непохешируемые параметры - считаем без кэша
+        key = digest = None
+    if digest is None:
+        payload = _DIGEST_ENCODER.encode([params, child_hashes])
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        if key is not None:
+            if len(_DIGEST_CACHE) >= _DIGEST_CACHE_SIZE:
+                _DIGEST_CACHE.clear()
+            _DIGEST_CACHE[key] = digest
+    return digest
+
+
+def node_hash(params: Dict[str, Any], child_hashes: List[str]) -> str:
+    """
+    Вычисляет структурный хэш узла по его параметрам и хэшам дочерних узлов.
     
-    if func_type == "zero":
-        return Zero.from_dict(data)
-    elif func_type == "successor":
-        return Successor.from_dict(data)
-    elif func_type == "constant":
-        return Constant.from_dict(data)
-    elif func_type == "projection":
-        return Projection.from_dict(data)
-    elif func_type == "composition":
-        return Composition.from_dict(data)
-    elif func_type == "primitive_recursion":
-        return PrimitiveRecursion.from_dict(data)
-    else:
-        raise ValueError(f"Unknown function type: {func_type}")
+    Args:
+        params: Собственные параметры узла (см. definition_params)
+        child_hashes: Структурные хэши дочерних узлов
+        
+    Returns:
+        Шестнадцатеричная строка SHA-256
+    """
+    return _node_digest(params, child_hashes)
+
+
+def _merkle_hashes(root: Any, children, params,
+                   known: Optional[Callable[[Any], Optional[str]]] = None) -> Dict[int, str]:
+    """
+    Вычисляет структурные хэши всех узлов дерева без рекурсии.
+    
+    Хэш узла зависит только от его параметров и хэшей дочерних узлов,
+    поэтому одинаковые поддеревья получают одинаковые хэши.
+    
+    Args:
+        known: Возвращает уже известный хэш узла (тогда узел не обходится) или None
+    
+    Returns:
+        Словарь id(узел) -> хэш
+    """
+    hashes: Dict[int, str] = {}
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in hashes:
+            continue
+        if known is not None:
+            digest = known(node)
+            if digest is not None:
+                hashes[id(node)] = digest
+                continue
+        node_children = children(node)
+        if expanded or not node_children:
+            hashes[id(node)] = _node_digest(
+                params(node), [hashes[id(child)] for child in node_children]
+            )
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node_children))
+    return hashes
+
+
+def definition_node_hashes(data: Dict[str, Any]) -> Dict[int, str]:
+    """Возвращает структурные хэши всех узлов определения (id(узел) -> хэш)."""
+    return _merkle_hashes(data, definition_children, definition_params)
+
+
+def definition_nodes(data: Dict[str, Any]) -> List[tuple]:
+    """
+    Разбивает определение на уникальные узлы, идентифицируемые структурным хэшем.
+    
+    Одинаковые поддеревья дают один узел.
+    
+    Returns:
+        Список (хэш, параметры, хэши дочерних узлов); корень - первый
+    """
+    hashes = definition_node_hashes(data)
+    nodes: Dict[str, tuple] = {}
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        node_hash = hashes[id(node)]
+        if node_hash in nodes:
+            continue
+        children = definition_children(node)
+        nodes[node_hash] = (definition_params(node), [hashes[id(child)] for child in children])
+        stack.extend(children)
+    return [(node_hash, params, child_hashes)
+            for node_hash, (params, child_hashes) in nodes.items()]
+
+
+def structural_hash(data: Dict[str, Any]) -> str:
+    """
+    Вычисляет канонический структурный хэш определения функции.
+    
+    Args:
+        data: Определение функции (словарь)
+        
+    Returns:
+        Шестнадцатеричная строка SHA-256
+    """
+    return definition_node_hashes(data)[id(data)]
+
+
+def _known_hash(function: PrimitiveFunction) -> Optional[str]:
+    """Известный без обхода хэш ленивого узла (или None)."""
+    return function.known_hash if isinstance(function, LazyFunction) else None
+
+
+def function_node_hashes(function: PrimitiveFunction) -> Dict[int, str]:
+    """
+    Возвращает структурные хэши всех узлов функции (id(узел) -> хэш).
+    
+    Ленивые узлы с известным хэшем не строятся и не обходятся (их
+    поддеревья не получают хэшей).
+    """
+    hashes = _merkle_hashes(function, function_children, function_params, _known_hash)
+    
+    # Целевые функции связанных ссылок и ленивых узлов получают их хэш
+    visited = set()
+    stack = [function]
+    while stack:
+        node = stack.pop()
+        if id(node) in visited or id(node) not in hashes:
+            continue
+        visited.add(id(node))
+        if isinstance(node, LazyFunction):
+            # Непостроенный узел не строится ради хэша
+            if node.is_built():
+                hashes.setdefault(id(node.resolve()), hashes[id(node)])
+                if _known_hash(node) is None:
+                    stack.append(node.resolve())
+        elif isinstance(node, Reference):
+            if node.target is not None:
+                hashes.setdefault(id(node.target), hashes[id(node)])
+                stack.append(node.target)
+        else:
+            stack.extend(function_children(node))
+    return hashes
+
+
+def function_hash(function: PrimitiveFunction) -> str:
+    """
+    Вычисляет структурный хэш функции.
+    
+    Для функций без ссылок совпадает с structural_hash(function.to_dict()),
+    связанные ссылки хэшируются как встроенные копии целевых функций.
+    """
+    return function_node_hashes(function)[id(function)]
+
+
+def definition_references(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Возвращает узлы-ссылки определения (без повторов)."""
+    references = []
+    seen = set()
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if node.get("type") == "reference":
+            key = (node.get("name"), node.get("hash"))
+            if key not in seen:
+                seen.add(key)
+                references.append(node)
+        else:
+            stack.extend(definition_children(node))
+    return references
+
+
+def link_references(function: PrimitiveFunction,
+                    resolver: Callable[[Reference], PrimitiveFunction]) -> List[Reference]:
+    """
+    Связывает несвязанные ссылки функции с целевыми функциями.
+    
+    В целевые функции обход не спускается: их ссылки связывает resolver.
+    
+    Args:
+        function: Функция
+        resolver: Возвращает целевую функцию для ссылки
+        
+    Returns:
+        Список ссылок функции
+    """
+    references = []
+    visited = set()
+    stack = [function]
+    while stack:
+        node = stack.pop()
+        if id(node) in visited:
+            continue
+        visited.add(id(node))
+        if isinstance(node, Reference):
+            if node.target is None:
+                node.link(resolver(node))
+            references.append(node)
+        else:
+            stack.extend(function_children(node))
+    return references
 
 
 # Предопределенные функции
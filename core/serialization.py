@@ -0,0 +1,329 @@
+"""
+Сериализация определений ПРФ в JSON без рекурсии.
+
+Модуль json стандартной библиотеки разбирает и строит вложенные структуры
+рекурсивно и не справляется с определениями глубиной в десятки тысяч
+уровней (а при поднятом sys.setrecursionlimit - переполняет стек C).
+Здесь неглубокие документы по-прежнему обрабатывает модуль json, а
+глубокие - итеративные разборщик и писатель с явным стеком.
+
+Кроме вложенного формата поддерживается плоский - список узлов с индексами
+дочерних узлов:
+
+    {"format": "prf-nodes", "version": 1, "root": 2, "nodes": [
+        {"type": "successor"},
+        {"type": "projection", "n": 1, "i": 1},
+        {"type": "composition", "children": [0, 1]}
+    ]}
+
+Дочерние узлы стоят в списке раньше родителя, одинаковые поддеревья
+записываются один раз. Плоский формат не содержит вложенности и читается
+обычным json.loads.
+"""
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, Dict, List, Tuple
+
+from core.prf import definition_children, definition_params, definition_from_parts
+
+
+FLAT_FORMAT = "prf-nodes"
+FLAT_VERSION = 1
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?")
+_LITERALS = (("true", True), ("false", False), ("null", None))
+
+# Глубина вложенности, до которой документы обрабатывает модуль json
+_SAFE_DEPTH = 500
+
+_BRACKETS = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+
+
+def _skip(text: str, pos: int) -> int:
+    """Пропускает пробельные символы."""
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _read_key(text: str, pos: int) -> Tuple[str, int]:
+    """Читает ключ объекта и двоеточие после него."""
+    if not text.startswith('"', pos):
+        raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, pos)
+    key, pos = scanstring(text, pos + 1)
+    pos = _skip(text, pos)
+    if not text.startswith(":", pos):
+        raise json.JSONDecodeError("Expecting ':' delimiter", text, pos)
+    return key, _skip(text, pos + 1)
+
+
+def _parse(text: str) -> Any:
+    """Разбирает JSON явным стеком (без ограничения глубины)."""
+    end = len(text)
+    pos = _skip(text, 0)
+    # Кадр: [контейнер, ключ текущего значения (для объекта)]
+    stack: List[list] = []
+    while True:
+        if pos >= end:
+            raise json.JSONDecodeError("Expecting value", text, pos)
+        char = text[pos]
+        if char == "{":
+            pos = _skip(text, pos + 1)
+            if not text.startswith("}", pos):
+                key, pos = _read_key(text, pos)
+                stack.append([{}, key])
+                continue
+            value, pos = {}, pos + 1
+        elif char == "[":
+            pos = _skip(text, pos + 1)
+            if not text.startswith("]", pos):
+                stack.append([[], None])
+                continue
+            value, pos = [], pos + 1
+        elif char == '"':
+            value, pos = scanstring(text, pos + 1)
+        else:
+            for literal, literal_value in _LITERALS:
+                if text.startswith(literal, pos):
+                    value, pos = literal_value, pos + len(literal)
+                    break
+            else:
+                match = _NUMBER.match(text, pos)
+                if match is None:
+                    raise json.JSONDecodeError("Expecting value", text, pos)
+                number = match.group()
+                value = float(number) if match.group(1) or match.group(2) else int(number)
+                pos = match.end()
+
+        # Значение добавляется в контейнер; закрытые контейнеры сами становятся значениями
+        while True:
+            pos = _skip(text, pos)
+            if not stack:
+                if pos != end:
+                    raise json.JSONDecodeError("Extra data", text, pos)
+                return value
+            frame = stack[-1]
+            container = frame[0]
+            is_object = isinstance(container, dict)
+            closer = "}" if is_object else "]"
+            if is_object:
+                container[frame[1]] = value
+            else:
+                container.append(value)
+            if text.startswith(",", pos):
+                pos = _skip(text, pos + 1)
+                if is_object:
+                    frame[1], pos = _read_key(text, pos)
+                break
+            if text.startswith(closer, pos):
+                stack.pop()
+                value, pos = container, pos + 1
+                continue
+            raise json.JSONDecodeError(f"Expecting ',' delimiter or '{closer}'", text, pos)
+
+
+class _Token:
+    """Готовый фрагмент текста в стеке писателя."""
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+_CLOSE_OBJECT = _Token("}")
+_CLOSE_ARRAY = _Token("]")
+_SEPARATOR = _Token(", ")
+
+
+def _write(value: Any, ensure_ascii: bool) -> str:
+    """Строит JSON явным стеком (в том же виде, что json.dumps без отступов)."""
+    encode = json.JSONEncoder(ensure_ascii=ensure_ascii).encode
+    keys: Dict[Any, _Token] = {}
+    parts: List[str] = []
+    # В стеке лежат значения и готовые фрагменты текста
+    stack: List[Any] = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, _Token):
+            parts.append(item.text)
+        elif isinstance(item, dict):
+            if not any(isinstance(entry, (dict, list, tuple)) for entry in item.values()):
+                # Листья дерева сериализует модуль json
+                parts.append(encode(item))
+                continue
+            stack.append(_CLOSE_OBJECT)
+            entries = list(item.items())
+            for index in range(len(entries) - 1, -1, -1):
+                key, entry = entries[index]
+                stack.append(entry)
+                token = keys.get((index > 0, key))
+                if token is None:
+                    prefix = ", " if index else ""
+                    token = keys[(index > 0, key)] = _Token(f"{prefix}{encode(str(key))}: ")
+                stack.append(token)
+            parts.append("{")
+        elif isinstance(item, (list, tuple)):
+            stack.append(_CLOSE_ARRAY)
+            for index in range(len(item) - 1, -1, -1):
+                stack.append(item[index])
+                if index:
+                    stack.append(_SEPARATOR)
+            parts.append("[")
+        else:
+            parts.append(encode(item))
+    return "".join(parts)
+
+
+def _text_too_deep(text: str) -> bool:
+    """Проверяет, превышает ли вложенность текста JSON _SAFE_DEPTH."""
+    # Глубина не больше числа открывающих скобок - обычно хватает подсчета
+    if text.count("{") + text.count("[") <= _SAFE_DEPTH:
+        return False
+    depth = 0
+    for match in _BRACKETS.finditer(text):
+        bracket = match.group()
+        if bracket in "{[":
+            depth += 1
+            if depth > _SAFE_DEPTH:
+                return True
+        elif bracket in "}]":
+            depth -= 1
+    return False
+
+
+def _value_too_deep(value: Any) -> bool:
+    """Проверяет, превышает ли вложенность значения _SAFE_DEPTH."""
+    stack = [(value, 0)]
+    while stack:
+        item, depth = stack.pop()
+        if depth > _SAFE_DEPTH:
+            return True
+        if isinstance(item, dict):
+            stack.extend((entry, depth + 1) for entry in item.values()
+                         if isinstance(entry, (dict, list, tuple)))
+        elif isinstance(item, (list, tuple)):
+            stack.extend((entry, depth + 1) for entry in item
+                         if isinstance(entry, (dict, list, tuple)))
+    return False
+
+
+def loads(text: str) -> Any:
+    """
+    Разбирает JSON любой глубины.
+
+    Неглубокие документы разбирает json.loads, глубокие - итеративный
+    разборщик.
+    """
+    if _text_too_deep(text):
+        return _parse(text)
+    return json.loads(text)
+
+
+def dumps(value: Any, ensure_ascii: bool = True) -> str:
+    """Сериализует значение любой глубины в JSON (как json.dumps)."""
+    if _value_too_deep(value):
+        return _write(value, ensure_ascii)
+    return json.dumps(value, ensure_ascii=ensure_ascii)
+
+
+def is_flat_definition(data: Any) -> bool:
+    """Проверяет, является ли значение определением в плоском формате."""
+    return isinstance(data, dict) and data.get("format") == FLAT_FORMAT
+
+
+def definition_to_flat(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Преобразует определение в плоский формат.
+
+    Args:
+        data: Определение функции (вложенный словарь)
+
+    Returns:
+        Словарь {"format", "version", "root", "nodes"}
+    """
+    nodes: List[Dict[str, Any]] = []
+    index_of: Dict[int, int] = {}
+    # Одинаковые поддеревья получают один индекс
+    interned: Dict[tuple, int] = {}
+    stack = [(data, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in index_of:
+            continue
+        children = definition_children(node)
+        if children and not expanded:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        params = definition_params(node)
+        child_indices = [index_of[id(child)] for child in children]
+        try:
+            key = (tuple(sorted(params.items())), tuple(child_indices))
+        except TypeError:
+            key = (id(node),)
+        index = interned.get(key)
+        if index is None:
+            index = interned[key] = len(nodes)
+            if children:
+                params["children"] = child_indices
+            nodes.append(params)
+        index_of[id(node)] = index
+    return {"format": FLAT_FORMAT, "version": FLAT_VERSION,
+            "root": index_of[id(data)], "nodes": nodes}
+
+
+def definition_from_flat(flat: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Восстанавливает вложенное определение из плоского формата.
+
+    Общие поддеревья возвращаются одним и тем же словарем.
+
+    Raises:
+        ValueError: Если формат или индексы узлов некорректны
+    """
+    if not is_flat_definition(flat):
+        raise ValueError("Not a flat PRF definition")
+    if flat.get("version") != FLAT_VERSION:
+        raise ValueError(f"Unsupported flat definition version {flat.get('version')}")
+    built: List[Dict[str, Any]] = []
+    for index, node in enumerate(flat["nodes"]):
+        children = node.get("children", [])
+        for child in children:
+            if not isinstance(child, int) or not 0 <= child < index:
+                raise ValueError(f"Node {index}: invalid child index {child}")
+        params = {key: value for key, value in node.items() if key != "children"}
+        built.append(definition_from_parts(params, [built[child] for child in children]))
+    root = flat["root"]
+    if not isinstance(root, int) or not 0 <= root < len(built):
+        raise ValueError(f"Invalid root index {root}")
+    return built[root]
+
+
+def dumps_definition(data: Dict[str, Any], flat: bool = False,
+                     ensure_ascii: bool = True) -> str:
+    """
+    Сериализует определение функции в JSON.
+
+    Args:
+        data: Определение функции
+        flat: Если True, используется плоский формат
+        ensure_ascii: Экранировать ли символы вне ASCII
+
+    Returns:
+        Текст JSON
+    """
+    if flat:
+        return json.dumps(definition_to_flat(data), ensure_ascii=ensure_ascii)
+    return dumps(data, ensure_ascii)
+
+
+def loads_definition(text: str) -> Dict[str, Any]:
+    """
+    Разбирает определение функции из JSON в любом из двух форматов.
+
+    Returns:
+        Вложенное определение {"type": ...}
+    """
+    data = loads(text)
+    return definition_from_flat(data) if is_flat_definition(data) else data
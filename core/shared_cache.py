@@ -0,0 +1,391 @@
+"""
+Кэш результатов в разделяемой памяти для нескольких процессов.
+
+Кэш - хэш-таблица (структурный хэш функции, аргументы) -> результат в
+сегменте multiprocessing.shared_memory: результат, вычисленный одним
+процессом пула или веб-воркером, сразу доступен остальным процессам на
+той же машине.
+
+Устройство сегмента:
+    заголовок   HEADER: магия, количество слотов, размер слота, слотов в корзине
+    слоты       счетчик версии (4 байта), длина значения + 1 (0 - пустой слот),
+                время последнего обращения (8 байт), ключ (16 байт), значение
+
+Ключ - 128-битный дайджест BLAKE2b от хэша функции и аргументов; он
+выбирает корзину из WAYS соседних слотов. Чтение идет без блокировок:
+запись делает счетчик версии слота нечетным на время изменения, и
+читатель повторяет чтение, если счетчик нечетный или изменился
+(seqlock). Запись берет блокировку одной из полос (stripes) - байта в
+файле блокировок, поэтому писатели разных корзин не мешают друг другу.
+При заполнении корзины вытесняется слот, к которому дольше всего не
+обращались (LRU внутри корзины).
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, List, Optional
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+MAGIC = b"PRFSHM1\0"
+HEADER = struct.Struct("<8sIIII")
+HEADER_SIZE = 64
+
+# Заголовок слота: версия, длина значения + 1, время обращения, ключ
+SLOT_HEADER = struct.Struct("<IIQ16s")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+
+# Количество слотов в корзине
+WAYS = 4
+
+# Попыток согласованного чтения слота, изменяемого другим процессом
+READ_RETRIES = 16
+
+
+def _untrack(shm: shared_memory.SharedMemory) -> None:
+    """
+    Снимает сегмент с учета resource_tracker, чтобы он не удалялся при
+    завершении процесса (в Windows сегмент и так живет, пока открыт).
+    """
+    if os.name == "posix":
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+
+def result_key(function_hash: str, arguments: List[int]) -> bytes:
+    """Возвращает 128-битный ключ результата."""
+    text = f"{function_hash}:{json.dumps(arguments)}"
+    return hashlib.blake2b(text.encode("ascii"), digest_size=16).digest()
+
+
+class _StripeLocks:
+    """
+    Блокировки полос между процессами: байтовые блокировки файла.
+
+    Блокировки файла принадлежат процессу, поэтому потоки одного процесса
+    дополнительно разделяются обычными блокировками.
+    """
+
+    def __init__(self, path: str, stripes: int):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._threads = [threading.Lock() for _ in range(stripes)]
+        # Позиция файла общая для потоков процесса (нужна msvcrt.locking)
+        self._seek_lock = threading.Lock()
+
+    def _lock_byte(self, stripe: int, lock: bool) -> None:
+        if sys.platform == "win32":
+            with self._seek_lock:
+                os.lseek(self._fd, stripe, os.SEEK_SET)
+                while True:
+                    try:
+                        msvcrt.locking(self._fd, msvcrt.LK_LOCK if lock else msvcrt.LK_UNLCK, 1)
+                        return
+                    except OSError:
+                        if not lock:
+                            raise
+        else:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if lock else fcntl.LOCK_UN, 1, stripe)
+
+    def acquire(self, stripe: int) -> None:
+        self._threads[stripe].acquire()
+        try:
+            self._lock_byte(stripe, True)
+        except BaseException:
+            self._threads[stripe].release()
+            raise
+
+    def release(self, stripe: int) -> None:
+        try:
+            self._lock_byte(stripe, False)
+        finally:
+            self._threads[stripe].release()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class SharedResultCache:
+    """
+    Кэш результатов в разделяемой памяти.
+
+    Предоставляет get_cached_result и save_cached_result, поэтому передается
+    в Evaluator(result_cache=...). Кэш без имени создается родительским
+    процессом и передается процессам пула (объект сериализуется как имя
+    сегмента). Кэш с именем открывается независимыми процессами (например,
+    веб-воркерами): первый процесс создает сегмент, остальные подключаются;
+    сегмент живет до вызова unlink(). Безымянный сегмент и его файл
+    блокировок удаляются при закрытии создавшего их кэша.
+    """
+
+    def __init__(self, name: Optional[str] = None, slots: int = 65536,
+                 slot_size: int = 128, stripes: int = 64,
+                 backing: Optional[Any] = None):
+        """
+        Args:
+            name: Имя сегмента (None - новый безымянный сегмент)
+            slots: Количество слотов (округляется вверх до кратного WAYS)
+            slot_size: Размер слота в байтах (значение занимает до slot_size - 32 байт)
+            stripes: Количество полос блокировок записи
+            backing: Кэш второго уровня (например, DatabaseManager): промахи
+                ищутся в нем, записи дублируются в него
+        """
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError(f"slot_size must exceed {SLOT_HEADER.size} bytes")
+        self.backing = backing
+        self.persistent = name is not None
+        self.hits = 0
+        self.misses = 0
+        self._owner = False
+
+        slots = -(-max(slots, WAYS) // WAYS) * WAYS
+        size = HEADER_SIZE + slots * slot_size
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._owner = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        if self.persistent:
+            # Сегмент с именем переживает создавший его процесс
+            _untrack(self._shm)
+
+        buf = self._shm.buf
+        if self._owner:
+            HEADER.pack_into(buf, 0, b"\0" * 8, slots, slot_size, WAYS, stripes)
+            # Магия записывается последней: по ней подключившиеся процессы
+            # узнают, что заголовок готов
+            buf[0:8] = MAGIC
+        else:
+            self._wait_header()
+        self._attach_layout()
+
+    def _wait_header(self, timeout: float = 5.0) -> None:
+        """Ждет, пока создавший сегмент процесс запишет заголовок."""
+        deadline = time.monotonic() + timeout
+        while bytes(self._shm.buf[0:8]) != MAGIC:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Shared cache {self.name} is not initialised")
+            time.sleep(0.001)
+
+    def _attach_layout(self) -> None:
+        """Читает параметры таблицы из заголовка и открывает блокировки."""
+        _, self.slots, self.slot_size, self.ways, self.stripes = HEADER.unpack_from(self._shm.buf, 0)
+        self.capacity = self.slot_size - SLOT_HEADER.size
+        self.buckets = self.slots // self.ways
+        self._locks = _StripeLocks(
+            os.path.join(tempfile.gettempdir(), f"{self.name.lstrip('/')}.lock"), self.stripes
+        )
+
+    @property
+    def name(self) -> str:
+        """Имя сегмента разделяемой памяти."""
+        return self._shm.name
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Процессы пула подключаются к тому же сегменту; кэш второго уровня не передается
+        return {"name": self.name, "persistent": self.persistent}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.backing = None
+        self.persistent = state["persistent"]
+        self.hits = 0
+        self.misses = 0
+        self._owner = False
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        if self.persistent:
+            _untrack(self._shm)
+        self._wait_header()
+        self._attach_layout()
+
+    def _bucket(self, key: bytes) -> int:
+        return int.from_bytes(key[:8], "little") % self.buckets
+
+    def _slot_offset(self, bucket: int, way: int) -> int:
+        return HEADER_SIZE + (bucket * self.ways + way) * self.slot_size
+
+    def _read_slot(self, offset: int) -> Optional[tuple]:
+        """
+        Читает слот без блокировки.
+
+        Returns:
+            (длина + 1, ключ, значение) или None, если слот постоянно изменяется
+        """
+        buf = self._shm.buf
+        for _ in range(READ_RETRIES):
+            version, length, _, key = SLOT_HEADER.unpack_from(buf, offset)
+            if version & 1:
+                time.sleep(0)
+                continue
+            value = bytes(buf[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + max(length - 1, 0)])
+            if _U32.unpack_from(buf, offset)[0] == version:
+                return length, key, value
+        return None
+
+    def get(self, key: bytes) -> Optional[int]:
+        """Ищет результат по ключу (без обращения к кэшу второго уровня)."""
+        bucket = self._bucket(key)
+        for way in range(self.ways):
+            offset = self._slot_offset(bucket, way)
+            slot = self._read_slot(offset)
+            if slot is not None and slot[0] and slot[1] == key:
+                # Время обращения обновляется без блокировки: гонка влияет
+                # только на выбор вытесняемого слота
+                _U64.pack_into(self._shm.buf, offset + 8, time.monotonic_ns())
+                return int.from_bytes(slot[2], "little")
+        return None
+
+    def put(self, key: bytes, result: int) -> bool:
+        """
+        Записывает результат по ключу.
+
+        Returns:
+            False, если результат не помещается в слот
+        """
+        if result < 0:
+            return False
+        value = result.to_bytes((result.bit_length() + 7) // 8, "little")
+        if len(value) > self.capacity:
+            return False
+        bucket = self._bucket(key)
+        stripe = bucket % self.stripes
+        buf = self._shm.buf
+        self._locks.acquire(stripe)
+        try:
+            target = None
+            oldest = None
+            for way in range(self.ways):
+                offset = self._slot_offset(bucket, way)
+                _, length, stamp, slot_key = SLOT_HEADER.unpack_from(buf, offset)
+                if length and slot_key == key:
+                    target = offset
+                    break
+                if not length:
+                    stamp = -1
+                if oldest is None or stamp < oldest[0]:
+                    oldest = (stamp, offset)
+            if target is None:
+                target = oldest[1]
+
+            version = _U32.unpack_from(buf, target)[0]
+            _U32.pack_into(buf, target, (version + 1) & 0xFFFFFFFF)
+            SLOT_HEADER.pack_into(buf, target, (version + 1) & 0xFFFFFFFF, len(value) + 1,
+                                  time.monotonic_ns(), key)
+            buf[target + SLOT_HEADER.size:target + SLOT_HEADER.size + len(value)] = value
+            _U32.pack_into(buf, target, (version + 2) & 0xFFFFFFFF)
+        finally:
+            self._locks.release(stripe)
+        return True
+
+    def get_cached_result(self, function_hash: str, arguments: List[int]) -> Optional[int]:
+        """
+        Возвращает результат из кэша.
+
+        При промахе результат ищется в кэше второго уровня и копируется в
+        разделяемую память.
+
+        Args:
+            function_hash: Структурный хэш функции
+            arguments: Аргументы
+
+        Returns:
+            Результат или None
+        """
+        key = result_key(function_hash, arguments)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        if self.backing is not None:
+            result = self.backing.get_cached_result(function_hash, arguments)
+            if result is not None:
+                self.put(key, result)
+        return result
+
+    def save_cached_result(self, function_hash: str, arguments: List[int], result: int) -> None:
+        """
+        Сохраняет результат в кэш (и в кэш второго уровня).
+
+        Args:
+            function_hash: Структурный хэш функции
+            arguments: Аргументы
+            result: Результат
+        """
+        self.put(result_key(function_hash, arguments), result)
+        if self.backing is not None:
+            self.backing.save_cached_result(function_hash, arguments, result)
+
+    def clear(self) -> None:
+        """Очищает кэш во всех процессах."""
+        buf = self._shm.buf
+        for bucket in range(self.buckets):
+            stripe = bucket % self.stripes
+            self._locks.acquire(stripe)
+            try:
+                for way in range(self.ways):
+                    offset = self._slot_offset(bucket, way)
+                    version = _U32.unpack_from(buf, offset)[0]
+                    _U32.pack_into(buf, offset, (version + 1) & 0xFFFFFFFF)
+                    _U32.pack_into(buf, offset + 4, 0)
+                    _U32.pack_into(buf, offset, (version + 2) & 0xFFFFFFFF)
+            finally:
+                self._locks.release(stripe)
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику кэша.
+
+        Returns:
+            Словарь с количеством занятых слотов, всех слотов и попаданий
+            и промахов текущего процесса
+        """
+        buf = self._shm.buf
+        entries = sum(
+            1 for slot in range(self.slots)
+            if _U32.unpack_from(buf, HEADER_SIZE + slot * self.slot_size + 4)[0]
+        )
+        return {"entries": entries, "slots": self.slots, "hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        """
+        Отключает текущий процесс от сегмента.
+
+        Владелец безымянного сегмента при этом удаляет сегмент и файл
+        блокировок; сегмент с именем остается до вызова unlink().
+        """
+        if self._shm is None:
+            return
+        if self._owner and not self.persistent:
+            self.unlink()
+        else:
+            self._detach()
+
+    def _detach(self) -> None:
+        """Закрывает блокировки и отображение сегмента."""
+        self._locks.close()
+        self._shm.close()
+        self._shm = None
+
+    def unlink(self) -> None:
+        """Удаляет сегмент и файл блокировок (после этого новые процессы его не найдут)."""
+        if self._shm is None:
+            raise RuntimeError("Shared cache is closed")
+        lock_path = self._locks.path
+        if self.persistent and os.name == "posix":
+            # Сегмент был снят с учета resource_tracker при подключении
+            resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
+        self._detach()
+        if os.path.exists(lock_path):
+            os.remove(lock_path)
@@ -0,0 +1,423 @@
+"""
+Предвычисленные таблицы значений функций на ограниченной области.
+
+Таблица хранит значения функции арности k на всех аргументах из
+0..bound-1 и читается через mmap: поиск значения - одно чтение по
+смещению, а несколько процессов, открывших один файл, разделяют страницы
+кэша ОС вместо собственных копий таблицы.
+
+Формат файла (все числа little-endian):
+    заголовок   HEADER: магия, версия, ширина записи, арность, bound,
+                количество записей, структурный хэш функции
+    записи      ширина > 0: count записей фиксированной ширины (1, 2, 4 или 8 байт)
+                ширина = 0: count + 1 смещений (8 байт) и данные - значения
+                переменной длины (большие числа)
+
+Запись аргументов (a_1, ..., a_k) имеет номер a_1 + a_2 * bound + ... +
+a_k * bound^(k-1): первый (рекурсивный) аргумент меняется быстрее всех,
+поэтому таблица примитивной рекурсии заполняется по строкам за одно
+вычисление h на запись.
+"""
+
+import itertools
+import mmap
+import os
+import shutil
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from core.prf import PrimitiveFunction, PrimitiveRecursion, LazyFunction, Reference, function_hash
+from core.evaluator import Evaluator
+
+
+MAGIC = b"PRFTBL"
+VERSION = 1
+TABLE_SUFFIX = ".prft"
+
+HEADER = struct.Struct("<6sBBHxxQQ64s")
+HEADER_SIZE = (HEADER.size + 7) // 8 * 8
+
+# Ширина записи -> код типа array
+_WIDTHS = {1: "B", 2: "H", 4: "I", 8: "Q"}
+_UINT = {width: struct.Struct(f"<{code}") for width, code in _WIDTHS.items()}
+_OFFSET = _UINT[8]
+
+# Наибольшее значение, помещающееся в запись фиксированной ширины
+_MAX_FIXED = 2 ** 64 - 1
+
+# Количество записей, буферизуемых в памяти при записи и перекодировании таблицы
+_CHUNK = 65536
+
+# Обработчик прогресса: (вычислено записей, всего записей)
+TableProgress = Callable[[int, int], None]
+
+
+class TableError(ValueError):
+    """Ошибка формата таблицы значений."""
+    pass
+
+
+def table_size(arity: int, bound: int) -> int:
+    """Количество записей таблицы."""
+    return bound ** arity
+
+
+def table_index(args: List[int], bound: int) -> Optional[int]:
+    """Номер записи аргументов или None, если они вне области таблицы."""
+    index = 0
+    scale = 1
+    for arg in args:
+        if not 0 <= arg < bound:
+            return None
+        index += arg * scale
+        scale *= bound
+    return index
+
+
+def _unwrap(function: PrimitiveFunction) -> PrimitiveFunction:
+    """Раскрывает ссылки и ленивые узлы до функции, которую они обозначают."""
+    while isinstance(function, (Reference, LazyFunction)):
+        function = function.resolve()
+    return function
+
+
+def compute_table_values(function: PrimitiveFunction, bound: int,
+                         evaluator: Optional[Evaluator] = None,
+                         progress: Optional[TableProgress] = None) -> Iterator[int]:
+    """
+    Вычисляет значения функции на всех аргументах из 0..bound-1.
+
+    Значения выдаются по мере вычисления, поэтому таблица не собирается в
+    памяти целиком. Для примитивной рекурсии значения строки (фиксированные
+    y) получаются одно из другого: f(x+1, y) = h(x, f(x, y), y), и хранится
+    только предыдущее значение строки.
+
+    Args:
+        function: Функция
+        bound: Граница области (аргументы от 0 до bound - 1)
+        evaluator: Вычислитель (по умолчанию - новый с настройками по умолчанию)
+        progress: Обработчик прогресса
+
+    Yields:
+        Значения в порядке номеров записей
+    """
+    if bound < 1:
+        raise ValueError("Table bound must be positive")
+    evaluator = evaluator or Evaluator()
+    arity = function.arity()
+    total = table_size(arity, bound)
+    done = 0
+    root = _unwrap(function)
+
+    if isinstance(root, PrimitiveRecursion) and arity >= 1:
+        # Старшие аргументы перебираются так, чтобы второй менялся быстрее всех
+        for suffix in itertools.product(range(bound), repeat=arity - 1):
+            y_args = list(reversed(suffix))
+            value = evaluator.evaluate(root.g, y_args)
+            yield value
+            for x in range(bound - 1):
+                value = evaluator.evaluate(root.h, [x, value] + y_args)
+                yield value
+            done += bound
+            if progress:
+                progress(done, total)
+    else:
+        for suffix in itertools.product(range(bound), repeat=arity):
+            yield evaluator.evaluate(function, list(reversed(suffix)))
+            done += 1
+            if progress and done % bound == 0:
+                progress(done, total)
+
+
+def _to_little_endian(data: array) -> bytes:
+    """Возвращает содержимое массива в порядке байтов little-endian."""
+    if sys.byteorder == "big":
+        data = array(data.typecode, data)
+        data.byteswap()
+    return data.tobytes()
+
+
+def _read_records(f: BinaryIO, start: int, count: int) -> array:
+    """Читает count 8-байтных записей, начиная с записи start."""
+    f.seek(HEADER_SIZE + start * 8)
+    records = array("Q")
+    records.frombytes(f.read(count * 8))
+    if sys.byteorder == "big":
+        records.byteswap()
+    return records
+
+
+def _narrow_records(f: BinaryIO, count: int, width: int) -> None:
+    """Перезаписывает 8-байтные записи записями меньшей ширины на месте."""
+    for start in range(0, count, _CHUNK):
+        records = _read_records(f, start, min(_CHUNK, count - start))
+        # Запись идет не дальше уже прочитанного, поэтому данные не затираются
+        f.seek(HEADER_SIZE + start * width)
+        f.write(_to_little_endian(array(_WIDTHS[width], records)))
+    f.truncate(HEADER_SIZE + count * width)
+
+
+def _spill_records(f: BinaryIO, data: BinaryIO, count: int) -> int:
+    """
+    Переводит уже записанные 8-байтные записи в формат переменной длины.
+
+    Значения переносятся в файл данных, а их записи заменяются смещениями
+    того же размера.
+
+    Returns:
+        Смещение конца данных
+    """
+    offset = 0
+    for start in range(0, count, _CHUNK):
+        records = _read_records(f, start, min(_CHUNK, count - start))
+        offsets = array("Q")
+        for value in records:
+            offsets.append(offset)
+            chunk = value.to_bytes((value.bit_length() + 7) // 8, "little")
+            data.write(chunk)
+            offset += len(chunk)
+        f.seek(HEADER_SIZE + start * 8)
+        f.write(_to_little_endian(offsets))
+    f.seek(HEADER_SIZE + count * 8)
+    return offset
+
+
+def write_value_table(path: Union[str, Path], values: Iterable[int], arity: int,
+                      bound: int, function_hash_hex: str) -> None:
+    """
+    Записывает таблицу значений в файл.
+
+    Значения пишутся в файл по мере поступления записями по 8 байт, а после
+    последнего значения сужаются до нужной ширины. Если встречается значение
+    больше 8 байт, записанные значения переносятся во временный файл данных,
+    а таблица продолжается в формате переменной длины. В памяти одновременно
+    находится не больше _CHUNK записей.
+
+    Файл пишется во временный и переименовывается после завершения, поэтому
+    процессы, уже отобразившие старую таблицу, продолжают ее читать.
+
+    Args:
+        path: Путь к файлу таблицы
+        values: Значения в порядке номеров записей
+        arity: Арность функции
+        bound: Граница области
+        function_hash_hex: Структурный хэш функции
+    """
+    total = table_size(arity, bound)
+    temp_path = f"{path}.partial"
+    data_path = f"{path}.data"
+    data: Optional[BinaryIO] = None
+    try:
+        with open(temp_path, "w+b") as f:
+            f.seek(HEADER_SIZE)
+            buffer = array("Q")
+            count = 0
+            largest = 0
+            offset = 0
+            for value in values:
+                if value < 0:
+                    raise TableError("Table values must be non-negative")
+                if count == total:
+                    raise TableError(f"Expected {total} values, got more")
+                if data is None and value > _MAX_FIXED:
+                    f.write(_to_little_endian(buffer))
+                    buffer = array("Q")
+                    data = open(data_path, "w+b")
+                    offset = _spill_records(f, data, count)
+                if data is None:
+                    buffer.append(value)
+                    largest = max(largest, value)
+                else:
+                    chunk = value.to_bytes((value.bit_length() + 7) // 8, "little")
+                    buffer.append(offset)
+                    data.write(chunk)
+                    offset += len(chunk)
+                count += 1
+                if len(buffer) >= _CHUNK:
+                    f.write(_to_little_endian(buffer))
+                    buffer = array("Q")
+            if count != total:
+                raise TableError(f"Expected {total} values, got {count}")
+
+            if data is None:
+                max_bytes = (largest.bit_length() + 7) // 8
+                width = next(w for w in sorted(_WIDTHS) if max_bytes <= w)
+                f.write(_to_little_endian(buffer))
+                if width < 8:
+                    _narrow_records(f, count, width)
+            else:
+                width = 0
+                buffer.append(offset)
+                f.write(_to_little_endian(buffer))
+                data.seek(0)
+                shutil.copyfileobj(data, f)
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, width, arity, bound, count,
+                                function_hash_hex.encode("ascii")).ljust(HEADER_SIZE, b"\0"))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        if data is not None:
+            data.close()
+            os.remove(data_path)
+
+
+class ValueTable:
+    """Таблица значений, отображенная в память только для чтения."""
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Args:
+            path: Путь к файлу таблицы
+
+        Raises:
+            TableError: Если файл не является таблицей значений
+        """
+        self.path = str(path)
+        with open(self.path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+            if len(header) < HEADER.size:
+                raise TableError(f"{self.path}: truncated header")
+            magic, version, width, arity, bound, count, hash_bytes = HEADER.unpack_from(header)
+            if magic != MAGIC:
+                raise TableError(f"{self.path}: not a value table")
+            if version != VERSION:
+                raise TableError(f"{self.path}: unsupported table version {version}")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.width = width
+        self.arity = arity
+        self.bound = bound
+        self.count = count
+        self.function_hash = hash_bytes.decode("ascii")
+        if count != table_size(arity, bound):
+            raise TableError(f"{self.path}: record count does not match arity and bound")
+        if width:
+            if width not in _WIDTHS:
+                raise TableError(f"{self.path}: invalid record width {width}")
+            self._unpack = _UINT[width].unpack_from
+            expected = HEADER_SIZE + count * width
+        else:
+            self._data_start = HEADER_SIZE + (count + 1) * 8
+            expected = self._data_start + _OFFSET.unpack_from(self._mm, HEADER_SIZE + count * 8)[0]
+        if len(self._mm) < expected:
+            raise TableError(f"{self.path}: truncated table")
+
+    def get(self, args: List[int]) -> Optional[int]:
+        """
+        Возвращает значение на аргументах.
+
+        Returns:
+            Значение или None, если аргументы вне области таблицы
+        """
+        if len(args) != self.arity:
+            return None
+        index = table_index(args, self.bound)
+        if index is None:
+            return None
+        if self.width:
+            return self._unpack(self._mm, HEADER_SIZE + index * self.width)[0]
+        start = _OFFSET.unpack_from(self._mm, HEADER_SIZE + index * 8)[0]
+        end = _OFFSET.unpack_from(self._mm, HEADER_SIZE + index * 8 + 8)[0]
+        return int.from_bytes(self._mm[self._data_start + start:self._data_start + end], "little")
+
+    def close(self) -> None:
+        """Снимает отображение файла."""
+        self._mm.close()
+
+
+def table_file_name(function_hash_hex: str, arity: int, bound: int) -> str:
+    """Имя файла таблицы функции."""
+    return f"{function_hash_hex}-{arity}x{bound}{TABLE_SUFFIX}"
+
+
+def build_value_table(function: PrimitiveFunction, bound: int, directory: Union[str, Path],
+                      evaluator: Optional[Evaluator] = None,
+                      progress: Optional[TableProgress] = None) -> str:
+    """
+    Вычисляет таблицу значений функции и сохраняет ее в каталоге.
+
+    Args:
+        function: Функция
+        bound: Граница области (аргументы от 0 до bound - 1)
+        directory: Каталог таблиц
+        evaluator: Вычислитель для заполнения таблицы
+        progress: Обработчик прогресса
+
+    Returns:
+        Путь к файлу таблицы
+    """
+    values = compute_table_values(function, bound, evaluator, progress)
+    digest = function_hash(function)
+    arity = function.arity()
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    path = Path(directory) / table_file_name(digest, arity, bound)
+    write_value_table(path, values, arity, bound, digest)
+    return str(path)
+
+
+class ValueTableSet:
+    """
+    Таблицы значений каталога, доступные по структурному хэшу функции.
+
+    Предоставляет lookup(function_hash, args) для Evaluator. Для функции с
+    несколькими таблицами используется таблица с наибольшей областью.
+    """
+
+    def __init__(self, directory: Optional[Union[str, Path]] = None):
+        """
+        Args:
+            directory: Каталог таблиц (None или несуществующий - пустой набор)
+        """
+        self.directory = Path(directory) if directory is not None else None
+        self._tables: Dict[str, ValueTable] = {}
+        self.reload()
+
+    def reload(self) -> None:
+        """Перечитывает каталог таблиц."""
+        self.close()
+        if self.directory is None or not self.directory.is_dir():
+            return
+        for path in sorted(self.directory.glob(f"*{TABLE_SUFFIX}")):
+            try:
+                table = ValueTable(path)
+            except (OSError, TableError) as e:
+                print(f"Skipping value table {path.name}: {e}")
+                continue
+            current = self._tables.get(table.function_hash)
+            if current is None or table.bound > current.bound:
+                if current is not None:
+                    current.close()
+                self._tables[table.function_hash] = table
+            else:
+                table.close()
+
+    def get_table(self, function_hash_hex: str) -> Optional[ValueTable]:
+        """Возвращает таблицу функции или None."""
+        return self._tables.get(function_hash_hex)
+
+    def lookup(self, function_hash_hex: str, args: List[int]) -> Optional[int]:
+        """
+        Ищет значение функции в таблицах.
+
+        Returns:
+            Значение или None, если таблицы нет или аргументы вне ее области
+        """
+        table = self._tables.get(function_hash_hex)
+        return table.get(args) if table is not None else None
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def close(self) -> None:
+        """Снимает отображение всех таблиц."""
+        for table in self._tables.values():
+            table.close()
+        self._tables = {}
@@ -4,18 +4,68 @@
 Проверяет корректность построения функций и их арность.
 """
 
-from typing import List, Optional
-from core.prf import PrimitiveFunction, Composition, PrimitiveRecursion
+import threading
+from typing import Dict, List, Optional, Tuple
+from core.prf import (
+    PrimitiveFunction, Composition, PrimitiveRecursion, LazyFunction,
+    node_hash, structural_hash
+)
 
 
 class ValidationError(Exception):
-    """Исключение для ошибок валидации."""
-    pass
+    """
+    Ошибка валидации узла функции.
+    
+    Attributes:
+        message: Текст ошибки
+        path: Путь к узлу от корня: "f", "g[i]" для композиции, "g", "h" для
+            примитивной рекурсии (пустой путь - корень)
+    """
+    
+    def __init__(self, message: str, path: Tuple[str, ...] = ()):
+        super().__init__(message)
+        self.message = message
+        self.path = tuple(path)
+    
+    @property
+    def location(self) -> str:
+        """Путь к узлу в виде строки (например, "g[0].h")."""
+        return ".".join(self.path) or "root"
+    
+    def __repr__(self) -> str:
+        return f"ValidationError({self.message!r}, path={self.path!r})"
+
+
+# Результат проверки узла: структурный хэш, арность (None - неизвестна),
+# можно ли запомнить результат (нет, если под узлом есть цикл)
+_NodeResult = Tuple[str, Optional[int], bool]
+
+
+def _unwrap_built(function: PrimitiveFunction) -> PrimitiveFunction:
+    """Раскрывает уже построенные ленивые узлы (непостроенные остаются листьями)."""
+    while isinstance(function, LazyFunction) and function.is_built():
+        function = function.resolve()
+    return function
+
+
+def _node_steps(function: PrimitiveFunction) -> List[Tuple[str, PrimitiveFunction]]:
+    """Дочерние узлы с шагами пути к ним."""
+    if isinstance(function, Composition):
+        return [("f", function.f)] + [(f"g[{i}]", g) for i, g in enumerate(function.g_list)]
+    if isinstance(function, PrimitiveRecursion):
+        return [("g", function.g), ("h", function.h)]
+    return []
 
 
 class Validator:
     """Валидатор примитивно-рекурсивных функций."""
     
+    # Результаты проверки узлов по структурному хэшу: хэш -> (арность, ошибки узла).
+    # Одни и те же поддеревья встречаются во многих функциях и версиях
+    _results: Dict[str, Tuple[Optional[int], Tuple[str, ...]]] = {}
+    _RESULTS_SIZE = 65536
+    _results_lock = threading.Lock()
+    
     @staticmethod
     def validate(function: PrimitiveFunction) -> List[str]:
         """
@@ -27,76 +77,176 @@ class Validator:
         Returns:
             Список ошибок (пустой, если функция корректна)
         """
-        errors = []
-        
         try:
-            Validator._validate_recursive(function, errors, set())
+            return [error.message for error in Validator.validate_detailed(function)]
         except Exception as e:
-            errors.append(f"Validation error: {str(e)}")
-        
-        return errors
+            return [f"Validation error: {str(e)}"]
     
     @staticmethod
-    def _validate_recursive(function: PrimitiveFunction, errors: List[str], 
-                           visited: set) -> None:
-        """Рекурсивная валидация функции."""
-        # Проверка на циклические зависимости
-        func_id = id(function)
-        if func_id in visited:
-            errors.append("Circular dependency detected")
-            return
+    def validate_detailed(function: PrimitiveFunction) -> List[ValidationError]:
+        """
+        Валидирует функцию за один проход без рекурсии.
         
-        visited.add(func_id)
+        Каждый узел посещается один раз, арность составных узлов вычисляется
+        по арностям дочерних, а проверки узла запоминаются по его
+        структурному хэшу, поэтому повторная проверка после небольшого
+        изменения функции проверяет только измененные узлы. Ошибка общего
+        поддерева сообщается один раз - по пути первого вхождения.
         
-        try:
-            # Проверка арности
-            arity = function.arity()
-            if arity < 0:
-                errors.append(f"Invalid arity: {arity}")
+        Args:
+            function: Функция для валидации
             
-            # Валидация в зависимости от типа
-            if isinstance(function, Composition):
-                comp = function
+        Returns:
+            Список ошибок в порядке обхода узлов
+        """
+        results: Dict[int, _NodeResult] = {}
+        # id(узел) -> (id(родитель), шаг) для восстановления путей
+        parents: Dict[int, Tuple[Optional[int], str]] = {}
+        order: Dict[int, int] = {}
+        active = set()
+        # Ошибки: (id узла, от которого отсчитывается путь, доп. шаги, текст)
+        found: List[Tuple[int, Tuple[str, ...], str]] = []
+        
+        root = _unwrap_built(function)
+        parents[id(root)] = (None, "")
+        # Элемент стека: (узел, дочерние узлы - если узел уже раскрыт, родитель, шаг)
+        stack: List[tuple] = [(root, None, 0, "")]
+        while stack:
+            node, children, parent_id, step = stack.pop()
+            node_id = id(node)
+            if children is None:
+                if node_id in results:
+                    continue
+                if node_id in active:
+                    found.append((parent_id, (step,), "Circular dependency detected"))
+                    continue
+                if node_id not in order:
+                    order[node_id] = len(order)
+                    if node is not root:
+                        parents[node_id] = (parent_id, step)
+                steps = _node_steps(node)
+                if steps:
+                    children = [_unwrap_built(child) for _, child in steps]
+                    active.add(node_id)
+                    stack.append((node, children, parent_id, step))
+                    for (child_step, _), child in zip(reversed(steps), reversed(children)):
+                        stack.append((child, None, node_id, child_step))
+                    continue
+                results[node_id] = Validator._check_leaf(node, node_id, found)
+                continue
+            
+            active.discard(node_id)
+            results[node_id] = Validator._check_node(node, node_id, children, results, found)
+        
+        def path(node_id: int) -> Tuple[str, ...]:
+            steps = []
+            while True:
+                parent_id, step = parents[node_id]
+                if parent_id is None:
+                    break
+                steps.append(step)
+                node_id = parent_id
+            return tuple(reversed(steps))
+        
+        found.sort(key=lambda error: order[error[0]])
+        return [ValidationError(message, path(node_id) + extra) for node_id, extra, message in found]
+    
+    @staticmethod
+    def _recall(digest: str) -> Optional[Tuple[Optional[int], Tuple[str, ...]]]:
+        """Возвращает запомненный результат проверки узла."""
+        with Validator._results_lock:
+            return Validator._results.get(digest)
+    
+    @staticmethod
+    def _remember(digest: str, arity: Optional[int], messages: List[str]) -> None:
+        """Запоминает результат проверки узла."""
+        with Validator._results_lock:
+            if len(Validator._results) >= Validator._RESULTS_SIZE:
+                Validator._results.clear()
+            Validator._results[digest] = (arity, tuple(messages))
+    
+    @staticmethod
+    def _check_leaf(node: PrimitiveFunction, node_id: int,
+                    found: List[Tuple[int, Tuple[str, ...], str]]) -> _NodeResult:
+        """
+        Проверяет лист (базовую функцию, ссылку или непостроенный ленивый узел).
+        
+        Непостроенный ленивый узел - целое поддерево, из которого проверяется
+        только арность. Его результат берется из памяти, если поддерево уже
+        проверялось полностью, но сам не запоминается (ни для узла, ни для
+        его предков), чтобы неполная проверка не скрыла ошибки поддерева.
+        """
+        lazy = isinstance(node, LazyFunction)
+        if lazy:
+            digest = node.known_hash or structural_hash(node.data)
+        else:
+            digest = node_hash(node.to_dict(), [])
+        known = Validator._recall(digest)
+        complete = known is not None or not lazy
+        if known is None:
+            messages = []
+            arity = None
+            try:
+                arity = node.arity()
+                if arity < 0:
+                    messages.append(f"Invalid arity: {arity}")
+            except Exception as e:
+                messages.append(f"Validation error: {str(e)}")
+            if complete:
+                Validator._remember(digest, arity, messages)
+            known = (arity, tuple(messages))
+        arity, messages = known
+        found.extend((node_id, (), message) for message in messages)
+        return digest, arity, complete
+    
+    @staticmethod
+    def _check_node(node: PrimitiveFunction, node_id: int, children: List[PrimitiveFunction],
+                    results: Dict[int, _NodeResult],
+                    found: List[Tuple[int, Tuple[str, ...], str]]) -> _NodeResult:
+        """Проверяет составной узел по результатам дочерних узлов."""
+        child_results = [results.get(id(child)) for child in children]
+        # Дочерний узел без результата - предок того же узла (цикл)
+        cacheable = all(result is not None and result[2] for result in child_results)
+        arities = [result[1] if result is not None else None for result in child_results]
+        params = {"type": "composition" if isinstance(node, Composition) else "primitive_recursion"}
+        digest = node_hash(params, [result[0] if result is not None else "cycle"
+                                    for result in child_results])
+        
+        known = Validator._recall(digest) if cacheable else None
+        if known is None:
+            messages = []
+            if isinstance(node, Composition):
+                f_arity, g_arities = arities[0], arities[1:]
+                arity = g_arities[0] if g_arities else 0
                 # Проверка количества функций в композиции
-                if len(comp.g_list) != comp.f.arity():
-                    errors.append(
-                        f"Composition arity mismatch: f requires {comp.f.arity()} "
-                        f"functions, got {len(comp.g_list)}"
+                if f_arity is not None and len(g_arities) != f_arity:
+                    messages.append(
+                        f"Composition arity mismatch: f requires {f_arity} "
+                        f"functions, got {len(g_arities)}"
                     )
-                
                 # Проверка арности функций в списке
-                if comp.g_list:
-                    first_arity = comp.g_list[0].arity()
-                    for i, g in enumerate(comp.g_list):
-                        if g.arity() != first_arity:
-                            errors.append(
+                if arity is not None:
+                    for i, g_arity in enumerate(g_arities):
+                        if g_arity is not None and g_arity != arity:
+                            messages.append(
                                 f"Composition: all g functions must have same arity, "
-                                f"g[{i}] has arity {g.arity()}, expected {first_arity}"
+                                f"g[{i}] has arity {g_arity}, expected {arity}"
                             )
-                
-                # Рекурсивная валидация
-                Validator._validate_recursive(comp.f, errors, visited)
-                for g in comp.g_list:
-                    Validator._validate_recursive(g, errors, visited)
-            
-            elif isinstance(function, PrimitiveRecursion):
-                rec = function
-                g_arity = rec.g.arity()
-                h_arity = rec.h.arity()
-                
+            else:
+                g_arity, h_arity = arities
+                arity = g_arity + 1 if g_arity is not None else None
                 # Проверка соотношения арностей
-                if h_arity != g_arity + 2:
-                    errors.append(
+                if g_arity is not None and h_arity is not None and h_arity != g_arity + 2:
+                    messages.append(
                         f"PrimitiveRecursion: h must have arity {g_arity + 2}, "
                         f"got {h_arity}"
                     )
-                
-                # Рекурсивная валидация
-                Validator._validate_recursive(rec.g, errors, visited)
-                Validator._validate_recursive(rec.h, errors, visited)
-        
-        finally:
-            visited.remove(func_id)
+            if cacheable:
+                Validator._remember(digest, arity, messages)
+            known = (arity, tuple(messages))
+        arity, messages = known
+        found.extend((node_id, (), message) for message in messages)
+        return digest, arity, cacheable
     
     @staticmethod
     def validate_arguments(function: PrimitiveFunction, args: List[int]) -> Optional[str]:
@@ -0,0 +1,216 @@
+"""
+Резервное копирование базы данных через SQLite backup API.
+
+Копирование выполняется постранично с живого соединения, поэтому чтение
+и запись в базу продолжаются во время создания копии. Копия может быть
+сжата gzip, а плановые копии - ротироваться по количеству.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+# Количество страниц, копируемых за один шаг
+DEFAULT_BACKUP_PAGES = 256
+
+# Количество перезапусков постраничного копирования из-за записи в исходную
+# базу, после которого оставшиеся страницы копируются за один шаг
+DEFAULT_BACKUP_RESTARTS = 8
+
+# Обработчик прогресса: (скопировано страниц, всего страниц)
+ProgressCallback = Callable[[int, int], None]
+
+
+class _BackupRestarted(Exception):
+    """Постраничное копирование перезапускалось слишком часто."""
+
+
+def run_backup(source: sqlite3.Connection, target_path: str,
+               pages: int = DEFAULT_BACKUP_PAGES,
+               progress: Optional[ProgressCallback] = None,
+               compress: bool = False,
+               max_restarts: int = DEFAULT_BACKUP_RESTARTS) -> None:
+    """
+    Копирует базу данных в файл.
+
+    Копия сначала пишется во временный файл и переименовывается только
+    после успешного завершения, так что незавершенная копия не заменяет
+    существующую.
+
+    Запись в исходную базу через другое соединение перезапускает
+    постраничное копирование. Шаг, после которого число оставшихся страниц
+    не уменьшилось, считается перезапуском; после max_restarts перезапусков
+    оставшиеся страницы копируются за один шаг с удержанием блокировки
+    чтения, поэтому копирование всегда завершается.
+
+    Args:
+        source: Соединение с исходной базой
+        target_path: Путь к файлу копии
+        pages: Количество страниц за шаг (между шагами блокировка снимается)
+        progress: Обработчик прогресса
+        compress: Если True, копия сжимается gzip
+        max_restarts: Допустимое количество перезапусков копирования
+
+    Raises:
+        ValueError: Если pages не положительно
+    """
+    if pages <= 0:
+        raise ValueError("pages must be positive")
+
+    temp_path = f"{target_path}.partial"
+    raw_path = f"{temp_path}.db" if compress else temp_path
+    restarts = 0
+    last_remaining: Optional[int] = None
+
+    def on_step(status: int, remaining: int, total: int) -> None:
+        nonlocal restarts, last_remaining
+        if progress:
+            progress(total - remaining, total)
+        if last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _BackupRestarted()
+        last_remaining = remaining
+
+    def on_final_step(status: int, remaining: int, total: int) -> None:
+        if progress:
+            progress(total - remaining, total)
+
+    try:
+        target = sqlite3.connect(raw_path)
+        try:
+            try:
+                source.backup(target, pages=pages, progress=on_step)
+            except _BackupRestarted:
+                source.backup(target, pages=-1, progress=on_final_step)
+        finally:
+            target.close()
+
+        if compress:
+            with open(raw_path, "rb") as src, gzip.open(temp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.remove(raw_path)
+
+        os.replace(temp_path, target_path)
+    except BaseException:
+        for path in {raw_path, temp_path}:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+
+def restore_backup(backup_path: str, db_path: str) -> None:
+    """
+    Восстанавливает базу данных из копии (в том числе сжатой).
+
+    Args:
+        backup_path: Путь к файлу копии
+        db_path: Путь к восстанавливаемой базе
+    """
+    if backup_path.endswith(".gz"):
+        temp_path = f"{db_path}.restore"
+        with gzip.open(backup_path, "rb") as src, open(temp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        backup_path = temp_path
+    else:
+        temp_path = None
+
+    try:
+        source = sqlite3.connect(backup_path)
+        target = sqlite3.connect(db_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    finally:
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def backup_file_name(prefix: str, compress: bool) -> str:
+    """Возвращает имя файла плановой копии с отметкой времени."""
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    return f"{prefix}-{stamp}.db" + (".gz" if compress else "")
+
+
+def rotate_backups(directory: str, prefix: str, keep: int) -> List[str]:
+    """
+    Удаляет старые плановые копии, оставляя keep самых новых.
+
+    Args:
+        directory: Каталог копий
+        prefix: Префикс имен файлов копий
+        keep: Количество сохраняемых копий
+
+    Returns:
+        Список удаленных файлов
+    """
+    # Отметка времени в имени упорядочивает копии лексикографически
+    backups = sorted(
+        path for path in Path(directory).glob(f"{prefix}-*.db*")
+        if not path.name.endswith(".partial") and ".partial." not in path.name
+    )
+    removed = []
+    for path in backups[:max(len(backups) - keep, 0)]:
+        path.unlink()
+        removed.append(str(path))
+    return removed
+
+
+class BackupScheduler:
+    """Фоновый поток, создающий копии базы по расписанию с ротацией."""
+
+    def __init__(self, backup: Callable[[str], bool], directory: str,
+                 interval: float, keep: int = 7, prefix: str = "backup",
+                 compress: bool = True):
+        """
+        Args:
+            backup: Функция, создающая копию по указанному пути
+            directory: Каталог копий
+            interval: Интервал между копиями в секундах
+            keep: Количество сохраняемых копий
+            prefix: Префикс имен файлов копий
+            compress: Сжимать ли копии gzip
+        """
+        self.backup = backup
+        self.directory = directory
+        self.interval = interval
+        self.keep = keep
+        self.prefix = prefix
+        self.compress = compress
+        self.last_backup: Optional[str] = None
+
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="db-backup", daemon=True)
+        self._thread.start()
+
+    def run_once(self) -> Optional[str]:
+        """
+        Создает одну копию и удаляет устаревшие.
+
+        Returns:
+            Путь к созданной копии или None при ошибке
+        """
+        path = str(Path(self.directory) / backup_file_name(self.prefix, self.compress))
+        if not self.backup(path):
+            return None
+        self.last_backup = path
+        rotate_backups(self.directory, self.prefix, self.keep)
+        return path
+
+    def _run(self) -> None:
+        """Основной цикл фонового потока."""
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def stop(self) -> None:
+        """Останавливает расписание, дождавшись текущей копии."""
+        self._stop.set()
+        self._thread.join()
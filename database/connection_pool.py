@@ -0,0 +1,291 @@
+"""
+Пул соединений SQLite: по одному соединению на поток.
+
+Каждый поток получает собственное соединение для записи и отдельное
+соединение только для чтения. В режиме WAL читатели не блокируются
+записью истории и других таблиц. Соединения потока закрываются, когда
+поток завершается.
+
+База в памяти существует только внутри одного соединения, поэтому все
+потоки используют одно соединение, доступ к которому сериализуется.
+"""
+
+import sqlite3
+import threading
+import weakref
+from pathlib import Path
+from typing import Any, Iterator, List, Optional
+
+
+class _ThreadConnections:
+    """
+    Соединения одного потока.
+    
+    Хранится только в threading.local, поэтому освобождается при
+    завершении потока, что и закрывает его соединения.
+    """
+
+    __slots__ = ("writer", "reader", "connections", "__weakref__")
+
+    def __init__(self):
+        self.writer: Optional[sqlite3.Connection] = None
+        self.reader: Optional[sqlite3.Connection] = None
+        self.connections: List[sqlite3.Connection] = []
+
+
+class _FetchedCursor:
+    """Курсор с результатом, полностью прочитанным под блокировкой соединения."""
+
+    def __init__(self, connection: "SerializedConnection"):
+        self._connection = connection
+        self._rows: List[Any] = []
+        self._position = 0
+        self.lastrowid: Optional[int] = None
+        self.rowcount = -1
+        self.description = None
+
+    def _run(self, method: str, *args) -> "_FetchedCursor":
+        with self._connection.lock:
+            cursor = getattr(self._connection.raw.cursor(), method)(*args)
+            self._rows = cursor.fetchall()
+            self._position = 0
+            self.lastrowid = cursor.lastrowid
+            self.rowcount = cursor.rowcount
+            self.description = cursor.description
+        return self
+
+    def execute(self, sql: str, parameters=()) -> "_FetchedCursor":
+        return self._run("execute", sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> "_FetchedCursor":
+        return self._run("executemany", sql, seq_of_parameters)
+
+    def executescript(self, script: str) -> "_FetchedCursor":
+        return self._run("executescript", script)
+
+    def fetchone(self) -> Any:
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchmany(self, size: int = 1) -> List[Any]:
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def __iter__(self) -> Iterator[Any]:
+        while self._position < len(self._rows):
+            yield self.fetchone()
+
+    def close(self) -> None:
+        self._rows = []
+
+
+class SerializedConnection:
+    """
+    Соединение, разделяемое потоками: каждая операция выполняется под
+    блокировкой, а транзакция "with conn:" удерживает ее до завершения.
+    
+    Результаты запросов читаются целиком под блокировкой, поэтому курсоры
+    не используют соединение одновременно с другими потоками.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.raw = connection
+        self.lock = threading.RLock()
+
+    def cursor(self) -> _FetchedCursor:
+        return _FetchedCursor(self)
+
+    def execute(self, sql: str, parameters=()) -> _FetchedCursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters) -> _FetchedCursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script: str) -> _FetchedCursor:
+        return self.cursor().executescript(script)
+
+    def commit(self) -> None:
+        with self.lock:
+            self.raw.commit()
+
+    def rollback(self) -> None:
+        with self.lock:
+            self.raw.rollback()
+
+    def backup(self, target: sqlite3.Connection, **kwargs) -> None:
+        with self.lock:
+            self.raw.backup(target, **kwargs)
+
+    def close(self) -> None:
+        with self.lock:
+            self.raw.close()
+
+    def __enter__(self) -> "SerializedConnection":
+        self.lock.acquire()
+        try:
+            self.raw.__enter__()
+        except BaseException:
+            self.lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        try:
+            return self.raw.__exit__(exc_type, exc_value, traceback)
+        finally:
+            self.lock.release()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.raw, name)
+
+
+class ConnectionPool:
+    """Пул соединений SQLite с настройкой прагм."""
+
+    def __init__(self, db_path: str, journal_mode: str = "WAL",
+                 synchronous: str = "NORMAL", cache_size: int = -65536,
+                 mmap_size: int = 256 * 1024 * 1024, busy_timeout: int = 5000):
+        """
+        Args:
+            db_path: Путь к файлу базы данных
+            journal_mode: Режим журнала (WAL, DELETE, ...)
+            synchronous: Уровень синхронизации (OFF, NORMAL, FULL, EXTRA)
+            cache_size: Размер кэша страниц (отрицательное значение - в КиБ)
+            mmap_size: Размер области, отображаемой в память, в байтах
+            busy_timeout: Время ожидания блокировки в миллисекундах
+        """
+        self.db_path = db_path
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+
+        # База в памяти существует только внутри одного соединения,
+        # поэтому все потоки используют его совместно
+        self.shared = db_path == ":memory:" or db_path.startswith("file::memory:")
+
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._finalizers: List[weakref.finalize] = []
+        self._lock = threading.Lock()
+        self._shared_conn: Optional[SerializedConnection] = None
+        self._journal_configured = False
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        """Открывает и настраивает новое соединение."""
+        if read_only:
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            # Пул закрывает соединения всех потоков, поэтому проверка потока отключена
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   timeout=self.busy_timeout / 1000)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                   timeout=self.busy_timeout / 1000)
+        conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
+
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        if not read_only:
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+            with self._lock:
+                if not self._journal_configured:
+                    # Режим журнала хранится в файле базы, достаточно установить его один раз
+                    conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+                    self._journal_configured = True
+
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _thread_connections(self) -> _ThreadConnections:
+        """Возвращает соединения текущего потока."""
+        owned = getattr(self._local, "owned", None)
+        if owned is None:
+            owned = _ThreadConnections()
+            self._local.owned = owned
+            finalizer = weakref.finalize(owned, self._release, owned.connections)
+            with self._lock:
+                self._finalizers = [f for f in self._finalizers if f.alive]
+                self._finalizers.append(finalizer)
+        return owned
+
+    def _release(self, connections: List[sqlite3.Connection]) -> None:
+        """Закрывает соединения завершившегося потока."""
+        with self._lock:
+            self._connections = [conn for conn in self._connections
+                                 if all(conn is not own for own in connections)]
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        connections.clear()
+
+    def _shared(self) -> SerializedConnection:
+        """Возвращает соединение базы в памяти, общее для всех потоков."""
+        with self._lock:
+            conn = self._shared_conn
+        if conn is None:
+            conn = SerializedConnection(self._connect(read_only=False))
+            with self._lock:
+                if self._shared_conn is None:
+                    self._shared_conn = conn
+                    conn = None
+            if conn is not None:
+                # Другой поток успел создать соединение раньше
+                self._release([conn.raw])
+            conn = self._shared_conn
+        return conn
+
+    def writer(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока для записи."""
+        if self.shared:
+            return self._shared()
+        owned = self._thread_connections()
+        if owned.writer is None:
+            owned.writer = self._connect(read_only=False)
+            owned.connections.append(owned.writer)
+        return owned.writer
+
+    def reader(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока только для чтения."""
+        if self.shared:
+            return self._shared()
+        owned = self._thread_connections()
+        if owned.reader is None:
+            # Файл базы должен существовать до открытия в режиме только для чтения
+            self.writer()
+            owned.reader = self._connect(read_only=True)
+            owned.connections.append(owned.reader)
+        return owned.reader
+
+    def connection_count(self) -> int:
+        """Количество открытых соединений пула."""
+        with self._lock:
+            return len(self._connections)
+
+    def close_all(self) -> None:
+        """Закрывает все соединения пула."""
+        with self._lock:
+            finalizers, self._finalizers = self._finalizers, []
+        for finalizer in finalizers:
+            finalizer()
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+        self._shared_conn = None
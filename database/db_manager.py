@@ -6,31 +6,126 @@
 
 import sqlite3
 import json
-from typing import List, Dict, Any, Optional
+import re
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterable
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-import shutil
+import threading
+import time
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from core.prf import (
+    PrimitiveFunction, function_from_dict, structural_hash, definition_arity,
+    definition_node_count, render_definition, definition_nodes, definition_from_parts,
+    definition_node_hashes, definition_children, definition_params, definition_references,
+    Reference, LazyFunction, link_references, function_hash
+)
+from database.connection_pool import ConnectionPool
+from database.history_writer import HistoryWriteError, HistoryWriter
+from core.validator import Validator
+from database.library_io import (
+    open_library_file, library_line, iter_library_lines, batched,
+    open_binary_library_file, write_binary_library_header, binary_library_record,
+    iter_binary_library
+)
+from core.codec import encode_definition, decode_definition
+from core.tables import ValueTableSet, TableProgress, build_value_table
+from core.fingerprint import canonical_hash, behaviour_fingerprint
+from core.serialization import dumps, loads, is_flat_definition, definition_from_flat
+from database.versions import (
+    SNAPSHOT_INTERVAL, encode_nodes, decode_nodes, version_delta, needs_snapshot,
+    build_definition, reachable_nodes
+)
+from database.backup import (
+    DEFAULT_BACKUP_PAGES, ProgressCallback, BackupScheduler, run_backup
+)
+from database.history_retention import HISTORY_DELETE_BATCH, RetentionPolicy, HistoryCompactor
 
 
 class DatabaseManager:
     """Менеджер базы данных для PRF Constructor."""
     
-    def __init__(self, db_path: str = "prf_constructor.db"):
+    def __init__(self, db_path: str = "prf_constructor.db",
+                 result_cache_max_bytes: int = 64 * 1024 * 1024,
+                 journal_mode: str = "WAL", synchronous: str = "NORMAL",
+                 cache_size: int = -65536, mmap_size: int = 256 * 1024 * 1024,
+                 async_history: bool = False, history_batch_size: int = 500,
+                 history_flush_ms: int = 50, history_durability: str = "normal"):
         """
         Args:
             db_path: Путь к файлу базы данных
+            result_cache_max_bytes: Максимальный размер кэша результатов в байтах
+            journal_mode: Режим журнала SQLite
+            synchronous: Прагма synchronous для соединений записи
+            cache_size: Прагма cache_size (отрицательное значение - в КиБ)
+            mmap_size: Прагма mmap_size в байтах
+            async_history: Если True, история пишется фоновым потоком пакетами
+            history_batch_size: Размер пакета отложенной записи истории
+            history_flush_ms: Максимальная задержка отложенной записи истории
+            history_durability: Надежность отложенной записи: "fast", "normal", "safe"
         """
         self.db_path = db_path
-        self.conn: Optional[sqlite3.Connection] = None
+        self.result_cache_max_bytes = result_cache_max_bytes
+        self._result_cache_bytes: Optional[int] = None
+        # Попадания в кэш результатов, еще не записанные в базу:
+        # (хэш, аргументы) -> [количество, время последнего попадания (julianday)]
+        self._pending_hits: Dict[Tuple[str, str], List[float]] = {}
+        self._pending_hits_lock = threading.Lock()
+        # Единственный поток фоновых копий: соединения пула создаются в нем
+        # один раз, а копии выполняются по очереди
+        self._backup_executor: Optional[ThreadPoolExecutor] = None
+        self._backup_executor_lock = threading.Lock()
+        self.fts_available = False
+        # Уже разобранные функции: id -> ((updated_at, hash, content_hash), функция).
+        # Хэш содержимого меняется и при изменении целей ссылок по имени
+        self._function_cache: "OrderedDict[int, tuple]" = OrderedDict()
+        self.function_cache_size = 256
+        # Кэш общий для потоков (у каждого потока свои соединения)
+        self._function_cache_lock = threading.Lock()
+        # Уже собранные поддеревья определений: хэш узла -> определение
+        self._node_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.node_cache_size = 4096
+        self._node_cache_lock = threading.Lock()
+        # Функции, ссылки которых связывает текущий поток (для поиска циклов)
+        self._linking = threading.local()
+        self._pool: Optional[ConnectionPool] = ConnectionPool(
+            db_path, journal_mode=journal_mode, synchronous=synchronous,
+            cache_size=cache_size, mmap_size=mmap_size
+        )
         self._initialize_database()
+        
+        # Каталог предвычисленных таблиц значений рядом с файлом базы
+        self.tables_dir: Optional[str] = (
+            None if self._pool.shared else str(Path(db_path).with_suffix(".tables"))
+        )
+        self._value_tables: Optional[ValueTableSet] = None
+        
+        # База в памяти доступна только через общее соединение, поэтому
+        # для нее история всегда пишется синхронно
+        self._history_writer: Optional[HistoryWriter] = None
+        if async_history and not self._pool.shared:
+            self._history_writer = HistoryWriter(
+                self._pool, batch_size=history_batch_size,
+                flush_interval_ms=history_flush_ms, durability=history_durability
+            )
+    
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        """Соединение текущего потока для записи."""
+        return self._pool.writer() if self._pool else None
+    
+    @property
+    def read_conn(self) -> Optional[sqlite3.Connection]:
+        """Соединение текущего потока только для чтения."""
+        return self._pool.reader() if self._pool else None
     
     def _initialize_database(self) -> None:
         """Инициализирует базу данных и создает таблицы."""
         schema_path = Path(__file__).parent / "schema.sql"
         
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
-        
         # Читаем и выполняем схему
         if schema_path.exists():
             with open(schema_path, 'r', encoding='utf-8') as f:
@@ -40,8 +135,489 @@ class DatabaseManager:
             # Создаем таблицы программно, если schema.sql не найден
             self._create_tables()
         
+        self._migrate()
         self.conn.commit()
     
+    # Колонки, добавленные после создания исходных таблиц
+    _MIGRATIONS = {
+        "slow_evaluations": {
+            "peak_memory": "INTEGER",
+            "trace_memory": "INTEGER",
+            "largest_int_bits": "INTEGER",
+        },
+        "functions": {
+            "hash": "TEXT",
+            "arity": "INTEGER",
+            "node_count": "INTEGER",
+            "size": "INTEGER",
+            "updated_at": "TIMESTAMP",
+            "rendered": "TEXT",
+            "content_hash": "TEXT",
+        },
+        "history": {
+            "steps": "INTEGER",
+            "elapsed": "REAL",
+            "depth": "INTEGER",
+            "engine": "TEXT",
+            "cache_hit": "INTEGER",
+        },
+    }
+    
+    # Индексы и исправления данных для колонок из миграций
+    # (выполняются после добавления колонок)
+    _POST_MIGRATION = [
+        "CREATE INDEX IF NOT EXISTS idx_functions_hash ON functions(hash)",
+        "CREATE INDEX IF NOT EXISTS idx_functions_content_hash ON functions(content_hash)",
+        # Функции без ссылок: хэш содержимого совпадает с хэшем определения
+        """
+        UPDATE functions SET content_hash = hash
+        WHERE content_hash IS NULL AND hash IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM function_dependencies d WHERE d.function_id = functions.id
+        )
+        """,
+        "UPDATE functions SET updated_at = created_at WHERE updated_at IS NULL",
+        # Одноколоночные индексы истории заменены составными
+        "DROP INDEX IF EXISTS idx_history_function_id",
+        "DROP INDEX IF EXISTS idx_history_timestamp",
+        # Индексы истории по функции покрывают ключ страницы и флаг кэша,
+        # поэтому создаются после добавления колонки cache_hit
+        "DROP INDEX IF EXISTS idx_history_function_timestamp",
+        "DROP INDEX IF EXISTS idx_history_function_arguments",
+        "CREATE INDEX IF NOT EXISTS idx_history_function_page ON history(function_id, timestamp, id, cache_hit)",
+        "CREATE INDEX IF NOT EXISTS idx_history_function_costs ON history(function_id, arguments, timestamp, id, cache_hit)",
+    ]
+    
+    def _migrate(self) -> None:
+        """Добавляет недостающие колонки в таблицы существующих баз данных."""
+        for table, columns in self._MIGRATIONS.items():
+            existing = {
+                row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")
+            }
+            for column, declaration in columns.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        
+        for statement in self._POST_MIGRATION:
+            self.conn.execute(statement)
+        
+        self._backfill_functions()
+        self._normalise_definitions()
+        self._backfill_versions()
+        self._create_history_rollup()
+        self._create_full_text_index()
+    
+    # Полнотекстовый индекс по имени, описанию и текстовой записи определения,
+    # синхронизируемый с таблицей функций триггерами
+    _FTS_SCHEMA = [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS functions_fts USING fts5(
+            name, description, rendered, content='functions', content_rowid='id'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS functions_fts_insert AFTER INSERT ON functions BEGIN
+            INSERT INTO functions_fts(rowid, name, description, rendered)
+            VALUES (new.id, new.name, new.description, new.rendered);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS functions_fts_delete AFTER DELETE ON functions BEGIN
+            INSERT INTO functions_fts(functions_fts, rowid, name, description, rendered)
+            VALUES ('delete', old.id, old.name, old.description, old.rendered);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS functions_fts_update AFTER UPDATE ON functions BEGIN
+            INSERT INTO functions_fts(functions_fts, rowid, name, description, rendered)
+            VALUES ('delete', old.id, old.name, old.description, old.rendered);
+            INSERT INTO functions_fts(rowid, name, description, rendered)
+            VALUES (new.id, new.name, new.description, new.rendered);
+        END
+        """,
+    ]
+    
+    def _create_full_text_index(self) -> None:
+        """Создает полнотекстовый индекс FTS5, если SQLite его поддерживает."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'functions_fts'"
+        ).fetchone()
+        try:
+            for statement in self._FTS_SCHEMA:
+                self.conn.execute(statement)
+        except sqlite3.OperationalError:
+            # SQLite собран без FTS5 - поиск будет использовать LIKE
+            self.fts_available = False
+            return
+        if not exists:
+            # Индексируем функции, сохраненные до появления индекса
+            self.conn.execute("INSERT INTO functions_fts(functions_fts) VALUES ('rebuild')")
+        self.fts_available = True
+    
+    # Сводная статистика истории по функциям и дням, пополняемая триггером
+    # при вставке (удаление записей истории сводку не уменьшает).
+    # history_rollup_arguments хранит наборы аргументов последних дней,
+    # чтобы считать различные наборы без просмотра истории. Шаги и время
+    # результатов из кэша в статистику стоимости не входят.
+    _ROLLUP_SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS history_rollup (
+            function_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            calls INTEGER NOT NULL,
+            argument_sets INTEGER NOT NULL,
+            measured_steps INTEGER NOT NULL,
+            min_steps INTEGER,
+            max_steps INTEGER,
+            total_steps INTEGER NOT NULL,
+            measured_time INTEGER NOT NULL,
+            min_elapsed REAL,
+            max_elapsed REAL,
+            total_elapsed REAL NOT NULL,
+            PRIMARY KEY(function_id, day)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS history_rollup_arguments (
+            function_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            arguments TEXT NOT NULL,
+            PRIMARY KEY(function_id, day, arguments)
+        ) WITHOUT ROWID
+        """,
+        # Триггер пересоздается, чтобы существующие базы получали его текущую версию
+        "DROP TRIGGER IF EXISTS history_rollup_insert",
+        """
+        CREATE TRIGGER history_rollup_insert AFTER INSERT ON history
+        WHEN new.function_id IS NOT NULL BEGIN
+            INSERT INTO history_rollup (
+                function_id, day, calls, argument_sets,
+                measured_steps, min_steps, max_steps, total_steps,
+                measured_time, min_elapsed, max_elapsed, total_elapsed
+            )
+            VALUES (
+                new.function_id, date(new.timestamp), 1,
+                NOT EXISTS (
+                    SELECT 1 FROM history_rollup_arguments
+                    WHERE function_id = new.function_id AND day = date(new.timestamp)
+                      AND arguments = new.arguments
+                ),
+                iif(new.cache_hit, NULL, new.steps) IS NOT NULL,
+                iif(new.cache_hit, NULL, new.steps), iif(new.cache_hit, NULL, new.steps),
+                coalesce(iif(new.cache_hit, NULL, new.steps), 0),
+                iif(new.cache_hit, NULL, new.elapsed) IS NOT NULL,
+                iif(new.cache_hit, NULL, new.elapsed), iif(new.cache_hit, NULL, new.elapsed),
+                coalesce(iif(new.cache_hit, NULL, new.elapsed), 0)
+            )
+            ON CONFLICT(function_id, day) DO UPDATE SET
+                calls = calls + 1,
+                argument_sets = argument_sets + excluded.argument_sets,
+                measured_steps = measured_steps + excluded.measured_steps,
+                min_steps = coalesce(min(min_steps, excluded.min_steps), min_steps, excluded.min_steps),
+                max_steps = coalesce(max(max_steps, excluded.max_steps), max_steps, excluded.max_steps),
+                total_steps = total_steps + excluded.total_steps,
+                measured_time = measured_time + excluded.measured_time,
+                min_elapsed = coalesce(min(min_elapsed, excluded.min_elapsed), min_elapsed, excluded.min_elapsed),
+                max_elapsed = coalesce(max(max_elapsed, excluded.max_elapsed), max_elapsed, excluded.max_elapsed),
+                total_elapsed = total_elapsed + excluded.total_elapsed;
+            INSERT OR IGNORE INTO history_rollup_arguments (function_id, day, arguments)
+            VALUES (new.function_id, date(new.timestamp), new.arguments);
+        END
+        """,
+    ]
+    
+    # Количество последних дней, для которых хранятся наборы аргументов
+    ROLLUP_ARGUMENT_DAYS = 2
+    
+    def _create_history_rollup(self) -> None:
+        """Создает сводную статистику истории и заполняет ее по существующей истории."""
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_rollup'"
+        ).fetchone()
+        for statement in self._ROLLUP_SCHEMA:
+            self.conn.execute(statement)
+        if not exists:
+            self._fill_history_rollup()
+    
+    def _fill_history_rollup(self) -> None:
+        """Строит сводную статистику по всей таблице истории."""
+        self.conn.execute("""
+            INSERT INTO history_rollup
+            SELECT function_id, day, COUNT(*), COUNT(DISTINCT arguments),
+                   COUNT(steps), MIN(steps), MAX(steps), coalesce(SUM(steps), 0),
+                   COUNT(elapsed), MIN(elapsed), MAX(elapsed), TOTAL(elapsed)
+            FROM (
+                SELECT function_id, date(timestamp) AS day, arguments,
+                       iif(cache_hit, NULL, steps) AS steps,
+                       iif(cache_hit, NULL, elapsed) AS elapsed
+                FROM history
+                WHERE function_id IS NOT NULL
+            )
+            GROUP BY function_id, day
+        """)
+        self.conn.execute("""
+            INSERT OR IGNORE INTO history_rollup_arguments (function_id, day, arguments)
+            SELECT function_id, date(timestamp), arguments FROM history
+            WHERE function_id IS NOT NULL AND timestamp >= date('now', ?)
+        """, (f"-{self.ROLLUP_ARGUMENT_DAYS - 1} days",))
+    
+    def rebuild_history_rollup(self) -> None:
+        """
+        Пересчитывает сводную статистику по записям, оставшимся в истории.
+        
+        Статистика удаленных политикой хранения записей при этом теряется.
+        """
+        self.flush_history()
+        with self.conn:
+            self.conn.execute("DELETE FROM history_rollup")
+            self.conn.execute("DELETE FROM history_rollup_arguments")
+            self._fill_history_rollup()
+    
+    # Время изменения с миллисекундами: ключ кэша разобранных функций
+    _NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+    
+    # Производные колонки функций, вычисляемые по определению
+    _FUNCTION_COLUMNS = ("hash", "arity", "node_count", "size", "rendered")
+    
+    # Максимальная длина текстовой записи определения для поиска
+    RENDERED_MAX_LENGTH = 65536
+    
+    @staticmethod
+    def _function_columns(definition: Dict[str, Any],
+                          definition_json: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Вычисляет производные колонки функции по ее определению.
+        
+        Args:
+            definition: Определение функции (словарь)
+            definition_json: Сериализованное определение, если уже вычислено
+            
+        Returns:
+            Словарь колонка -> значение
+        """
+        if definition_json is None:
+            definition_json = dumps(definition, ensure_ascii=False)
+        return {
+            "hash": structural_hash(definition),
+            "arity": definition_arity(definition),
+            "node_count": definition_node_count(definition),
+            "size": len(definition_json.encode("utf-8")),
+            "rendered": render_definition(definition, DatabaseManager.RENDERED_MAX_LENGTH),
+        }
+    
+    def _backfill_functions(self) -> None:
+        """Заполняет производные колонки у функций, сохраненных до их появления."""
+        missing = " OR ".join(f"{column} IS NULL" for column in self._FUNCTION_COLUMNS)
+        rows = self.conn.execute(
+            f"SELECT id, definition FROM functions WHERE {missing}"
+        ).fetchall()
+        for row in rows:
+            values = self._function_columns(self._resolve_definition(row["definition"]))
+            assignments = ", ".join(f"{column} = ?" for column in values)
+            self.conn.execute(
+                f"UPDATE functions SET {assignments} WHERE id = ?",
+                (*values.values(), row["id"])
+            )
+    
+    # Определение функции хранится как ссылка на корневой узел в таблице nodes
+    _ROOT_TYPE = "node"
+    
+    @classmethod
+    def _root_definition(cls, root_hash: str) -> str:
+        """Возвращает хранимое определение-ссылку на корневой узел."""
+        return json.dumps({"type": cls._ROOT_TYPE, "hash": root_hash})
+    
+    @staticmethod
+    def _node_rows(nodes: List[tuple]) -> Dict[str, tuple]:
+        """
+        Преобразует узлы definition_nodes в строки таблиц nodes и node_edges.
+        
+        Returns:
+            Словарь хэш -> (строка nodes, список строк node_edges)
+        """
+        return {
+            node_hash: (
+                (node_hash, json.dumps(params, ensure_ascii=False, sort_keys=True),
+                 json.dumps(child_hashes)),
+                [(node_hash, position, child) for position, child in enumerate(child_hashes)]
+            )
+            for node_hash, params, child_hashes in nodes
+        }
+    
+    def _store_nodes(self, node_rows: Dict[str, tuple]) -> None:
+        """Записывает узлы; уже сохраненные поддеревья не дублируются."""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO nodes (hash, params, children) VALUES (?, ?, ?)",
+            [node for node, _ in node_rows.values()]
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO node_edges (parent, position, child) VALUES (?, ?, ?)",
+            [edge for _, edges in node_rows.values() for edge in edges]
+        )
+    
+    def _normalise_definitions(self) -> None:
+        """Переносит определения, сохраненные целиком, в таблицу узлов."""
+        rows = self.conn.execute(f"""
+            SELECT id, definition FROM functions
+            WHERE json_extract(definition, '$.type') IS NOT '{self._ROOT_TYPE}'
+        """).fetchall()
+        for row in rows:
+            nodes = definition_nodes(loads(row["definition"]))
+            self._store_nodes(self._node_rows(nodes))
+            self.conn.execute(
+                "UPDATE functions SET definition = ? WHERE id = ?",
+                (self._root_definition(nodes[0][0]), row["id"])
+            )
+    
+    def _resolve_definition(self, definition_json: str) -> Dict[str, Any]:
+        """
+        Возвращает полное определение по хранимому значению колонки definition.
+        
+        Поддеревья собираются из таблицы узлов и разделяются между
+        определениями через кэш, поэтому возвращаемые словари нельзя изменять.
+        """
+        definition = loads(definition_json)
+        if definition.get("type") != self._ROOT_TYPE:
+            return definition
+        return self.load_node(definition["hash"])
+    
+    def _load_node_parts(self, node_hash: str) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Читает один узел: параметры и хэши дочерних узлов (загрузчик LazyFunction).
+        
+        Raises:
+            ValueError: Если узел не найден
+        """
+        row = self.read_conn.execute(
+            "SELECT params, children FROM nodes WHERE hash = ?", (node_hash,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"Node {node_hash} not found")
+        return json.loads(row["params"]), json.loads(row["children"])
+    
+    def load_node(self, node_hash: str) -> Optional[Dict[str, Any]]:
+        """
+        Собирает определение поддерева по хэшу его корневого узла.
+        
+        Все узлы поддерева читаются одним рекурсивным запросом; поддеревья,
+        уже собранные для других функций, берутся из кэша.
+        
+        Args:
+            node_hash: Структурный хэш узла
+            
+        Returns:
+            Определение (словарь) или None, если узел не найден
+        """
+        with self._node_cache_lock:
+            cached = self._node_cache.get(node_hash)
+            if cached is not None:
+                self._node_cache.move_to_end(node_hash)
+                return cached
+        
+        rows = self.read_conn.execute("""
+            WITH RECURSIVE subtree(hash) AS (
+                SELECT ?
+                UNION
+                SELECT e.child FROM node_edges e JOIN subtree s ON e.parent = s.hash
+            )
+            SELECT n.hash, n.params, n.children FROM nodes n JOIN subtree USING (hash)
+        """, (node_hash,)).fetchall()
+        stored = {row["hash"]: row for row in rows}
+        if node_hash not in stored:
+            return None
+        
+        # Собираем узлы снизу вверх без рекурсии
+        built: Dict[str, Dict[str, Any]] = {}
+        stack = [(node_hash, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if current in built:
+                continue
+            with self._node_cache_lock:
+                cached = self._node_cache.get(current)
+            if cached is not None:
+                built[current] = cached
+                continue
+            children = json.loads(stored[current]["children"])
+            if expanded or not children:
+                built[current] = definition_from_parts(
+                    json.loads(stored[current]["params"]), [built[child] for child in children]
+                )
+            else:
+                stack.append((current, True))
+                stack.extend((child, False) for child in reversed(children))
+        
+        with self._node_cache_lock:
+            for current, definition in built.items():
+                self._node_cache[current] = definition
+                self._node_cache.move_to_end(current)
+            while len(self._node_cache) > self.node_cache_size:
+                self._node_cache.popitem(last=False)
+        return built[node_hash]
+    
+    def find_functions_containing(self, subtree: Any) -> List[Dict[str, Any]]:
+        """
+        Находит функции, определения которых содержат поддерево.
+        
+        Args:
+            subtree: Структурный хэш узла или определение поддерева (словарь)
+            
+        Returns:
+            Список метаданных функций
+        """
+        node_hash = subtree if isinstance(subtree, str) else structural_hash(subtree)
+        cursor = self.read_conn.execute(f"""
+            WITH RECURSIVE ancestors(hash) AS (
+                SELECT ?
+                UNION
+                SELECT e.parent FROM node_edges e JOIN ancestors a ON e.child = a.hash
+            )
+            SELECT {self._METADATA_SELECT} FROM functions
+            WHERE hash IN ancestors
+            ORDER BY name
+        """, (node_hash,))
+        return [self._metadata_from_row(row) for row in cursor.fetchall()]
+    
+    def collect_unused_nodes(self) -> int:
+        """
+        Удаляет узлы, не достижимые ни из одной функции.
+        
+        Returns:
+            Количество удаленных узлов
+        """
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS temp.live_nodes")
+            self.conn.execute("""
+                CREATE TEMP TABLE live_nodes AS
+                WITH RECURSIVE live(hash) AS (
+                    SELECT hash FROM functions WHERE hash IS NOT NULL
+                    UNION
+                    SELECT e.child FROM node_edges e JOIN live l ON e.parent = l.hash
+                )
+                SELECT hash FROM live
+            """)
+            removed = self.conn.execute(
+                "DELETE FROM nodes WHERE hash NOT IN (SELECT hash FROM temp.live_nodes)"
+            ).rowcount
+            self.conn.execute(
+                "DELETE FROM node_edges WHERE parent NOT IN (SELECT hash FROM temp.live_nodes)"
+            )
+            self.conn.execute("DROP TABLE temp.live_nodes")
+        return removed
+    
+    def get_node_stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику хранения узлов.
+        
+        Returns:
+            Словарь: nodes - хранимых узлов, logical_nodes - суммарное
+            количество узлов в определениях всех функций
+        """
+        nodes = self.read_conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+        logical = self.read_conn.execute(
+            "SELECT COALESCE(SUM(node_count), 0) FROM functions"
+        ).fetchone()[0]
+        return {"nodes": nodes, "logical_nodes": logical}
+    
     def _create_tables(self) -> None:
         """Создает таблицы базы данных."""
         cursor = self.conn.cursor()
@@ -53,9 +629,78 @@ class DatabaseManager:
                 name TEXT UNIQUE NOT NULL,
                 definition TEXT NOT NULL,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                description TEXT
+                description TEXT,
+                hash TEXT,
+                arity INTEGER,
+                node_count INTEGER,
+                size INTEGER,
+                updated_at TIMESTAMP,
+                rendered TEXT,
+                content_hash TEXT
+            )
+        """)
+        
+        # Узлы определений, общие для всех функций (ключ - структурный хэш)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS nodes (
+                hash TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                children TEXT NOT NULL
             )
         """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS node_edges (
+                parent TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                child TEXT NOT NULL,
+                PRIMARY KEY(parent, position)
+            ) WITHOUT ROWID
+        """)
+        
+        # Индекс зависимостей: ссылки функций на другие функции
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS function_dependencies (
+                function_id INTEGER NOT NULL,
+                target_name TEXT,
+                target_hash TEXT,
+                FOREIGN KEY(function_id) REFERENCES functions(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # История версий определений (дельты узлов и полные снимки)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS function_versions (
+                function_id INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                snapshot INTEGER NOT NULL,
+                root_hash TEXT NOT NULL,
+                nodes TEXT NOT NULL,
+                description TEXT,
+                created_at TIMESTAMP,
+                PRIMARY KEY(function_id, version)
+            ) WITHOUT ROWID
+        """)
+        
+        # Удаленные функции с сохраненными версиями
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS deleted_functions (
+                name TEXT PRIMARY KEY,
+                function_id INTEGER NOT NULL,
+                deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Канонические хэши и поведенческие отпечатки определений
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS function_fingerprints (
+                content_hash TEXT PRIMARY KEY,
+                canonical_hash TEXT,
+                fingerprint TEXT,
+                probe_prefix TEXT,
+                probe_values TEXT,
+                error TEXT
+            ) WITHOUT ROWID
+        """)
         
         # Таблица истории
         cursor.execute("""
@@ -65,6 +710,11 @@ class DatabaseManager:
                 arguments TEXT NOT NULL,
                 result TEXT NOT NULL,
                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                steps INTEGER,
+                elapsed REAL,
+                depth INTEGER,
+                engine TEXT,
+                cache_hit INTEGER,
                 FOREIGN KEY(function_id) REFERENCES functions(id) ON DELETE CASCADE
             )
         """)
@@ -80,244 +730,2056 @@ class DatabaseManager:
             )
         """)
         
-        # Индексы
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_functions_name ON functions(name)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_function_id ON history(function_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp)")
+        # Журнал медленных вычислений
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS slow_evaluations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                function_id INTEGER,
+                arguments TEXT NOT NULL,
+                steps INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                elapsed REAL NOT NULL,
+                engine TEXT NOT NULL,
+                error TEXT,
+                peak_memory INTEGER,
+                trace_memory INTEGER,
+                largest_int_bits INTEGER,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(function_id) REFERENCES functions(id) ON DELETE CASCADE
+            )
+        """)
+        
+        # Контрольные точки долгих вычислений
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                function_hash TEXT NOT NULL,
+                arguments TEXT NOT NULL,
+                state TEXT NOT NULL,
+                steps INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Кэш результатов по структурному хэшу функции и аргументам
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                function_hash TEXT NOT NULL,
+                arguments TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                last_used REAL NOT NULL,
+                PRIMARY KEY(function_hash, arguments)
+            )
+        """)
+        
+        # Индексы
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_functions_name ON functions(name)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp_id ON history(timestamp, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_function_fingerprints_canonical ON function_fingerprints(canonical_hash)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_function_fingerprints_fingerprint ON function_fingerprints(fingerprint)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_function_fingerprints_prefix ON function_fingerprints(probe_prefix)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_slow_evaluations_function_id ON slow_evaluations(function_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_slow_evaluations_elapsed ON slow_evaluations(elapsed)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_slow_evaluations_steps ON slow_evaluations(steps)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_checkpoints_key ON checkpoints(function_hash, arguments, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_last_used ON result_cache(last_used)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_node_edges_child ON node_edges(child)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_function_dependencies_function ON function_dependencies(function_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_function_dependencies_name ON function_dependencies(target_name)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_function_dependencies_hash ON function_dependencies(target_hash)")
+    
+    def save_function(self, name: str, definition: Dict[str, Any], 
+                     description: Optional[str] = None) -> int:
+        """
+        Сохраняет функцию в базу данных.
+        
+        Args:
+            name: Имя функции
+            definition: Определение функции (словарь)
+            description: Описание функции
+            
+        Returns:
+            ID сохраненной функции
+            
+        Raises:
+            sqlite3.IntegrityError: Если функция с таким именем уже существует
+        """
+        cursor = self.conn.cursor()
+        nodes = definition_nodes(definition)
+        columns = self._function_columns(definition)
+        definition_json = self._root_definition(columns["hash"])
+        self._store_nodes(self._node_rows(nodes))
+        
+        cursor.execute("SELECT content_hash FROM functions WHERE name = ?", (name,))
+        previous = cursor.fetchone()
+        
+        # Хэш содержимого функции со ссылками вычисляется после связывания
+        columns["content_hash"] = None if definition_references(definition) else columns["hash"]
+        names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        
+        try:
+            cursor.execute(f"""
+                INSERT INTO functions (name, definition, description, updated_at, {names})
+                VALUES (?, ?, ?, {self._NOW}, {placeholders})
+            """, (name, definition_json, description, *columns.values()))
+            function_id = cursor.lastrowid
+            self._reattach_versions({name: function_id})
+        except sqlite3.IntegrityError:
+            # Обновляем существующую функцию; время создания сохраняется,
+            # а предыдущее определение остается в истории версий
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            cursor.execute(f"""
+                UPDATE functions 
+                SET definition = ?, description = ?,
+                    updated_at = {self._NOW}, {assignments}
+                WHERE name = ?
+            """, (definition_json, description, *columns.values(), name))
+            cursor.execute("SELECT id FROM functions WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            function_id = row[0] if row else None
+        
+        if function_id is not None:
+            self._update_dependencies(function_id, definition)
+            self._record_versions([(function_id, nodes, description)])
+        self.conn.commit()
+        self._relink_dependents(name, previous["content_hash"] if previous else None)
+        return function_id
+    
+    def _update_dependencies(self, function_id: int, definition: Dict[str, Any]) -> None:
+        """Перестраивает записи индекса зависимостей функции."""
+        self.conn.execute(
+            "DELETE FROM function_dependencies WHERE function_id = ?", (function_id,)
+        )
+        self.conn.executemany(
+            "INSERT INTO function_dependencies (function_id, target_name, target_hash) "
+            "VALUES (?, ?, ?)",
+            [(function_id, ref.get("name"), ref.get("hash"))
+             for ref in definition_references(definition)]
+        )
+    
+    def _relink_dependents(self, name: str, previous_hash: Optional[str]) -> None:
+        """
+        Обновляет функции, зависящие от измененной или удаленной функции name.
+        
+        Затрагиваются только функции, ссылающиеся на name по имени (в том
+        числе косвенно): их объекты удаляются из кэша, хэши содержимого
+        пересчитываются, а результаты и отпечатки прежних версий удаляются.
+        """
+        ids = [entry["id"] for entry in self.get_dependents(name)]
+        own = self.conn.execute("SELECT id FROM functions WHERE name = ?", (name,)).fetchone()
+        old_hashes = {previous_hash}
+        with self._function_cache_lock:
+            for function_id in ids:
+                self._function_cache.pop(function_id, None)
+        if ids:
+            placeholders = ", ".join("?" * len(ids))
+            old_hashes.update(row[0] for row in self.conn.execute(
+                f"SELECT content_hash FROM functions WHERE id IN ({placeholders})", ids
+            ))
+            self.conn.execute(
+                f"UPDATE functions SET content_hash = NULL WHERE id IN ({placeholders})", ids
+            )
+        self._compute_content_hashes(ids + ([own["id"]] if own else []))
+        
+        current = {row[0] for row in self.conn.execute(
+            f"SELECT content_hash FROM functions WHERE name = ? OR id IN ({', '.join('?' * len(ids))})",
+            (name, *ids)
+        )}
+        for function_hash in old_hashes - current - {None}:
+            # Определение изменилось - результаты старой версии больше не нужны
+            self._invalidate_cached_results(function_hash)
+        self.conn.commit()
+    
+    def _compute_content_hashes(self, ids: Iterable[int]) -> None:
+        """
+        Вычисляет хэши содержимого функций со ссылками.
+        
+        Хэш содержимого - структурный хэш функции со связанными ссылками;
+        по нему вычислитель ищет результаты в кэше. Функции с
+        неразрешимыми ссылками остаются без хэша.
+        
+        Args:
+            ids: Функции, хэши которых могли измениться (пересчитываются
+                только функции без хэша)
+        """
+        rows = []
+        for chunk in batched(list(ids), 500):
+            rows.extend(self.conn.execute(
+                f"SELECT id FROM functions WHERE content_hash IS NULL "
+                f"AND id IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        for row in rows:
+            try:
+                function = self.load_function_object(function_id=row["id"])
+            except ValueError:
+                continue
+            self.conn.execute(
+                "UPDATE functions SET content_hash = ? WHERE id = ?",
+                (function_hash(function), row["id"])
+            )
+    
+    def get_dependencies(self, function_id: int) -> List[Dict[str, Any]]:
+        """
+        Возвращает функции, на которые ссылается функция.
+        
+        Args:
+            function_id: ID функции
+            
+        Returns:
+            Список ссылок: словари с name и hash
+        """
+        cursor = self.read_conn.execute("""
+            SELECT target_name, target_hash FROM function_dependencies
+            WHERE function_id = ?
+            ORDER BY target_name, target_hash
+        """, (function_id,))
+        return [{"name": row["target_name"], "hash": row["target_hash"]} for row in cursor]
+    
+    def _dependent_ids(self, names: Iterable[str]) -> List[int]:
+        """ID функций names и всех функций, ссылающихся на них по имени."""
+        ids: set = set()
+        for chunk in batched(list(names), 500):
+            ids.update(row[0] for row in self.conn.execute(f"""
+                WITH RECURSIVE dependents(id, name) AS (
+                    SELECT id, name FROM functions WHERE name IN ({', '.join('?' * len(chunk))})
+                    UNION
+                    SELECT f.id, f.name FROM dependents p
+                    JOIN function_dependencies d ON d.target_name = p.name
+                    JOIN functions f ON f.id = d.function_id
+                )
+                SELECT id FROM dependents
+            """, chunk))
+        return sorted(ids)
+    
+    def get_dependents(self, name: str, transitive: bool = True) -> List[Dict[str, Any]]:
+        """
+        Возвращает функции, ссылающиеся на функцию по имени.
+        
+        Только эти функции меняют поведение при изменении функции name;
+        ссылки по хэшу закрепляют конкретную версию.
+        
+        Args:
+            name: Имя функции
+            transitive: Учитывать ли косвенные ссылки
+            
+        Returns:
+            Список метаданных зависимых функций
+        """
+        columns = ", ".join(f"f.{column}" for column in self._METADATA_COLUMNS)
+        if transitive:
+            query = f"""
+                WITH RECURSIVE dependents(id, name) AS (
+                    SELECT f.id, f.name FROM function_dependencies d
+                    JOIN functions f ON f.id = d.function_id
+                    WHERE d.target_name = ?
+                    UNION
+                    SELECT f.id, f.name FROM dependents p
+                    JOIN function_dependencies d ON d.target_name = p.name
+                    JOIN functions f ON f.id = d.function_id
+                )
+                SELECT {columns} FROM functions f
+                WHERE f.id IN (SELECT id FROM dependents)
+                ORDER BY f.name
+            """
+        else:
+            query = f"""
+                SELECT {columns} FROM functions f
+                WHERE f.id IN (SELECT function_id FROM function_dependencies WHERE target_name = ?)
+                ORDER BY f.name
+            """
+        cursor = self.read_conn.execute(query, (name,))
+        return [self._metadata_from_row(row) for row in cursor.fetchall()]
+    
+    def link_definition(self, definition: Dict[str, Any],
+                        exclude_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Заменяет встроенные копии сохраненных функций ссылками на них по имени.
+        
+        Args:
+            definition: Определение функции (словарь)
+            exclude_name: Имя функции, на которую нельзя ссылаться (сама функция)
+            
+        Returns:
+            Новое определение со ссылками
+        """
+        hashes = definition_node_hashes(definition)
+        # При нескольких функциях с одним определением выбирается первая по имени
+        targets: Dict[str, Tuple[str, int]] = {}
+        unique = list(set(hashes.values()))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            for row in self.read_conn.execute(f"""
+                SELECT content_hash, name, arity FROM functions
+                WHERE content_hash IN ({', '.join('?' * len(chunk))}) AND name IS NOT ?
+                ORDER BY name DESC
+            """, (*chunk, exclude_name)):
+                targets[row["content_hash"]] = (row["name"], row["arity"])
+        
+        # Корень не заменяется ссылкой на самого себя
+        root_hash = hashes[id(definition)]
+        
+        # Собираем новое дерево снизу вверх без рекурсии
+        built: Dict[int, Dict[str, Any]] = {}
+        stack = [(definition, False)]
+        while stack:
+            node, expanded = stack.pop()
+            node_hash = hashes[id(node)]
+            if node is not definition and node_hash in targets and node_hash != root_hash:
+                name, arity = targets[node_hash]
+                built[id(node)] = Reference(name=name, arity=arity).to_dict()
+                continue
+            children = definition_children(node)
+            if expanded or not children:
+                built[id(node)] = definition_from_parts(
+                    definition_params(node), [built[id(child)] for child in children]
+                )
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+        return built[id(definition)]
+    
+    def _stored_nodes(self, root_hash: str) -> List[tuple]:
+        """
+        Читает узлы сохраненного определения.
+        
+        Returns:
+            Список (хэш, параметры, хэши дочерних узлов); корень - первый
+        """
+        rows = self.conn.execute("""
+            WITH RECURSIVE subtree(hash) AS (
+                SELECT ?
+                UNION
+                SELECT e.child FROM node_edges e JOIN subtree s ON e.parent = s.hash
+            )
+            SELECT n.hash, n.params, n.children FROM nodes n JOIN subtree USING (hash)
+        """, (root_hash,)).fetchall()
+        nodes = {row["hash"]: (json.loads(row["params"]), json.loads(row["children"]))
+                 for row in rows}
+        return reachable_nodes(root_hash, nodes)
+    
+    def _version_nodes(self, function_id: int, version: int) -> Dict[str, tuple]:
+        """Объединяет узлы версий от ближайшего полного снимка до указанной версии."""
+        rows = self.conn.execute("""
+            SELECT nodes FROM function_versions
+            WHERE function_id = ? AND version <= ? AND version >= (
+                SELECT MAX(version) FROM function_versions
+                WHERE function_id = ? AND version <= ? AND snapshot = 1
+            )
+            ORDER BY version
+        """, (function_id, version, function_id, version)).fetchall()
+        nodes: Dict[str, tuple] = {}
+        for row in rows:
+            nodes.update(decode_nodes(row["nodes"]))
+        return nodes
+    
+    def _record_versions(self, entries: Iterable[tuple]) -> None:
+        """
+        Записывает новые версии функций (в текущей транзакции).
+        
+        Версия хранит только узлы, которых не было в предыдущей версии, либо
+        полный снимок. Если определение и описание не изменились, версия не
+        создается.
+        
+        Args:
+            entries: Кортежи (id функции, узлы definition_nodes, описание)
+        """
+        entries = list(entries)
+        # Последние версии функций читаются пакетами
+        latest_versions: Dict[int, sqlite3.Row] = {}
+        for start in range(0, len(entries), 500):
+            chunk = [entry[0] for entry in entries[start:start + 500]]
+            for row in self.conn.execute(f"""
+                SELECT function_id, version, root_hash, description, (
+                    SELECT MAX(version) FROM function_versions
+                    WHERE function_id = v.function_id AND snapshot = 1
+                ) AS last_snapshot
+                FROM function_versions v
+                WHERE function_id IN ({', '.join('?' * len(chunk))}) AND version = (
+                    SELECT MAX(version) FROM function_versions WHERE function_id = v.function_id
+                )
+            """, chunk):
+                latest_versions[row["function_id"]] = row
+        
+        rows = []
+        # Одинаковые полные снимки сериализуются один раз
+        encoded: Dict[str, str] = {}
+        for function_id, nodes, description in entries:
+            root_hash = nodes[0][0]
+            latest = latest_versions.get(function_id)
+            if latest is None:
+                version, last_snapshot, delta = 1, 0, nodes
+            elif latest["root_hash"] == root_hash:
+                if latest["description"] == description:
+                    continue
+                version, last_snapshot, delta = latest["version"] + 1, latest["last_snapshot"], []
+            else:
+                version, last_snapshot = latest["version"] + 1, latest["last_snapshot"]
+                delta = version_delta(nodes, self._version_nodes(function_id, latest["version"]))
+            snapshot = needs_snapshot(version, last_snapshot, len(delta), len(nodes))
+            if snapshot:
+                payload = encoded.get(root_hash)
+                if payload is None:
+                    payload = encoded[root_hash] = encode_nodes(nodes)
+            else:
+                payload = encode_nodes(delta)
+            rows.append((function_id, version, int(snapshot), root_hash, payload, description))
+        self.conn.executemany(f"""
+            INSERT INTO function_versions
+                (function_id, version, snapshot, root_hash, nodes, description, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, {self._NOW})
+        """, rows)
+    
+    def _backfill_versions(self) -> None:
+        """Создает первую версию функций, сохраненных до появления истории версий."""
+        rows = self.conn.execute("""
+            SELECT id, hash, description FROM functions f
+            WHERE hash IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM function_versions v WHERE v.function_id = f.id
+            )
+        """).fetchall()
+        self._record_versions(
+            (row["id"], self._stored_nodes(row["hash"]), row["description"]) for row in rows
+        )
+    
+    def _reattach_versions(self, functions: Dict[str, int]) -> None:
+        """
+        Передает версии удаленных функций новым функциям с теми же именами
+        (в текущей транзакции).
+        
+        Args:
+            functions: Имя -> ID только что созданной функции
+        """
+        for chunk in batched(list(functions), 500):
+            rows = self.conn.execute(
+                f"SELECT name, function_id FROM deleted_functions "
+                f"WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE function_versions SET function_id = ? WHERE function_id = ?",
+                [(functions[row["name"]], row["function_id"]) for row in rows]
+            )
+            self.conn.executemany(
+                "DELETE FROM deleted_functions WHERE name = ?", [(row["name"],) for row in rows]
+            )
+    
+    def _versions_owner(self, function_id: Optional[int],
+                        name: Optional[str]) -> Optional[Tuple[int, str]]:
+        """ID и имя функции, которой принадлежат версии (удаленная - только по имени)."""
+        metadata = self.get_function_metadata(function_id=function_id, name=name)
+        if metadata is not None:
+            return metadata["id"], metadata["name"]
+        if name:
+            row = self.read_conn.execute(
+                "SELECT function_id FROM deleted_functions WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None:
+                return row["function_id"], name
+        return None
+    
+    def get_versions(self, function_id: Optional[int] = None,
+                     name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает версии функции, начиная с последней.
+        
+        Версии удаленной функции доступны по ее имени.
+        
+        Args:
+            function_id: ID функции
+            name: Имя функции
+            
+        Returns:
+            Список словарей с номером версии, хэшем определения, описанием,
+            временем создания, признаком полного снимка и количеством
+            хранимых узлов
+        """
+        owner = self._versions_owner(function_id, name)
+        if owner is None:
+            return []
+        rows = self.read_conn.execute("""
+            SELECT version, snapshot, root_hash, nodes, description, created_at
+            FROM function_versions WHERE function_id = ?
+            ORDER BY version DESC
+        """, (owner[0],)).fetchall()
+        return [
+            {
+                "version": row["version"],
+                "hash": row["root_hash"],
+                "description": row["description"],
+                "created_at": row["created_at"],
+                "snapshot": bool(row["snapshot"]),
+                "stored_nodes": len(decode_nodes(row["nodes"])),
+            }
+            for row in rows
+        ]
+    
+    def load_version(self, version: int, function_id: Optional[int] = None,
+                     name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Восстанавливает определение функции указанной версии.
+        
+        Читаются только версии от ближайшего полного снимка. Версии
+        удаленной функции доступны по ее имени.
+        
+        Args:
+            version: Номер версии
+            function_id: ID функции
+            name: Имя функции
+            
+        Returns:
+            Словарь с определением, описанием и хэшем версии или None
+        """
+        owner = self._versions_owner(function_id, name)
+        if owner is None:
+            return None
+        row = self.conn.execute("""
+            SELECT root_hash, description, created_at FROM function_versions
+            WHERE function_id = ? AND version = ?
+        """, (owner[0], version)).fetchone()
+        if row is None:
+            return None
+        nodes = self._version_nodes(owner[0], version)
+        return {
+            "version": version,
+            "definition": build_definition(row["root_hash"], nodes),
+            "description": row["description"],
+            "hash": row["root_hash"],
+            "created_at": row["created_at"],
+        }
+    
+    def rollback_function(self, version: int, function_id: Optional[int] = None,
+                          name: Optional[str] = None) -> Optional[int]:
+        """
+        Возвращает функцию к указанной версии.
+        
+        Откат сохраняется как новая версия, поэтому его тоже можно отменить.
+        Удаленная функция восстанавливается откатом по имени.
+        
+        Args:
+            version: Номер версии
+            function_id: ID функции
+            name: Имя функции
+            
+        Returns:
+            Номер новой версии или None, если версия не найдена
+        """
+        owner = self._versions_owner(function_id, name)
+        restored = self.load_version(version, function_id=function_id, name=name)
+        if owner is None or restored is None:
+            return None
+        saved_id = self.save_function(owner[1], restored["definition"], restored["description"])
+        row = self.conn.execute(
+            "SELECT MAX(version) FROM function_versions WHERE function_id = ?", (saved_id,)
+        ).fetchone()
+        return row[0]
+    
+    def compact_versions(self, keep: int = SNAPSHOT_INTERVAL,
+                         function_id: Optional[int] = None) -> int:
+        """
+        Удаляет старые версии, оставляя keep последних версий каждой функции.
+        
+        Самая старая из оставшихся версий переписывается полным снимком,
+        чтобы остальные версии по-прежнему восстанавливались.
+        
+        Args:
+            keep: Количество сохраняемых версий (не меньше 1)
+            function_id: ID функции (None - все функции)
+            
+        Returns:
+            Количество удаленных версий
+        """
+        keep = max(keep, 1)
+        condition = "WHERE function_id = ?" if function_id else ""
+        functions = self.conn.execute(f"""
+            SELECT function_id FROM function_versions {condition}
+            GROUP BY function_id HAVING COUNT(*) > ?
+        """, (function_id, keep) if function_id else (keep,)).fetchall()
+        
+        removed = 0
+        with self.conn:
+            for (current,) in functions:
+                oldest = self.conn.execute("""
+                    SELECT version, snapshot, root_hash FROM function_versions
+                    WHERE function_id = ? ORDER BY version DESC LIMIT 1 OFFSET ?
+                """, (current, keep - 1)).fetchone()
+                if not oldest["snapshot"]:
+                    nodes = reachable_nodes(
+                        oldest["root_hash"], self._version_nodes(current, oldest["version"])
+                    )
+                    self.conn.execute("""
+                        UPDATE function_versions SET snapshot = 1, nodes = ?
+                        WHERE function_id = ? AND version = ?
+                    """, (encode_nodes(nodes), current, oldest["version"]))
+                removed += self.conn.execute(
+                    "DELETE FROM function_versions WHERE function_id = ? AND version < ?",
+                    (current, oldest["version"])
+                ).rowcount
+        return removed
+    
+    def load_function(self, function_id: Optional[int] = None, 
+                     name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Загружает функцию из базы данных.
+        
+        Args:
+            function_id: ID функции
+            name: Имя функции
+            
+        Returns:
+            Словарь с данными функции или None, если не найдена
+        """
+        cursor = self.read_conn.cursor()
+        
+        if function_id:
+            cursor.execute("SELECT * FROM functions WHERE id = ?", (function_id,))
+        elif name:
+            cursor.execute("SELECT * FROM functions WHERE name = ?", (name,))
+        else:
+            return None
+        
+        row = cursor.fetchone()
+        if row:
+            return {
+                "id": row["id"],
+                "name": row["name"],
+                "definition": self._resolve_definition(row["definition"]),
+                "created_at": row["created_at"],
+                "description": row["description"]
+            }
+        return None
+    
+    def list_functions(self) -> List[Dict[str, Any]]:
+        """
+        Возвращает список всех функций.
+        
+        Returns:
+            Список словарей с данными функций
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT * FROM functions ORDER BY name")
+        rows = cursor.fetchall()
+        
+        return [
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "definition": self._resolve_definition(row["definition"]),
+                "created_at": row["created_at"],
+                "description": row["description"]
+            }
+            for row in rows
+        ]
+    
+    # Колонки метаданных функции (без определения)
+    _METADATA_COLUMNS = (
+        "id", "name", "description", "arity", "node_count", "size", "created_at", "updated_at"
+    )
+    _METADATA_SELECT = ", ".join(_METADATA_COLUMNS)
+    
+    def _metadata_from_row(self, row: sqlite3.Row) -> Dict[str, Any]:
+        """Преобразует строку таблицы функций в словарь метаданных."""
+        return {column: row[column] for column in self._METADATA_COLUMNS}
+    
+    def list_function_metadata(self, limit: Optional[int] = None,
+                               offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Возвращает метаданные функций без разбора определений.
+        
+        Args:
+            limit: Максимальное количество функций (None - все)
+            offset: Смещение от начала списка
+            
+        Returns:
+            Список словарей с id, именем, описанием, арностью, количеством
+            узлов, размером определения и временем создания и изменения
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"""
+            SELECT {self._METADATA_SELECT} FROM functions
+            ORDER BY name
+            LIMIT ? OFFSET ?
+        """, (limit if limit is not None else -1, offset))
+        return [self._metadata_from_row(row) for row in cursor.fetchall()]
+    
+    def search_function_metadata(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Ищет функции по имени и возвращает только их метаданные.
+        
+        Args:
+            query: Поисковый запрос
+            
+        Returns:
+            Список метаданных найденных функций
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"""
+            SELECT {self._METADATA_SELECT} FROM functions
+            WHERE name LIKE ?
+            ORDER BY name
+        """, (f"%{query}%",))
+        return [self._metadata_from_row(row) for row in cursor.fetchall()]
+    
+    def get_function_metadata(self, function_id: Optional[int] = None,
+                              name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает метаданные одной функции.
+        
+        Args:
+            function_id: ID функции
+            name: Имя функции
+            
+        Returns:
+            Словарь метаданных или None, если функция не найдена
+        """
+        if function_id:
+            where, key = "id = ?", function_id
+        elif name:
+            where, key = "name = ?", name
+        else:
+            return None
+        row = self.read_conn.execute(
+            f"SELECT {self._METADATA_SELECT} FROM functions WHERE {where}", (key,)
+        ).fetchone()
+        return self._metadata_from_row(row) if row else None
+    
+    def load_function_object(self, function_id: Optional[int] = None,
+                             name: Optional[str] = None,
+                             lazy: bool = False) -> Optional[PrimitiveFunction]:
+        """
+        Загружает функцию и строит ее объект, используя кэш разобранных функций.
+        
+        Определение разбирается только если функции нет в кэше или она
+        (или функции, на которые она ссылается по имени) изменилась с
+        момента последней загрузки.
+        
+        Args:
+            function_id: ID функции
+            name: Имя функции
+            lazy: Если True и функции нет в кэше, возвращается ленивый узел
+                (LazyFunction): узлы строятся и ссылки связываются только
+                при первом обращении к ним
+            
+        Returns:
+            Функция или None, если она не найдена
+        """
+        if function_id:
+            where, key = "id = ?", function_id
+        elif name:
+            where, key = "name = ?", name
+        else:
+            return None
+        row = self.read_conn.execute(
+            f"SELECT id, updated_at, hash, content_hash, arity FROM functions WHERE {where}", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        # Хэш содержимого учитывает функции, на которые ссылается функция,
+        # поэтому их изменение другим процессом тоже сбрасывает кэш
+        version = (row["updated_at"], row["hash"], row["content_hash"])
+        with self._function_cache_lock:
+            cached = self._function_cache.get(row["id"])
+            if cached is not None and cached[0] == version:
+                self._function_cache.move_to_end(row["id"])
+                return cached[1]
+        
+        definition = self.read_conn.execute(
+            "SELECT definition FROM functions WHERE id = ?", (row["id"],)
+        ).fetchone()["definition"]
+        if lazy:
+            # Ленивые узлы не кэшируются: полностью построенная функция полезнее.
+            # Узлы читаются из таблицы узлов по одному при построении; хэш
+            # содержимого - хэш корня, а без ссылок хэши узлов совпадают
+            # с их структурными хэшами, поэтому для хэширования ничего не строится
+            stored = loads(definition)
+            if stored.get("type") != self._ROOT_TYPE:
+                stored = self._resolve_definition(definition)
+            return LazyFunction(stored, self._resolve_reference, row["arity"],
+                                loader=self._load_node_parts, known_hash=row["content_hash"],
+                                node_hashes=row["content_hash"] == row["hash"])
+        function = function_from_dict(self._resolve_definition(definition))
+        
+        # Ссылки связываются с объектами целевых функций из того же кэша
+        linking = getattr(self._linking, "ids", None)
+        if linking is None:
+            linking = self._linking.ids = set()
+        if row["id"] in linking:
+            raise ValueError(f"Circular reference to function {row['id']}")
+        linking.add(row["id"])
+        try:
+            link_references(function, self._resolve_reference)
+        finally:
+            linking.discard(row["id"])
+        
+        with self._function_cache_lock:
+            self._function_cache[row["id"]] = (version, function)
+            self._function_cache.move_to_end(row["id"])
+            while len(self._function_cache) > self.function_cache_size:
+                self._function_cache.popitem(last=False)
+        return function
+    
+    def _resolve_reference(self, reference: Reference) -> PrimitiveFunction:
+        """Находит целевую функцию ссылки."""
+        if reference.hash is not None:
+            row = self.read_conn.execute(
+                "SELECT id FROM functions WHERE hash = ? ORDER BY id LIMIT 1", (reference.hash,)
+            ).fetchone()
+            if row is not None:
+                return self.load_function_object(function_id=row["id"])
+            # Закрепленная версия, которой больше нет среди функций, но есть в узлах
+            definition = self.load_node(reference.hash)
+            if definition is not None:
+                target = function_from_dict(definition)
+                link_references(target, self._resolve_reference)
+                return target
+        else:
+            target = self.load_function_object(name=reference.name)
+            if target is not None:
+                return target
+        raise ValueError(f"Unresolved reference {reference.label()}")
+    
+    @staticmethod
+    def _fts_query(query: str) -> str:
+        """Преобразует пользовательский запрос в запрос FTS5 (слова как префиксы)."""
+        words = re.findall(r"\w+", query)
+        return " ".join(f'"{word}"*' for word in words)
+    
+    def full_text_search(self, query: str, limit: int = 20,
+                         offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        Ищет функции по имени, описанию и текстовой записи определения.
+        
+        Результаты упорядочены по релевантности (совпадения в имени важнее
+        совпадений в описании и определении) и содержат фрагмент с совпадением.
+        Без поддержки FTS5 выполняется поиск по подстроке.
+        
+        Args:
+            query: Поисковый запрос
+            limit: Количество результатов на странице
+            offset: Смещение страницы
+            
+        Returns:
+            Список метаданных функций с полями rank и snippet
+        """
+        fts_query = self._fts_query(query)
+        if not fts_query:
+            return []
+        
+        cursor = self.read_conn.cursor()
+        columns = ", ".join(f"f.{column}" for column in self._METADATA_COLUMNS)
+        if self.fts_available:
+            cursor.execute(f"""
+                SELECT {columns},
+                       bm25(functions_fts, 10.0, 5.0, 1.0) as rank,
+                       snippet(functions_fts, -1, '[', ']', '…', 12) as snippet
+                FROM functions_fts
+                JOIN functions f ON f.id = functions_fts.rowid
+                WHERE functions_fts MATCH ?
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            """, (fts_query, limit, offset))
+        else:
+            pattern = f"%{query}%"
+            cursor.execute(f"""
+                SELECT {columns}, 0 as rank, f.description as snippet
+                FROM functions f
+                WHERE f.name LIKE ? OR f.description LIKE ? OR f.rendered LIKE ?
+                ORDER BY f.name
+                LIMIT ? OFFSET ?
+            """, (pattern, pattern, pattern, limit, offset))
+        
+        results = []
+        for row in cursor.fetchall():
+            entry = self._metadata_from_row(row)
+            entry["rank"] = row["rank"]
+            entry["snippet"] = row["snippet"]
+            results.append(entry)
+        return results
+    
+    def delete_function(self, function_id: Optional[int] = None, 
+                       name: Optional[str] = None) -> bool:
+        """
+        Удаляет функцию из базы данных.
+        
+        Версии функции сохраняются: функцию можно восстановить через
+        rollback_function по имени, а новая функция с тем же именем
+        продолжает нумерацию ее версий.
+        
+        Args:
+            function_id: ID функции
+            name: Имя функции
+            
+        Returns:
+            True, если функция была удалена
+        """
+        cursor = self.conn.cursor()
+        
+        if function_id:
+            cursor.execute("SELECT id, name, content_hash FROM functions WHERE id = ?", (function_id,))
+            row = cursor.fetchone()
+            cursor.execute("DELETE FROM functions WHERE id = ?", (function_id,))
+        elif name:
+            cursor.execute("SELECT id, name, content_hash FROM functions WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            cursor.execute("DELETE FROM functions WHERE name = ?", (name,))
+        else:
+            return False
+        
+        deleted = cursor.rowcount > 0
+        if row:
+            cursor.execute(
+                "DELETE FROM function_dependencies WHERE function_id = ?", (row["id"],)
+            )
+            cursor.execute(
+                "INSERT OR REPLACE INTO deleted_functions (name, function_id) VALUES (?, ?)",
+                (row["name"], row["id"])
+            )
+            cursor.execute("DELETE FROM history_rollup WHERE function_id = ?", (row["id"],))
+            cursor.execute("DELETE FROM history_rollup_arguments WHERE function_id = ?", (row["id"],))
+        self.conn.commit()
+        if row:
+            self._relink_dependents(row["name"], row["content_hash"])
+        return deleted
+    
+    def search_functions(self, query: str) -> List[Dict[str, Any]]:
+        """
+        Ищет функции по имени.
+        
+        Args:
+            query: Поисковый запрос
+            
+        Returns:
+            Список найденных функций
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute(
+            "SELECT * FROM functions WHERE name LIKE ? ORDER BY name",
+            (f"%{query}%",)
+        )
+        rows = cursor.fetchall()
+        
+        return [
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "definition": self._resolve_definition(row["definition"]),
+                "created_at": row["created_at"],
+                "description": row["description"]
+            }
+            for row in rows
+        ]
+    
+    def _fingerprint_definitions(self, batch_size: int = 500) -> int:
+        """
+        Вычисляет канонические хэши и поведенческие отпечатки определений,
+        для которых их еще нет.
+        
+        Отпечаток хранится по хэшу содержимого, поэтому вычисляется один раз
+        на определение; при изменении определения отпечаток прежней версии
+        удаляется вместе с ее результатами. Для определения, которое не удалось проверить,
+        сохраняется запись с ошибкой, чтобы не проверять его повторно.
+        
+        Args:
+            batch_size: Количество записей, сохраняемых одной транзакцией
+            
+        Returns:
+            Количество вычисленных отпечатков
+        """
+        rows = self.conn.execute("""
+            SELECT f.content_hash, MIN(f.id) AS id FROM functions f
+            WHERE f.content_hash IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM function_fingerprints p WHERE p.content_hash = f.content_hash
+            )
+            GROUP BY f.content_hash
+        """).fetchall()
+        
+        computed = 0
+        for batch in batched(rows, batch_size):
+            records = []
+            for row in batch:
+                try:
+                    function = self.load_function_object(function_id=row["id"])
+                    canonical = canonical_hash(function)
+                    behaviour = behaviour_fingerprint(function)
+                except (ValueError, RecursionError) as e:
+                    # Например, ссылка на удаленную функцию
+                    records.append((row["content_hash"], None, None, None, None, str(e)))
+                    continue
+                records.append((row["content_hash"], canonical, behaviour["fingerprint"],
+                                behaviour["prefix"], json.dumps(behaviour["values"]), None))
+            with self.conn:
+                self.conn.executemany("""
+                    INSERT OR REPLACE INTO function_fingerprints
+                        (content_hash, canonical_hash, fingerprint, probe_prefix, probe_values, error)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, records)
+            computed += len(records)
+        return computed
+    
+    def update_fingerprints(self) -> int:
+        """
+        Вычисляет недостающие отпечатки и удаляет отпечатки определений,
+        которые больше не используются.
+        
+        Сохранение и импорт функций не вычисляют отпечатки (пробы - это
+        вычисления), их вычисляет первый поиск дубликатов после изменений.
+        Метод позволяет вычислить их заранее, например после импорта.
+        
+        Returns:
+            Количество вычисленных отпечатков
+        """
+        computed = self._fingerprint_definitions()
+        with self.conn:
+            self.conn.execute("""
+                DELETE FROM function_fingerprints WHERE content_hash NOT IN (
+                    SELECT content_hash FROM functions WHERE content_hash IS NOT NULL
+                )
+            """)
+        return computed
+    
+    def find_duplicates(self, function_id: Optional[int] = None, name: Optional[str] = None,
+                        near: bool = False) -> List[Dict[str, Any]]:
+        """
+        Ищет функции, совпадающие с данной, по индексам отпечатков.
+        
+        Вид совпадения (match):
+            identical - то же определение (после раскрытия ссылок)
+            canonical - то же определение после упрощений (см. core.fingerprint)
+            behaviour - те же значения на всех пробах (вероятный дубликат)
+            near      - те же значения на первых пробах (только при near=True)
+        
+        Функции, не все пробы которых вычислены в пределах ограничения
+        шагов, совпадают по поведению только как близкие. Недостающие
+        отпечатки (функций, измененных после предыдущего поиска)
+        вычисляются перед поиском.
+        
+        Args:
+            function_id: ID функции
+            name: Имя функции
+            near: Включать ли близкие функции
+            
+        Returns:
+            Список словарей с ключами id, name, match
+        """
+        metadata = self.get_function_metadata(function_id=function_id, name=name)
+        if metadata is None:
+            return []
+        self._fingerprint_definitions()
+        target = self.read_conn.execute("""
+            SELECT p.* FROM functions f
+            JOIN function_fingerprints p ON p.content_hash = f.content_hash
+            WHERE f.id = ?
+        """, (metadata["id"],)).fetchone()
+        if target is None:
+            return []
+        
+        # NULL (ошибка проверки, невычисленные пробы) ни с чем не совпадает
+        conditions = ["p.canonical_hash = ?", "p.fingerprint = ?"]
+        params = [target["canonical_hash"], target["fingerprint"]]
+        if near:
+            conditions.append("p.probe_prefix = ?")
+            params.append(target["probe_prefix"])
+        rows = self.read_conn.execute(f"""
+            SELECT f.id, f.name, p.content_hash, p.canonical_hash, p.fingerprint
+            FROM function_fingerprints p
+            JOIN functions f ON f.content_hash = p.content_hash
+            WHERE ({' OR '.join(conditions)}) AND f.id != ?
+            ORDER BY f.name
+        """, params + [metadata["id"]]).fetchall()
+        
+        def match(row: sqlite3.Row) -> str:
+            if row["content_hash"] == target["content_hash"]:
+                return "identical"
+            if row["canonical_hash"] == target["canonical_hash"]:
+                return "canonical"
+            if row["fingerprint"] is not None and row["fingerprint"] == target["fingerprint"]:
+                return "behaviour"
+            return "near"
+        
+        return [{"id": row["id"], "name": row["name"], "match": match(row)} for row in rows]
+    
+    # Ключи группировки дубликатов библиотеки
+    _DUPLICATE_KEYS = {
+        "canonical": "canonical_hash",
+        "behaviour": "fingerprint",
+        "near": "probe_prefix",
+    }
+    
+    def find_duplicate_groups(self, kind: str = "behaviour") -> List[Dict[str, Any]]:
+        """
+        Находит группы совпадающих функций во всей библиотеке.
+        
+        Группировка идет по индексу отпечатков, без попарного сравнения;
+        недостающие отпечатки вычисляются перед группировкой.
+        
+        Args:
+            kind: Вид совпадения: "canonical", "behaviour" или "near"
+            
+        Returns:
+            Список словарей с ключами key и functions (список {"id", "name"}),
+            от больших групп к меньшим
+            
+        Raises:
+            ValueError: Если вид совпадения неизвестен
+        """
+        if kind not in self._DUPLICATE_KEYS:
+            raise ValueError(f"Unknown duplicate kind: {kind}")
+        column = self._DUPLICATE_KEYS[kind]
+        self._fingerprint_definitions()
+        rows = self.read_conn.execute(f"""
+            SELECT p.{column} AS key, json_group_array(json_object('id', f.id, 'name', f.name)) AS functions
+            FROM function_fingerprints p
+            JOIN functions f ON f.content_hash = p.content_hash
+            WHERE p.{column} IS NOT NULL
+            GROUP BY p.{column}
+            HAVING COUNT(*) > 1
+        """).fetchall()
+        groups = [{"key": row["key"], "functions": sorted(json.loads(row["functions"]),
+                                                          key=lambda entry: entry["name"])}
+                  for row in rows]
+        groups.sort(key=lambda group: (-len(group["functions"]), group["functions"][0]["name"]))
+        return groups
+    
+    def save_history(self, function_id: int, arguments: List[int], result: int,
+                     steps: Optional[int] = None, elapsed: Optional[float] = None,
+                     depth: Optional[int] = None, engine: Optional[str] = None,
+                     cache_hit: Optional[bool] = None) -> int:
+        """
+        Сохраняет запись в историю вычислений вместе со стоимостью вычисления.
+        
+        Стоимость удобно передавать из статистики вычислителя:
+        save_history(fid, args, result, **DatabaseManager.history_costs(stats)).
+        
+        При отложенной записи запись ставится в очередь и появляется в базе
+        после сброса пакета (см. flush_history).
+        
+        Args:
+            function_id: ID функции
+            arguments: Аргументы
+            result: Результат
+            steps: Количество шагов вычисления
+            elapsed: Время вычисления в секундах
+            depth: Максимальная глубина вычисления
+            engine: Способ вычисления (simple, tracking, cache, table)
+            cache_hit: Взят ли результат из кэша
+            
+        Returns:
+            ID записи истории (None при отложенной записи)
+        """
+        costs = (steps, elapsed, depth, engine, None if cache_hit is None else int(cache_hit))
+        if self._history_writer is not None:
+            self._history_writer.add(function_id, arguments, result, costs)
+            return None
+        
+        cursor = self.conn.cursor()
+        args_json = json.dumps(arguments)
+        
+        cursor.execute("""
+            INSERT INTO history (function_id, arguments, result,
+                                 steps, elapsed, depth, engine, cache_hit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (function_id, args_json, str(result)) + costs)
+        
+        self.conn.commit()
+        return cursor.lastrowid
+    
+    def flush_history(self, timeout: Optional[float] = None) -> bool:
+        """
+        Дожидается записи всей отложенной истории.
+        
+        Args:
+            timeout: Максимальное время ожидания в секундах
+            
+        Returns:
+            True, если вся история записана
+        """
+        if self._history_writer is None:
+            return True
+        return self._history_writer.flush(timeout)
+    
+    @staticmethod
+    def history_costs(stats: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Выбирает стоимость вычисления из статистики вычислителя.
+        
+        Args:
+            stats: Результат Evaluator.get_statistics()
+            
+        Returns:
+            Именованные аргументы стоимости для save_history
+        """
+        return {
+            "steps": stats.get("total_steps"),
+            "elapsed": stats.get("elapsed"),
+            "depth": stats.get("max_depth"),
+            "engine": stats.get("engine"),
+            "cache_hit": stats.get("cache_hit"),
+        }
+    
+    # Курсор истории: (timestamp, id) последней полученной записи
+    HistoryCursor = Tuple[str, int]
+    
+    @staticmethod
+    def history_cursor(entry: Dict[str, Any]) -> "DatabaseManager.HistoryCursor":
+        """
+        Возвращает курсор, указывающий на запись истории.
+        
+        Args:
+            entry: Запись истории, полученная из get_history
+            
+        Returns:
+            Пара (timestamp, id)
+        """
+        return (entry["timestamp"], entry["id"])
+    
+    @staticmethod
+    def _history_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        """Преобразует строку истории в словарь."""
+        return {
+            "id": row["id"],
+            "function_id": row["function_id"],
+            "function_name": row["function_name"],
+            "arguments": json.loads(row["arguments"]),
+            "result": row["result"],
+            "timestamp": row["timestamp"],
+            "steps": row["steps"],
+            "elapsed": row["elapsed"],
+            "depth": row["depth"],
+            "engine": row["engine"],
+            "cache_hit": None if row["cache_hit"] is None else bool(row["cache_hit"])
+        }
+    
+    def _query_history(self, function_id: Optional[int], condition: Optional[str],
+                       cursor_values: Tuple, order: str,
+                       limit: Optional[int]) -> List[Dict[str, Any]]:
+        """
+        Выбирает записи истории по ключу (timestamp, id).
+        
+        Условие и порядок выражены через составной ключ, поэтому страница
+        ключей выбирается только из индекса (function_id, timestamp, id, ...) без
+        сортировки и обращений к таблице; строки истории читаются затем по
+        id только для записей страницы.
+        """
+        where = []
+        params: List[Any] = []
+        if function_id:
+            where.append("h.function_id = ?")
+            params.append(function_id)
+        if condition:
+            where.append(condition)
+            params.extend(cursor_values)
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        params.append(limit if limit is not None else -1)
+        
+        cursor = self.read_conn.cursor()
+        cursor.execute(f"""
+            WITH page AS (
+                SELECT h.timestamp, h.id FROM history h
+                {where_sql}
+                ORDER BY h.timestamp {order}, h.id {order}
+                LIMIT ?
+            )
+            SELECT h.*, f.name as function_name
+            FROM page
+            JOIN history h ON h.id = page.id
+            LEFT JOIN functions f ON h.function_id = f.id
+            ORDER BY page.timestamp {order}, page.id {order}
+        """, params)
+        return [self._history_entry(row) for row in cursor.fetchall()]
+    
+    def get_history(self, function_id: Optional[int] = None, 
+                   limit: int = 100,
+                   before: Optional[HistoryCursor] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает историю вычислений от новых записей к старым.
+        
+        Следующая страница запрашивается с before, равным курсору последней
+        записи текущей страницы (см. history_cursor).
+        
+        Args:
+            function_id: ID функции (None для всех функций)
+            limit: Максимальное количество записей
+            before: Курсор: вернуть только записи старше него
+            
+        Returns:
+            Список записей истории
+        """
+        condition = "(h.timestamp, h.id) < (?, ?)" if before else None
+        return self._query_history(function_id, condition, tuple(before or ()), "DESC", limit)
+    
+    def get_history_since(self, since: Optional[HistoryCursor],
+                          function_id: Optional[int] = None,
+                          limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает записи истории, добавленные после курсора, от старых к новым.
+        
+        Args:
+            since: Курсор последней известной записи (None - с начала истории)
+            function_id: ID функции (None для всех функций)
+            limit: Максимальное количество записей (None - без ограничения)
+            
+        Returns:
+            Список записей истории
+        """
+        condition = "(h.timestamp, h.id) > (?, ?)" if since else None
+        return self._query_history(function_id, condition, tuple(since or ()), "ASC", limit)
+    
+    def _delete_history_batches(self, condition: str, params: Tuple, batch_size: int) -> int:
+        """Удаляет записи истории по условию пакетами, каждый в своей транзакции."""
+        removed = 0
+        while True:
+            with self.conn:
+                cursor = self.conn.execute(f"""
+                    DELETE FROM history WHERE id IN (
+                        SELECT id FROM history WHERE {condition} LIMIT ?
+                    )
+                """, params + (batch_size,))
+            removed += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return removed
+    
+    def apply_history_retention(self, policy: RetentionPolicy,
+                                batch_size: int = HISTORY_DELETE_BATCH) -> int:
+        """
+        Удаляет записи истории, не попадающие под политику хранения.
+        
+        Удаление идет небольшими транзакциями по индексам истории, поэтому
+        запись новой истории в это время не блокируется надолго. Сводная
+        статистика (get_history_stats) удаленные записи сохраняет.
+        
+        Args:
+            policy: Политика хранения
+            batch_size: Количество записей, удаляемых одной транзакцией
+            
+        Returns:
+            Количество удаленных записей
+        """
+        self.flush_history()
+        removed = 0
+        if policy.max_age_days is not None:
+            removed += self._delete_history_batches(
+                "timestamp < datetime('now', ?)", (f"-{policy.max_age_days} days",), batch_size
+            )
+        if policy.max_rows_per_function is not None:
+            function_ids = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT function_id FROM history WHERE function_id IS NOT NULL"
+            )]
+            for function_id in function_ids:
+                # Самая старая из хранимых записей функции
+                cutoff = self.conn.execute("""
+                    SELECT timestamp, id FROM history WHERE function_id = ?
+                    ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?
+                """, (function_id, policy.max_rows_per_function - 1)).fetchone()
+                if cutoff is None:
+                    continue
+                removed += self._delete_history_batches(
+                    "function_id = ? AND (timestamp, id) < (?, ?)",
+                    (function_id, cutoff["timestamp"], cutoff["id"]), batch_size
+                )
+        return removed
+    
+    def compact_history(self, policy: Optional[RetentionPolicy] = None) -> int:
+        """
+        Сжимает историю: применяет политику хранения и удаляет устаревшие
+        наборы аргументов сводной статистики.
+        
+        Args:
+            policy: Политика хранения (None - только очистка сводки)
+            
+        Returns:
+            Количество удаленных записей истории
+        """
+        removed = 0
+        if policy is not None and not policy.is_empty():
+            removed = self.apply_history_retention(policy)
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM history_rollup_arguments WHERE day < date('now', ?)",
+                (f"-{self.ROLLUP_ARGUMENT_DAYS - 1} days",)
+            )
+        return removed
+    
+    def start_history_compaction(self, policy: RetentionPolicy,
+                                 interval: float) -> HistoryCompactor:
+        """
+        Запускает периодическое сжатие истории в фоновом потоке.
+        
+        Args:
+            policy: Политика хранения
+            interval: Интервал между запусками в секундах
+            
+        Returns:
+            Фоновый процесс сжатия
+        """
+        self.stop_history_compaction()
+        self._history_compactor = HistoryCompactor(self.compact_history, policy, interval)
+        return self._history_compactor
+    
+    def stop_history_compaction(self) -> None:
+        """Останавливает периодическое сжатие истории."""
+        compactor = getattr(self, "_history_compactor", None)
+        if compactor is not None:
+            compactor.stop()
+            self._history_compactor = None
+    
+    @staticmethod
+    def _rollup_entry(row: sqlite3.Row) -> Dict[str, Any]:
+        """Преобразует строку сводной статистики в словарь."""
+        entry = dict(row)
+        measured_steps = entry.pop("measured_steps")
+        total_steps = entry.pop("total_steps")
+        measured_time = entry.pop("measured_time")
+        total_elapsed = entry.pop("total_elapsed")
+        entry["avg_steps"] = total_steps / measured_steps if measured_steps else None
+        entry["avg_elapsed"] = total_elapsed / measured_time if measured_time else None
+        return entry
+    
+    def get_history_stats(self, function_id: Optional[int] = None,
+                          since: Optional[str] = None,
+                          until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает сводную статистику вычислений по функциям и дням.
+        
+        Статистика читается из history_rollup, а не из истории, и учитывает
+        записи, уже удаленные политикой хранения.
+        
+        Args:
+            function_id: ID функции (None для всех функций)
+            since: Первый день периода (YYYY-MM-DD)
+            until: Последний день периода (YYYY-MM-DD)
+            
+        Returns:
+            Список словарей с ключами function_id, function_name, day, calls,
+            argument_sets, min_steps, max_steps, avg_steps, min_elapsed,
+            max_elapsed, avg_elapsed (от новых дней к старым)
+        """
+        where = []
+        params: List[Any] = []
+        if function_id:
+            where.append("r.function_id = ?")
+            params.append(function_id)
+        if since:
+            where.append("r.day >= ?")
+            params.append(since)
+        if until:
+            where.append("r.day <= ?")
+            params.append(until)
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        
+        cursor = self.read_conn.execute(f"""
+            SELECT r.function_id, f.name AS function_name, r.day, r.calls, r.argument_sets,
+                   r.measured_steps, r.min_steps, r.max_steps, r.total_steps,
+                   r.measured_time, r.min_elapsed, r.max_elapsed, r.total_elapsed
+            FROM history_rollup r
+            LEFT JOIN functions f ON r.function_id = f.id
+            {where_sql}
+            ORDER BY r.day DESC, r.function_id
+        """, params)
+        return [self._rollup_entry(row) for row in cursor.fetchall()]
+    
+    def get_history_summary(self, function_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Возвращает итоговую статистику вычислений за все время.
+        
+        Args:
+            function_id: ID функции (None для всех функций)
+            
+        Returns:
+            Словарь с ключами calls, days, first_day, last_day, min_steps,
+            max_steps, avg_steps, min_elapsed, max_elapsed, avg_elapsed
+        """
+        where_sql = "WHERE function_id = ?" if function_id else ""
+        row = self.read_conn.execute(f"""
+            SELECT coalesce(SUM(calls), 0) AS calls, COUNT(DISTINCT day) AS days,
+                   MIN(day) AS first_day, MAX(day) AS last_day,
+                   coalesce(SUM(measured_steps), 0) AS measured_steps,
+                   MIN(min_steps) AS min_steps, MAX(max_steps) AS max_steps,
+                   coalesce(SUM(total_steps), 0) AS total_steps,
+                   coalesce(SUM(measured_time), 0) AS measured_time,
+                   MIN(min_elapsed) AS min_elapsed, MAX(max_elapsed) AS max_elapsed,
+                   TOTAL(total_elapsed) AS total_elapsed
+            FROM history_rollup
+            {where_sql}
+        """, (function_id,) if function_id else ()).fetchone()
+        return self._rollup_entry(row)
+    
+    # Показатели стоимости вычисления, по которым ищутся регрессии
+    COST_METRICS = ("steps", "elapsed", "depth")
+    
+    def get_cost_history(self, function_id: int, arguments: Optional[List[int]] = None,
+                         since: Optional[str] = None, include_cache_hits: bool = False,
+                         limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Возвращает стоимость вычислений функции во времени, от старых к новым.
+        
+        Ключи страницы вместе с фильтром по cache_hit выбираются только из
+        индекса: с аргументами - (function_id, arguments, timestamp, id,
+        cache_hit), без них - (function_id, timestamp, id, cache_hit); строки
+        истории читаются затем по id.
+        
+        Args:
+            function_id: ID функции
+            arguments: Аргументы (None - все вычисления функции)
+            since: Начало периода (YYYY-MM-DD или YYYY-MM-DD HH:MM:SS)
+            include_cache_hits: Включать ли результаты, взятые из кэша
+            limit: Максимальное количество записей
+            
+        Returns:
+            Список записей истории (см. get_history)
+        """
+        where = ["h.function_id = ?"]
+        params: List[Any] = [function_id]
+        if arguments is not None:
+            where.append("h.arguments = ?")
+            params.append(json.dumps(arguments))
+        if since:
+            where.append("h.timestamp >= ?")
+            params.append(since)
+        if not include_cache_hits:
+            where.append("NOT coalesce(h.cache_hit, 0)")
+        params.append(limit if limit is not None else -1)
+        
+        cursor = self.read_conn.execute(f"""
+            WITH page AS (
+                SELECT h.timestamp, h.id FROM history h
+                WHERE {' AND '.join(where)}
+                ORDER BY h.timestamp, h.id
+                LIMIT ?
+            )
+            SELECT h.*, f.name as function_name
+            FROM page
+            JOIN history h ON h.id = page.id
+            LEFT JOIN functions f ON h.function_id = f.id
+            ORDER BY page.timestamp, page.id
+        """, params)
+        return [self._history_entry(row) for row in cursor.fetchall()]
+    
+    def find_performance_regressions(self, metric: str = "elapsed", recent_days: float = 7,
+                                     baseline_days: float = 30, threshold: float = 1.5,
+                                     function_id: Optional[int] = None,
+                                     min_samples: int = 1) -> List[Dict[str, Any]]:
+        """
+        Ищет вычисления, ставшие дороже: сравнивает среднюю стоимость
+        вычислений с одинаковыми аргументами за последние recent_days дней
+        со средней за предшествующие baseline_days дней.
+        
+        Результаты из кэша не учитываются. Для одной функции выборка идет
+        по индексу (function_id, arguments, timestamp) без сортировки.
+        
+        Args:
+            metric: Показатель стоимости: "steps", "elapsed" или "depth"
+            recent_days: Длина проверяемого периода в днях
+            baseline_days: Длина базового периода в днях
+            threshold: Во сколько раз стоимость должна вырасти
+            function_id: ID функции (None - все функции)
+            min_samples: Минимальное количество вычислений в каждом периоде
+            
+        Returns:
+            Список словарей с ключами function_id, function_name, arguments,
+            baseline, recent, ratio, baseline_samples, recent_samples, engine
+            (по убыванию ratio; engine - способ последнего вычисления)
+            
+        Raises:
+            ValueError: Если показатель неизвестен
+        """
+        if metric not in self.COST_METRICS:
+            raise ValueError(f"Unknown cost metric: {metric}")
+        where = [f"h.{metric} IS NOT NULL", "NOT coalesce(h.cache_hit, 0)",
+                 "h.timestamp >= datetime('now', ?)"]
+        params: List[Any] = [f"-{recent_days} days", f"-{recent_days + baseline_days} days"]
+        if function_id:
+            where.append("h.function_id = ?")
+            params.append(function_id)
+        params.extend([min_samples, min_samples, threshold])
+        
+        cursor = self.read_conn.execute(f"""
+            SELECT g.*, f.name AS function_name, g.recent / g.baseline AS ratio,
+                   (SELECT engine FROM history l
+                    WHERE l.function_id = g.function_id AND l.arguments = g.arguments
+                    ORDER BY l.timestamp DESC LIMIT 1) AS engine
+            FROM (
+                SELECT h.function_id, h.arguments,
+                       AVG(CASE WHEN h.timestamp < split.at THEN h.{metric} END) AS baseline,
+                       AVG(CASE WHEN h.timestamp >= split.at THEN h.{metric} END) AS recent,
+                       COUNT(CASE WHEN h.timestamp < split.at THEN 1 END) AS baseline_samples,
+                       COUNT(CASE WHEN h.timestamp >= split.at THEN 1 END) AS recent_samples
+                FROM history h, (SELECT datetime('now', ?) AS at) AS split
+                WHERE {' AND '.join(where)}
+                GROUP BY h.function_id, h.arguments
+            ) AS g
+            LEFT JOIN functions f ON g.function_id = f.id
+            WHERE g.baseline_samples >= ? AND g.recent_samples >= ?
+              AND g.baseline > 0 AND g.recent > g.baseline * ?
+            ORDER BY ratio DESC
+        """, params)
+        return [
+            dict(row, arguments=json.loads(row["arguments"]))
+            for row in cursor.fetchall()
+        ]
     
-    def save_function(self, name: str, definition: Dict[str, Any], 
-                     description: Optional[str] = None) -> int:
+    def save_slow_evaluation(self, function_id: Optional[int], arguments: List[int],
+                             steps: int, depth: int, elapsed: float, engine: str,
+                             error: Optional[str] = None,
+                             peak_memory: Optional[int] = None,
+                             trace_memory: Optional[int] = None,
+                             largest_int_bits: Optional[int] = None) -> int:
         """
-        Сохраняет функцию в базу данных.
+        Сохраняет запись в журнал медленных вычислений.
         
         Args:
-            name: Имя функции
-            definition: Определение функции (словарь)
-            description: Описание функции
+            function_id: ID функции (None для несохраненных функций)
+            arguments: Аргументы
+            steps: Количество шагов вычисления
+            depth: Максимальная достигнутая глубина
+            elapsed: Время вычисления в секундах
+            engine: Использованный способ вычисления
+            error: Описание ошибки, если вычисление было прервано
+            peak_memory: Пиковый объем выделенной памяти в байтах
+            trace_memory: Объем памяти, удерживаемой трассой шагов
+            largest_int_bits: Разрядность наибольшего промежуточного значения
             
         Returns:
-            ID сохраненной функции
-            
-        Raises:
-            sqlite3.IntegrityError: Если функция с таким именем уже существует
+            ID записи журнала
         """
         cursor = self.conn.cursor()
-        definition_json = json.dumps(definition, ensure_ascii=False)
+        cursor.execute("""
+            INSERT INTO slow_evaluations
+                (function_id, arguments, steps, depth, elapsed, engine, error,
+                 peak_memory, trace_memory, largest_int_bits)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (function_id, json.dumps(arguments), steps, depth, elapsed, engine, error,
+              peak_memory, trace_memory, largest_int_bits))
         
-        try:
-            cursor.execute("""
-                INSERT INTO functions (name, definition, description)
-                VALUES (?, ?, ?)
-            """, (name, definition_json, description))
-            self.conn.commit()
-            return cursor.lastrowid
-        except sqlite3.IntegrityError:
-            # Обновляем существующую функцию
-            cursor.execute("""
-                UPDATE functions 
-                SET definition = ?, description = ?, created_at = CURRENT_TIMESTAMP
-                WHERE name = ?
-            """, (definition_json, description, name))
-            self.conn.commit()
-            cursor.execute("SELECT id FROM functions WHERE name = ?", (name,))
-            row = cursor.fetchone()
-            return row[0] if row else None
+        self.conn.commit()
+        return cursor.lastrowid
     
-    def load_function(self, function_id: Optional[int] = None, 
-                     name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    def get_slow_evaluations(self, function_id: Optional[int] = None,
+                             order_by: str = "elapsed",
+                             limit: int = 20) -> List[Dict[str, Any]]:
         """
-        Загружает функцию из базы данных.
+        Возвращает самые дорогие вычисления из журнала.
         
         Args:
-            function_id: ID функции
-            name: Имя функции
+            function_id: ID функции (None для всех функций)
+            order_by: Критерий сортировки: "elapsed" или "steps"
+            limit: Максимальное количество записей
             
         Returns:
-            Словарь с данными функции или None, если не найдена
+            Список записей журнала, начиная с самых дорогих
         """
-        cursor = self.conn.cursor()
+        if order_by not in ("elapsed", "steps"):
+            raise ValueError(f"Unknown order: {order_by}")
         
-        if function_id:
-            cursor.execute("SELECT * FROM functions WHERE id = ?", (function_id,))
-        elif name:
-            cursor.execute("SELECT * FROM functions WHERE name = ?", (name,))
-        else:
-            return None
+        cursor = self.read_conn.cursor()
+        where = "WHERE s.function_id = ?" if function_id else ""
+        params = (function_id, limit) if function_id else (limit,)
+        cursor.execute(f"""
+            SELECT s.*, f.name as function_name
+            FROM slow_evaluations s
+            LEFT JOIN functions f ON s.function_id = f.id
+            {where}
+            ORDER BY s.{order_by} DESC
+            LIMIT ?
+        """, params)
         
-        row = cursor.fetchone()
-        if row:
-            return {
+        return [
+            {
                 "id": row["id"],
-                "name": row["name"],
-                "definition": json.loads(row["definition"]),
-                "created_at": row["created_at"],
-                "description": row["description"]
+                "function_id": row["function_id"],
+                "function_name": row["function_name"],
+                "arguments": json.loads(row["arguments"]),
+                "steps": row["steps"],
+                "depth": row["depth"],
+                "elapsed": row["elapsed"],
+                "engine": row["engine"],
+                "error": row["error"],
+                "peak_memory": row["peak_memory"],
+                "trace_memory": row["trace_memory"],
+                "largest_int_bits": row["largest_int_bits"],
+                "timestamp": row["timestamp"]
             }
-        return None
+            for row in cursor.fetchall()
+        ]
     
-    def list_functions(self) -> List[Dict[str, Any]]:
+    def get_top_slow_functions(self, limit: int = 10) -> List[Dict[str, Any]]:
         """
-        Возвращает список всех функций.
+        Возвращает функции, чаще и дольше всего попадающие в журнал.
         
+        Args:
+            limit: Максимальное количество функций
+            
         Returns:
-            Список словарей с данными функций
+            Список агрегатов по функциям, отсортированный по суммарному времени
         """
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM functions ORDER BY name")
-        rows = cursor.fetchall()
+        cursor = self.read_conn.cursor()
+        cursor.execute("""
+            SELECT s.function_id, f.name as function_name,
+                   COUNT(*) as count,
+                   SUM(s.elapsed) as total_elapsed,
+                   MAX(s.elapsed) as max_elapsed,
+                   MAX(s.steps) as max_steps
+            FROM slow_evaluations s
+            LEFT JOIN functions f ON s.function_id = f.id
+            GROUP BY s.function_id
+            ORDER BY total_elapsed DESC
+            LIMIT ?
+        """, (limit,))
         
         return [
             {
-                "id": row["id"],
-                "name": row["name"],
-                "definition": json.loads(row["definition"]),
-                "created_at": row["created_at"],
-                "description": row["description"]
+                "function_id": row["function_id"],
+                "function_name": row["function_name"],
+                "count": row["count"],
+                "total_elapsed": row["total_elapsed"],
+                "max_elapsed": row["max_elapsed"],
+                "max_steps": row["max_steps"]
             }
-            for row in rows
+            for row in cursor.fetchall()
         ]
     
-    def delete_function(self, function_id: Optional[int] = None, 
-                       name: Optional[str] = None) -> bool:
+    def save_checkpoint(self, function_hash: str, arguments: List[int],
+                        state: Dict[str, Any]) -> int:
         """
-        Удаляет функцию из базы данных.
+        Сохраняет контрольную точку вычисления, заменяя предыдущие для тех же ключей.
         
         Args:
-            function_id: ID функции
-            name: Имя функции
+            function_hash: Структурный хэш функции
+            arguments: Аргументы вычисления
+            state: Состояние активных рекурсий (см. Evaluator)
             
         Returns:
-            True, если функция была удалена
+            ID контрольной точки
         """
         cursor = self.conn.cursor()
+        args_json = json.dumps(arguments)
         
-        if function_id:
-            cursor.execute("DELETE FROM functions WHERE id = ?", (function_id,))
-        elif name:
-            cursor.execute("DELETE FROM functions WHERE name = ?", (name,))
-        else:
-            return False
+        cursor.execute("""
+            INSERT INTO checkpoints (function_hash, arguments, state, steps)
+            VALUES (?, ?, ?, ?)
+        """, (function_hash, args_json, json.dumps(state), state.get("steps", 0)))
+        checkpoint_id = cursor.lastrowid
+        cursor.execute("""
+            DELETE FROM checkpoints
+            WHERE function_hash = ? AND arguments = ? AND id < ?
+        """, (function_hash, args_json, checkpoint_id))
         
         self.conn.commit()
-        return cursor.rowcount > 0
+        return checkpoint_id
     
-    def search_functions(self, query: str) -> List[Dict[str, Any]]:
+    def load_checkpoint(self, function_hash: str,
+                        arguments: List[int]) -> Optional[Dict[str, Any]]:
         """
-        Ищет функции по имени.
+        Загружает последнюю контрольную точку вычисления.
         
         Args:
-            query: Поисковый запрос
+            function_hash: Структурный хэш функции
+            arguments: Аргументы вычисления
             
         Returns:
-            Список найденных функций
+            Состояние активных рекурсий или None, если точки нет
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute("""
+            SELECT state FROM checkpoints
+            WHERE function_hash = ? AND arguments = ?
+            ORDER BY id DESC
+            LIMIT 1
+        """, (function_hash, json.dumps(arguments)))
+        
+        row = cursor.fetchone()
+        return json.loads(row["state"]) if row else None
+    
+    def delete_checkpoints(self, function_hash: str, arguments: List[int]) -> int:
+        """
+        Удаляет контрольные точки завершенного вычисления.
+        
+        Args:
+            function_hash: Структурный хэш функции
+            arguments: Аргументы вычисления
+            
+        Returns:
+            Количество удаленных точек
         """
         cursor = self.conn.cursor()
         cursor.execute(
-            "SELECT * FROM functions WHERE name LIKE ? ORDER BY name",
-            (f"%{query}%",)
+            "DELETE FROM checkpoints WHERE function_hash = ? AND arguments = ?",
+            (function_hash, json.dumps(arguments))
         )
-        rows = cursor.fetchall()
-        
-        return [
-            {
-                "id": row["id"],
-                "name": row["name"],
-                "definition": json.loads(row["definition"]),
-                "created_at": row["created_at"],
-                "description": row["description"]
-            }
-            for row in rows
-        ]
+        self.conn.commit()
+        return cursor.rowcount
     
-    def save_history(self, function_id: int, arguments: List[int], result: int) -> int:
+    # Максимальное количество различных записей кэша с незаписанными попаданиями;
+    # попадания в другие записи сверх него не учитываются
+    RESULT_CACHE_PENDING_HITS = 4096
+    
+    def get_cached_result(self, function_hash: str, arguments: List[int]) -> Optional[int]:
         """
-        Сохраняет запись в историю вычислений.
+        Возвращает результат из кэша результатов.
         
         Args:
-            function_id: ID функции
+            function_hash: Структурный хэш функции
             arguments: Аргументы
-            result: Результат
             
         Returns:
-            ID записи истории
+            Результат или None, если он не был сохранен
+        """
+        key = (function_hash, json.dumps(arguments))
+        row = self.read_conn.execute(
+            "SELECT result FROM result_cache WHERE function_hash = ? AND arguments = ?", key
+        ).fetchone()
+        if row is None:
+            return None
+        
+        # Попадание только запоминается: чтение не берет блокировку записи,
+        # счетчики записываются вместе со следующей записью в кэш
+        now = time.time() / 86400 + 2440587.5
+        with self._pending_hits_lock:
+            pending = self._pending_hits.get(key)
+            if pending is not None:
+                pending[0] += 1
+                pending[1] = now
+            elif len(self._pending_hits) < self.RESULT_CACHE_PENDING_HITS:
+                self._pending_hits[key] = [1, now]
+        return int(row["result"], 16)
+    
+    def _flush_cache_hits(self) -> None:
+        """Записывает накопленные попадания в кэш результатов (без фиксации транзакции)."""
+        with self._pending_hits_lock:
+            pending, self._pending_hits = self._pending_hits, {}
+        if pending:
+            self.conn.executemany("""
+                UPDATE result_cache SET hits = hits + ?, last_used = max(last_used, ?)
+                WHERE function_hash = ? AND arguments = ?
+            """, [(count, last_used, function_hash, arguments)
+                  for (function_hash, arguments), (count, last_used) in pending.items()])
+    
+    def save_cached_result(self, function_hash: str, arguments: List[int], result: int) -> None:
+        """
+        Сохраняет результат в кэш результатов, вытесняя давно не использованные записи.
+        
+        Args:
+            function_hash: Структурный хэш функции
+            arguments: Аргументы
+            result: Результат
         """
         cursor = self.conn.cursor()
         args_json = json.dumps(arguments)
+        # Результат хранится в шестнадцатеричном виде: без ограничения на длину десятичных строк
+        result_hex = format(result, "x")
+        size = len(function_hash) + len(args_json) + len(result_hex)
         
+        # Замена существующей записи меняет размер кэша только на разницу размеров
+        cursor.execute(
+            "SELECT size FROM result_cache WHERE function_hash = ? AND arguments = ?",
+            (function_hash, args_json)
+        )
+        previous = cursor.fetchone()
         cursor.execute("""
-            INSERT INTO history (function_id, arguments, result)
-            VALUES (?, ?, ?)
-        """, (function_id, args_json, str(result)))
+            INSERT INTO result_cache (function_hash, arguments, result, size, last_used)
+            VALUES (?, ?, ?, ?, julianday('now'))
+            ON CONFLICT(function_hash, arguments) DO UPDATE SET
+                result = excluded.result, size = excluded.size, last_used = excluded.last_used
+        """, (function_hash, args_json, result_hex, size))
+        self._flush_cache_hits()
+        
+        if self._result_cache_bytes is None:
+            self._result_cache_bytes = self._result_cache_size()
+        else:
+            self._result_cache_bytes += size - (previous[0] if previous else 0)
+        if self._result_cache_bytes > self.result_cache_max_bytes:
+            self._evict_cached_results()
         
         self.conn.commit()
-        return cursor.lastrowid
     
-    def get_history(self, function_id: Optional[int] = None, 
-                   limit: int = 100) -> List[Dict[str, Any]]:
+    def _result_cache_size(self) -> int:
+        """Возвращает суммарный размер записей кэша результатов."""
+        row = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM result_cache").fetchone()
+        return row[0]
+    
+    def _evict_cached_results(self) -> None:
+        """Удаляет давно не использованные записи, пока кэш не станет меньше 90% лимита."""
+        target = self.result_cache_max_bytes * 0.9
+        self._result_cache_bytes = self._result_cache_size()
+        while self._result_cache_bytes > target:
+            count = self.conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+            self.conn.execute("""
+                DELETE FROM result_cache WHERE rowid IN (
+                    SELECT rowid FROM result_cache ORDER BY last_used LIMIT ?
+                )
+            """, (max(count // 10, 1),))
+            self._result_cache_bytes = self._result_cache_size()
+    
+    def _invalidate_cached_results(self, function_hash: Optional[str]) -> None:
+        """Удаляет результаты и отпечаток определения, если оно больше не используется ни одной функцией."""
+        if function_hash is None:
+            return
+        in_use = self.conn.execute(
+            "SELECT 1 FROM functions WHERE content_hash = ? LIMIT 1", (function_hash,)
+        ).fetchone()
+        if not in_use:
+            self.conn.execute("DELETE FROM result_cache WHERE function_hash = ?", (function_hash,))
+            self.conn.execute("DELETE FROM function_fingerprints WHERE content_hash = ?", (function_hash,))
+            self._result_cache_bytes = None
+    
+    def clear_result_cache(self) -> None:
+        """Очищает кэш результатов."""
+        with self._pending_hits_lock:
+            self._pending_hits = {}
+        self.conn.execute("DELETE FROM result_cache")
+        self.conn.commit()
+        self._result_cache_bytes = 0
+    
+    def get_result_cache_stats(self) -> Dict[str, int]:
         """
-        Возвращает историю вычислений.
+        Возвращает статистику кэша результатов.
         
-        Args:
-            function_id: ID функции (None для всех функций)
-            limit: Максимальное количество записей
-            
         Returns:
-            Список записей истории
+            Словарь с количеством записей, размером в байтах и числом попаданий
         """
-        cursor = self.conn.cursor()
-        
-        if function_id:
-            cursor.execute("""
-                SELECT h.*, f.name as function_name
-                FROM history h
-                LEFT JOIN functions f ON h.function_id = f.id
-                WHERE h.function_id = ?
-                ORDER BY h.timestamp DESC
-                LIMIT ?
-            """, (function_id, limit))
-        else:
-            cursor.execute("""
-                SELECT h.*, f.name as function_name
-                FROM history h
-                LEFT JOIN functions f ON h.function_id = f.id
-                ORDER BY h.timestamp DESC
-                LIMIT ?
-            """, (limit,))
+        row = self.read_conn.execute("""
+            SELECT COUNT(*) as entries, COALESCE(SUM(size), 0) as bytes,
+                   COALESCE(SUM(hits), 0) as hits
+            FROM result_cache
+        """).fetchone()
+        with self._pending_hits_lock:
+            pending = sum(int(count) for count, _ in self._pending_hits.values())
+        return {"entries": row["entries"], "bytes": row["bytes"], "hits": row["hits"] + pending}
+    
+    def value_tables(self) -> ValueTableSet:
+        """
+        Возвращает предвычисленные таблицы значений из каталога tables_dir.
         
-        rows = cursor.fetchall()
+        Набор передается в Evaluator(value_tables=...). Таблицы отображаются
+        в память, поэтому процессы, открывшие одну базу, разделяют их страницы.
+        """
+        if self._value_tables is None:
+            self._value_tables = ValueTableSet(self.tables_dir)
+        return self._value_tables
+    
+    def precompute_table(self, bound: int, function_id: Optional[int] = None,
+                         name: Optional[str] = None,
+                         progress: Optional[TableProgress] = None) -> str:
+        """
+        Вычисляет таблицу значений функции на аргументах 0..bound-1 и
+        сохраняет ее в каталоге tables_dir.
         
-        return [
-            {
-                "id": row["id"],
-                "function_id": row["function_id"],
-                "function_name": row["function_name"],
-                "arguments": json.loads(row["arguments"]),
-                "result": row["result"],
-                "timestamp": row["timestamp"]
-            }
-            for row in rows
-        ]
+        Args:
+            bound: Граница области
+            function_id: ID функции
+            name: Имя функции
+            progress: Обработчик прогресса (вычислено записей, всего записей)
+            
+        Returns:
+            Путь к файлу таблицы
+            
+        Raises:
+            ValueError: Если функция не найдена или каталог таблиц не задан
+        """
+        if self.tables_dir is None:
+            raise ValueError("Value tables require a database file or tables_dir")
+        function = self.load_function_object(function_id=function_id, name=name)
+        if function is None:
+            raise ValueError(f"Function not found: {name or function_id}")
+        path = build_value_table(function, bound, self.tables_dir, progress=progress)
+        if self._value_tables is not None:
+            self._value_tables.reload()
+        return path
     
-    def backup_database(self, backup_path: str) -> bool:
+    def backup_database(self, backup_path: str, compress: Optional[bool] = None,
+                        pages: int = DEFAULT_BACKUP_PAGES,
+                        progress: Optional[ProgressCallback] = None) -> bool:
         """
         Создает резервную копию базы данных.
         
+        Копия снимается через SQLite backup API постранично, не закрывая
+        соединений: чтение и запись продолжаются во время копирования.
+        
         Args:
             backup_path: Путь для сохранения резервной копии
+            compress: Сжимать ли копию gzip (None - если путь оканчивается на .gz)
+            pages: Количество страниц, копируемых за один шаг
+            progress: Обработчик прогресса (скопировано страниц, всего страниц)
             
         Returns:
             True, если копия создана успешно
         """
+        if compress is None:
+            compress = backup_path.endswith(".gz")
         try:
-            if self.conn:
-                self.conn.close()
-            shutil.copy2(self.db_path, backup_path)
-            self._initialize_database()
+            self.flush_history()
+            # Копируем через отдельное соединение для чтения текущего потока
+            run_backup(self.read_conn, backup_path, pages=pages,
+                       progress=progress, compress=compress)
             return True
         except Exception as e:
             print(f"Backup failed: {e}")
             return False
     
+    def backup_database_async(self, backup_path: str, compress: Optional[bool] = None,
+                              pages: int = DEFAULT_BACKUP_PAGES,
+                              progress: Optional[ProgressCallback] = None,
+                              on_done: Optional[Callable[[bool], None]] = None
+                              ) -> "Future[bool]":
+        """
+        Создает резервную копию в фоновом потоке.
+        
+        Все фоновые копии выполняются по очереди одним потоком, который
+        переиспользует свои соединения пула и завершается при закрытии базы.
+        
+        Args:
+            backup_path: Путь для сохранения резервной копии
+            compress: Сжимать ли копию gzip (None - по расширению .gz)
+            pages: Количество страниц, копируемых за один шаг
+            progress: Обработчик прогресса (вызывается из фонового потока)
+            on_done: Вызывается с результатом по завершении
+            
+        Returns:
+            Future с результатом backup_database
+        """
+        def run() -> bool:
+            ok = self.backup_database(backup_path, compress, pages, progress)
+            if on_done:
+                on_done(ok)
+            return ok
+        
+        with self._backup_executor_lock:
+            if self._backup_executor is None:
+                self._backup_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="db-backup"
+                )
+            return self._backup_executor.submit(run)
+    
+    def start_backup_schedule(self, directory: str, interval: float, keep: int = 7,
+                              compress: bool = True) -> BackupScheduler:
+        """
+        Запускает создание копий по расписанию с ротацией старых копий.
+        
+        Args:
+            directory: Каталог копий
+            interval: Интервал между копиями в секундах
+            keep: Количество сохраняемых копий
+            compress: Сжимать ли копии gzip
+            
+        Returns:
+            Планировщик копий
+        """
+        self.stop_backup_schedule()
+        prefix = Path(self.db_path).stem if not self._pool.shared else "memory"
+        self._backup_scheduler = BackupScheduler(
+            self.backup_database, directory, interval, keep=keep,
+            prefix=prefix, compress=compress
+        )
+        return self._backup_scheduler
+    
+    def stop_backup_schedule(self) -> None:
+        """Останавливает создание копий по расписанию."""
+        scheduler = getattr(self, "_backup_scheduler", None)
+        if scheduler is not None:
+            scheduler.stop()
+            self._backup_scheduler = None
+    
     def export_functions(self, export_path: str) -> bool:
         """
         Экспортирует все функции в JSON файл.
@@ -357,30 +2819,375 @@ class DatabaseManager:
             with open(import_path, 'r', encoding='utf-8') as f:
                 import_data = json.load(f)
             
-            count = 0
-            for func_data in import_data.get("functions", []):
-                try:
-                    self.save_function(
-                        func_data["name"],
-                        func_data["definition"],
-                        func_data.get("description")
-                    )
-                    count += 1
-                except Exception as e:
-                    print(f"Failed to import function {func_data.get('name')}: {e}")
-            
-            return count
+            return self._import_records(import_data.get("functions", []), workers=1)
         except Exception as e:
             print(f"Import failed: {e}")
             return 0
     
+    def export_functions_jsonl(self, export_path: str,
+                               compress: Optional[bool] = None) -> int:
+        """
+        Экспортирует все функции построчно в формате JSON Lines.
+        
+        Args:
+            export_path: Путь к файлу (при расширении .gz - со сжатием)
+            compress: Сжатие gzip (None - по расширению файла)
+            
+        Returns:
+            Количество экспортированных функций
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT name, description, definition FROM functions ORDER BY id")
+        count = 0
+        # Одинаковые определения сериализуются один раз
+        encoded: Dict[str, str] = {}
+        with open_library_file(export_path, "w", compress) as f:
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    definition_json = encoded.get(row["definition"])
+                    if definition_json is None:
+                        if len(encoded) >= self.node_cache_size:
+                            encoded.clear()
+                        definition_json = dumps(
+                            self._resolve_definition(row["definition"]), ensure_ascii=False
+                        )
+                        encoded[row["definition"]] = definition_json
+                    f.write(library_line(row["name"], row["description"], definition_json))
+                count += len(rows)
+        return count
+    
+    def import_functions_jsonl(self, import_path: str, batch_size: int = 2000,
+                               workers: Optional[int] = None,
+                               compress: Optional[bool] = None) -> int:
+        """
+        Импортирует функции из файла JSON Lines.
+        
+        Файл читается построчно. Определения разбираются и проверяются
+        параллельно в отдельных процессах, а затем записываются пакетами:
+        одна транзакция и один INSERT ... ON CONFLICT на пакет. Функции с
+        существующими именами обновляются, некорректные пропускаются.
+        Определения принимаются во вложенном и в плоском формате
+        (core.serialization) и могут быть любой глубины.
+        
+        Args:
+            import_path: Путь к файлу (при расширении .gz - со сжатием)
+            batch_size: Количество функций в транзакции
+            workers: Количество процессов проверки (None - по числу ядер,
+                1 - проверка в текущем процессе)
+            compress: Сжатие gzip (None - по расширению файла)
+            
+        Returns:
+            Количество импортированных функций
+        """
+        with open_library_file(import_path, "r", compress) as f:
+            return self._import_records(iter_library_lines(f), batch_size, workers)
+    
+    def export_functions_binary(self, export_path: str,
+                                compress: Optional[bool] = None) -> int:
+        """
+        Экспортирует все функции в двоичную библиотеку.
+        
+        Определения записываются в компактном двоичном формате с общими
+        поддеревьями (core.codec).
+        
+        Args:
+            export_path: Путь к файлу (при расширении .gz - со сжатием)
+            compress: Сжатие gzip (None - по расширению файла)
+            
+        Returns:
+            Количество экспортированных функций
+        """
+        cursor = self.read_conn.cursor()
+        cursor.execute("SELECT name, description, definition FROM functions ORDER BY id")
+        count = 0
+        encoded: Dict[str, bytes] = {}
+        with open_binary_library_file(export_path, "w", compress) as f:
+            write_binary_library_header(f)
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    blob = encoded.get(row["definition"])
+                    if blob is None:
+                        if len(encoded) >= self.node_cache_size:
+                            encoded.clear()
+                        blob = encode_definition(self._resolve_definition(row["definition"]))
+                        encoded[row["definition"]] = blob
+                    f.write(binary_library_record(row["name"], row["description"], blob))
+                count += len(rows)
+        return count
+    
+    def import_functions_binary(self, import_path: str, batch_size: int = 2000,
+                                workers: Optional[int] = None,
+                                compress: Optional[bool] = None) -> int:
+        """
+        Импортирует функции из двоичной библиотеки.
+        
+        Работает так же, как import_functions_jsonl, но процессам проверки
+        передаются компактные двоичные определения.
+        
+        Args:
+            import_path: Путь к файлу (при расширении .gz - со сжатием)
+            batch_size: Количество функций в транзакции
+            workers: Количество процессов проверки
+            compress: Сжатие gzip (None - по расширению файла)
+            
+        Returns:
+            Количество импортированных функций
+        """
+        with open_binary_library_file(import_path, "r", compress) as f:
+            return self._import_records(iter_binary_library(f), batch_size, workers)
+    
+    def _import_records(self, records: Iterable[Any], batch_size: int = 2000,
+                        workers: Optional[int] = None) -> int:
+        """
+        Проверяет и записывает поток функций (строк JSON, словарей или
+        двоичных записей).
+        
+        Пока записывается очередной пакет, процессы уже проверяют следующий.
+        """
+        workers = workers or os.cpu_count() or 1
+        executor = None
+        count = 0
+        pending = None
+        # Функции, определения или описания которых изменил импорт
+        changed: set = set()
+        try:
+            for batch in batched(records, batch_size):
+                # Небольшие импорты не окупают запуск процессов
+                if executor is None and workers > 1 and len(batch) == batch_size:
+                    executor = ProcessPoolExecutor(
+                        workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                if executor is not None:
+                    chunksize = max(1, batch_size // (workers * 4))
+                    prepared = executor.map(_prepare_import_record, batch, chunksize=chunksize)
+                else:
+                    prepared = [_prepare_import_record(item) for item in batch]
+                if pending is not None:
+                    count += self._upsert_functions(pending, changed)
+                pending = prepared
+            if pending is not None:
+                count += self._upsert_functions(pending, changed)
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        
+        # Импортированные функции могли заменить цели ссылок по имени:
+        # хэши пересчитываются только для них и зависящих от них функций
+        ids = self._dependent_ids(changed)
+        with self.conn:
+            for chunk in batched(ids, 500):
+                self.conn.execute(f"""
+                    UPDATE functions SET content_hash = NULL
+                    WHERE id IN ({', '.join('?' * len(chunk))}) AND id IN (
+                        SELECT function_id FROM function_dependencies WHERE target_name IS NOT NULL
+                    )
+                """, chunk)
+        with self._function_cache_lock:
+            self._function_cache.clear()
+        self._compute_content_hashes(ids)
+        self.conn.commit()
+        return count
+    
+    def _upsert_functions(self, prepared: Iterable[Tuple],
+                          changed_names: Optional[set] = None) -> int:
+        """
+        Записывает пакет проверенных функций одной транзакцией.
+        
+        В changed_names добавляются имена функций, которые были изменены
+        или добавлены.
+        """
+        rows = []
+        node_rows: Dict[str, tuple] = {}
+        references: Dict[str, list] = {}
+        for status, name, payload in prepared:
+            if status == "ok":
+                row, nodes, refs = payload
+                # Хэш содержимого функций со ссылками вычисляется после импорта
+                rows.append((name, *row, None if refs else row[2]))
+                references[name] = refs
+                # Общие поддеревья функций пакета записываются один раз
+                node_rows.update(nodes)
+            else:
+                print(f"Failed to import function {name}: {payload}")
+        if not rows:
+            return 0
+        
+        columns = (*self._FUNCTION_COLUMNS, "content_hash")
+        names = ", ".join(columns)
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(
+            f"{column} = excluded.{column}"
+            for column in ("definition", "description", "updated_at", *columns)
+        )
+        
+        with self.conn:
+            self._store_nodes(node_rows)
+            
+            # Хэши заменяемых определений - для очистки кэша результатов
+            previous = set()
+            # Прежние определения и описания - для записи версий изменившихся функций
+            stored: Dict[str, tuple] = {}
+            for start in range(0, len(rows), 500):
+                chunk = [row[0] for row in rows[start:start + 500]]
+                for row in self.conn.execute(
+                    f"SELECT name, definition, description, content_hash FROM functions "
+                    f"WHERE name IN ({', '.join('?' * len(chunk))})", chunk
+                ):
+                    previous.add(row["content_hash"])
+                    stored[row["name"]] = (row["definition"], row["description"])
+            changed = {row[0]: row for row in rows if stored.get(row[0]) != (row[1], row[2])}
+            if changed_names is not None:
+                changed_names.update(changed)
+            
+            # Узлы версий берутся из узлов пакета
+            batch_nodes = {
+                node_hash: (json.loads(node[1]), json.loads(node[2]))
+                for node_hash, (node, _) in node_rows.items()
+            } if changed else {}
+            
+            # Неизменившиеся функции не перезаписываются
+            self.conn.executemany(f"""
+                INSERT INTO functions (name, definition, description, updated_at, {names})
+                VALUES (?, ?, ?, {self._NOW}, {placeholders})
+                ON CONFLICT(name) DO UPDATE SET {updates}
+                WHERE functions.definition IS NOT excluded.definition
+                   OR functions.description IS NOT excluded.description
+            """, rows)
+            
+            for function_hash in previous - {row[-1] for row in rows} - {None}:
+                self._invalidate_cached_results(function_hash)
+            
+            # Индекс зависимостей импортированных функций
+            dependency_rows = []
+            versions = []
+            for start in range(0, len(rows), 500):
+                chunk = [row[0] for row in rows[start:start + 500]]
+                ids = self.conn.execute(
+                    f"SELECT id, name FROM functions WHERE name IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                self.conn.execute(
+                    f"DELETE FROM function_dependencies WHERE function_id IN "
+                    f"({', '.join('?' * len(ids))})", [row["id"] for row in ids]
+                )
+                # Новые функции продолжают версии удаленных функций с тем же именем
+                self._reattach_versions(
+                    {row["name"]: row["id"] for row in ids if row["name"] not in stored}
+                )
+                dependency_rows.extend(
+                    (row["id"], target_name, target_hash)
+                    for row in ids for target_name, target_hash in references[row["name"]]
+                )
+                versions.extend(
+                    (row["id"], reachable_nodes(changed[row["name"]][3], batch_nodes),
+                     changed[row["name"]][2])
+                    for row in ids if row["name"] in changed
+                )
+            self.conn.executemany(
+                "INSERT INTO function_dependencies (function_id, target_name, target_hash) "
+                "VALUES (?, ?, ?)", dependency_rows
+            )
+            self._record_versions(versions)
+        return len(rows)
+    
     def close(self) -> None:
         """Закрывает соединение с базой данных."""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        self.stop_backup_schedule()
+        self.stop_history_compaction()
+        if getattr(self, "_backup_executor", None) is not None:
+            # Дожидаемся начатых копий; соединения потока закрываются с ним
+            self._backup_executor.shutdown(wait=True)
+            self._backup_executor = None
+        if getattr(self, "_value_tables", None) is not None:
+            self._value_tables.close()
+            self._value_tables = None
+        history_error = None
+        if getattr(self, "_history_writer", None) is not None:
+            writer, self._history_writer = self._history_writer, None
+            try:
+                writer.close()
+            except HistoryWriteError as e:
+                # Сначала освобождаем ресурсы, затем сообщаем о потере истории
+                history_error = e
+        if getattr(self, "_pending_hits", None) and self._pool:
+            try:
+                with self.conn:
+                    self._flush_cache_hits()
+            except sqlite3.Error as e:
+                print(f"Cannot save result cache hits: {e}")
+        if self._pool:
+            self._pool.close_all()
+            self._pool = None
+        if history_error is not None:
+            raise history_error
     
     def __del__(self):
         """Деструктор - закрывает соединение."""
         self.close()
 
+
+# Результаты проверки уже встречавшихся определений в процессе проверки
+_PREPARED_DEFINITIONS: Dict[Any, Tuple] = {}
+_PREPARED_DEFINITIONS_SIZE = 4096
+
+
+def _prepare_import_record(item: Any) -> Tuple:
+    """
+    Разбирает и проверяет импортируемую функцию (выполняется в процессе проверки).
+    
+    Args:
+        item: Строка JSON, словарь с полями name, description, definition
+            или кортеж (имя, описание, определение в двоичном формате)
+        
+    Returns:
+        ("ok", имя, ((ссылка на корень, описание, производные колонки...), узлы, ссылки))
+        или ("error", имя, сообщение)
+    """
+    name = None
+    try:
+        if isinstance(item, tuple):
+            name, description, blob = item
+            record = {"name": name, "description": description}
+            prepared = _PREPARED_DEFINITIONS.get(blob)
+            cache_key = blob
+            if prepared is None:
+                definition = decode_definition(blob)
+                definition_json = dumps(definition, ensure_ascii=False)
+        else:
+            record = loads(item) if isinstance(item, str) else item
+            name = record["name"]
+            definition = record["definition"]
+            if is_flat_definition(definition):
+                definition = definition_from_flat(definition)
+            definition_json = cache_key = dumps(definition, ensure_ascii=False)
+            prepared = _PREPARED_DEFINITIONS.get(cache_key)
+        if prepared is None:
+            errors = Validator.validate(function_from_dict(definition))
+            if errors:
+                prepared = ("; ".join(errors), ())
+            else:
+                columns = DatabaseManager._function_columns(definition, definition_json)
+                prepared = (None, (
+                    DatabaseManager._root_definition(columns["hash"]),
+                    tuple(columns.values()),
+                    DatabaseManager._node_rows(definition_nodes(definition)),
+                    [(ref.get("name"), ref.get("hash"))
+                     for ref in definition_references(definition)]
+                ))
+            if len(_PREPARED_DEFINITIONS) >= _PREPARED_DEFINITIONS_SIZE:
+                _PREPARED_DEFINITIONS.clear()
+            _PREPARED_DEFINITIONS[cache_key] = prepared
+        error, stored = prepared
+        if error:
+            return ("error", name, error)
+        root_definition, columns, node_rows, refs = stored
+        row = (root_definition, record.get("description"), *columns)
+        return ("ok", name, (row, node_rows, refs))
+    except Exception as e:
+        return ("error", name, f"{type(e).__name__}: {e}")
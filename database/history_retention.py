@@ -0,0 +1,89 @@
+"""
+Хранение истории вычислений: политика хранения и фоновое сжатие.
+
+Записи истории старше заданного возраста и сверх заданного количества
+на функцию удаляются небольшими пакетами, каждый в своей транзакции,
+чтобы не задерживать запись новой истории. Сводная статистика
+(history_rollup) при этом сохраняется: она пополняется триггером при
+вставке и удалением записей истории не уменьшается.
+"""
+
+import threading
+from typing import Callable, Optional
+
+# Количество записей истории, удаляемых одной транзакцией
+HISTORY_DELETE_BATCH = 5000
+
+
+class RetentionPolicy:
+    """Политика хранения истории вычислений."""
+
+    def __init__(self, max_age_days: Optional[float] = None,
+                 max_rows_per_function: Optional[int] = None):
+        """
+        Args:
+            max_age_days: Максимальный возраст записи в днях (None - без ограничения)
+            max_rows_per_function: Количество хранимых последних записей каждой
+                функции (None - без ограничения)
+        """
+        if max_age_days is not None and max_age_days < 0:
+            raise ValueError("max_age_days must be non-negative")
+        if max_rows_per_function is not None and max_rows_per_function < 1:
+            raise ValueError("max_rows_per_function must be positive")
+        self.max_age_days = max_age_days
+        self.max_rows_per_function = max_rows_per_function
+
+    def is_empty(self) -> bool:
+        """Проверяет, что политика ничего не ограничивает."""
+        return self.max_age_days is None and self.max_rows_per_function is None
+
+    def __repr__(self) -> str:
+        return (f"RetentionPolicy(max_age_days={self.max_age_days}, "
+                f"max_rows_per_function={self.max_rows_per_function})")
+
+
+class HistoryCompactor:
+    """Фоновый поток, периодически сжимающий историю по политике хранения."""
+
+    def __init__(self, compact: Callable[[RetentionPolicy], int],
+                 policy: RetentionPolicy, interval: float):
+        """
+        Args:
+            compact: Функция сжатия, возвращающая количество удаленных записей
+            policy: Политика хранения
+            interval: Интервал между запусками в секундах
+        """
+        self.compact = compact
+        self.policy = policy
+        self.interval = interval
+        self.last_removed: Optional[int] = None
+        self.total_removed = 0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-compactor", daemon=True)
+        self._thread.start()
+
+    def run_once(self) -> int:
+        """
+        Выполняет одно сжатие.
+
+        Returns:
+            Количество удаленных записей истории
+        """
+        removed = self.compact(self.policy)
+        self.last_removed = removed
+        self.total_removed += removed
+        return removed
+
+    def _run(self) -> None:
+        """Основной цикл фонового потока."""
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"History compaction failed: {e}")
+
+    def stop(self) -> None:
+        """Останавливает сжатие, дождавшись текущего запуска."""
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,184 @@
+"""
+Отложенная пакетная запись истории вычислений.
+
+Записи истории ставятся в очередь и сбрасываются в базу фоновым потоком
+одной транзакцией через executemany: каждые N записей или каждые T мс.
+"""
+
+import json
+import logging
+import queue
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from database.connection_pool import ConnectionPool
+
+
+logger = logging.getLogger(__name__)
+
+
+# Уровни надежности и соответствующие значения прагмы synchronous
+DURABILITY_LEVELS = {
+    "fast": "OFF",  # максимальная скорость, возможна потеря записей при сбое ОС
+    "normal": "NORMAL",  # в режиме WAL теряются только последние транзакции при сбое ОС
+    "safe": "FULL",  # каждая транзакция надежно записана на диск
+}
+
+
+class HistoryWriteError(RuntimeError):
+    """Часть истории не удалось записать в базу."""
+
+
+class HistoryWriter:
+    """Фоновый пакетный писатель истории вычислений."""
+
+    # Число попыток записи пакета и пауза между ними в секундах
+    WRITE_ATTEMPTS = 3
+    RETRY_DELAY = 0.05
+
+    def __init__(self, pool: ConnectionPool, batch_size: int = 500,
+                 flush_interval_ms: int = 50, durability: str = "normal"):
+        """
+        Args:
+            pool: Пул соединений базы данных
+            batch_size: Количество записей, после которого пакет сбрасывается
+            flush_interval_ms: Максимальное время ожидания записи в очереди
+            durability: Уровень надежности: "fast", "normal" или "safe"
+        """
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level: {durability}")
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.durability = durability
+        self.written = 0
+        self.last_error: Optional[Exception] = None
+
+        # Записи, которые не удалось записать; повторяются со следующим пакетом
+        self._failed: List[Tuple] = []
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def add(self, function_id: int, arguments: List[int], result: int,
+            costs: Tuple = (None,) * 5) -> None:
+        """
+        Ставит запись истории в очередь.
+
+        Args:
+            function_id: ID функции
+            arguments: Аргументы
+            result: Результат
+            costs: Стоимость вычисления (steps, elapsed, depth, engine, cache_hit)
+        """
+        if self._closed:
+            raise RuntimeError("History writer is closed")
+        self._queue.put((function_id, json.dumps(arguments), str(result)) + tuple(costs))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Дожидается записи всех поставленных в очередь записей.
+
+        Args:
+            timeout: Максимальное время ожидания в секундах
+
+        Returns:
+            True, если все записи сброшены; False по таймауту или если
+            часть записей не удалось записать
+        """
+        if not self._thread.is_alive():
+            return self._queue.empty() and not self._failed
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout) and not self._failed
+
+    @property
+    def pending_failed(self) -> int:
+        """Количество записей, ожидающих повторной записи после ошибки."""
+        return len(self._failed)
+
+    def close(self) -> None:
+        """
+        Сбрасывает очередь и останавливает фоновый поток.
+
+        Raises:
+            HistoryWriteError: Если часть записей так и не удалось записать
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        if self._failed:
+            lost = len(self._failed)
+            self._failed = []
+            raise HistoryWriteError(
+                f"{lost} history records were not written: {self.last_error}"
+            ) from self.last_error
+
+    def _run(self) -> None:
+        """Основной цикл фонового потока."""
+        conn = self.pool.writer()
+        conn.execute(f"PRAGMA synchronous = {DURABILITY_LEVELS[self.durability]}")
+
+        running = True
+        while running:
+            item = self._queue.get()
+            batch: List[Tuple] = []
+            waiters: List[threading.Event] = []
+            deadline = time.monotonic() + self.flush_interval
+
+            # Собираем пакет, пока он не заполнится или не истечет время ожидания
+            while True:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if not running or waiters or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            # Ранее не записанные записи повторяются вместе с новым пакетом
+            if self._failed:
+                batch = self._failed + batch
+            if batch:
+                self._failed = [] if self._write_batch(conn, batch) else batch
+            for waiter in waiters:
+                waiter.set()
+
+    def _write_batch(self, conn, batch: List[Tuple]) -> bool:
+        """
+        Записывает пакет одной транзакцией, повторяя попытку при ошибке.
+
+        Returns:
+            True, если пакет записан
+        """
+        for attempt in range(1, self.WRITE_ATTEMPTS + 1):
+            try:
+                with conn:
+                    conn.executemany("""
+                        INSERT INTO history (function_id, arguments, result,
+                                             steps, elapsed, depth, engine, cache_hit)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, batch)
+                self.written += len(batch)
+                return True
+            except Exception as e:
+                self.last_error = e
+                if attempt < self.WRITE_ATTEMPTS:
+                    logger.warning("History batch write failed (attempt %d/%d): %s",
+                                   attempt, self.WRITE_ATTEMPTS, e)
+                    time.sleep(self.RETRY_DELAY * attempt)
+        logger.error("History batch of %d records not written, kept for retry: %s",
+                     len(batch), self.last_error)
+        return False
@@ -0,0 +1,150 @@
+"""
+Потоковые форматы библиотеки функций.
+
+Библиотека хранится в формате JSON Lines: одна функция на строку
+({"name", "description", "definition"}), при расширении .gz - со сжатием
+gzip. Файл читается и пишется построчно, не загружаясь в память целиком.
+
+Двоичная библиотека состоит из заголовка и записей, каждая из которых
+предваряется своей длиной (4 байта). Запись содержит имя, описание и
+определение в двоичном формате (core.codec).
+"""
+
+import gzip
+import json
+import struct
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from core.codec import ByteReader, CodecError, write_bytes, write_varint
+
+BINARY_LIBRARY_MAGIC = b"PRFLIB"
+BINARY_LIBRARY_VERSION = 1
+
+_RECORD_LENGTH = struct.Struct(">I")
+
+
+def open_library_file(path: str, mode: str = "r",
+                      compress: Optional[bool] = None) -> IO[str]:
+    """
+    Открывает файл библиотеки как текстовый поток.
+
+    Args:
+        path: Путь к файлу
+        mode: "r" - чтение, "w" - запись
+        compress: Сжатие gzip (None - если путь оканчивается на .gz)
+
+    Returns:
+        Текстовый поток в кодировке UTF-8
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    return open(path, mode, encoding="utf-8")
+
+
+def library_line(name: str, description: Optional[str], definition_json: str) -> str:
+    """
+    Формирует строку библиотеки.
+
+    Определение уже хранится в базе как JSON и вставляется без повторной
+    сериализации.
+    """
+    header = json.dumps({"name": name, "description": description}, ensure_ascii=False)
+    return f'{header[:-1]}, "definition": {definition_json}}}\n'
+
+
+def open_binary_library_file(path: str, mode: str = "r",
+                             compress: Optional[bool] = None) -> IO[bytes]:
+    """
+    Открывает двоичный файл библиотеки.
+
+    Args:
+        path: Путь к файлу
+        mode: "r" - чтение, "w" - запись
+        compress: Сжатие gzip (None - если путь оканчивается на .gz)
+
+    Returns:
+        Двоичный поток
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, mode + "b", compresslevel=6)
+    return open(path, mode + "b")
+
+
+def write_binary_library_header(stream: IO[bytes]) -> None:
+    """Записывает заголовок двоичной библиотеки."""
+    stream.write(BINARY_LIBRARY_MAGIC + bytes([BINARY_LIBRARY_VERSION]))
+
+
+def binary_library_record(name: str, description: Optional[str], definition: bytes) -> bytes:
+    """
+    Формирует запись двоичной библиотеки.
+
+    Описание записывается длиной + 1, чтобы отличать None (0) от пустой строки.
+    """
+    body = bytearray()
+    write_bytes(body, name.encode("utf-8"))
+    if description is None:
+        write_varint(body, 0)
+    else:
+        encoded = description.encode("utf-8")
+        write_varint(body, len(encoded) + 1)
+        body += encoded
+    write_bytes(body, definition)
+    return _RECORD_LENGTH.pack(len(body)) + body
+
+
+def iter_binary_library(stream: IO[bytes]) -> Iterator[Tuple[str, Optional[str], bytes]]:
+    """
+    Читает записи двоичной библиотеки.
+
+    Yields:
+        (имя, описание, определение в двоичном формате)
+    """
+    header = stream.read(len(BINARY_LIBRARY_MAGIC) + 1)
+    if header[:len(BINARY_LIBRARY_MAGIC)] != BINARY_LIBRARY_MAGIC:
+        raise CodecError("Not a binary function library")
+    if header[-1] != BINARY_LIBRARY_VERSION:
+        raise CodecError(f"Unsupported binary library version {header[-1]}")
+    while True:
+        prefix = stream.read(_RECORD_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) < _RECORD_LENGTH.size:
+            raise CodecError("Unexpected end of library")
+        (length,) = _RECORD_LENGTH.unpack(prefix)
+        body = stream.read(length)
+        if len(body) < length:
+            raise CodecError("Unexpected end of library")
+        reader = ByteReader(body)
+        name = reader.bytes().decode("utf-8")
+        description_length = reader.varint()
+        description = None
+        if description_length:
+            start = reader.pos
+            reader.pos += description_length - 1
+            description = body[start:reader.pos].decode("utf-8")
+        yield name, description, reader.bytes()
+
+
+def iter_library_lines(stream: IO[str]) -> Iterator[str]:
+    """Возвращает непустые строки файла библиотеки."""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Разбивает поток элементов на списки длины size."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
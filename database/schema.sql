@@ -4,11 +4,79 @@
 CREATE TABLE IF NOT EXISTS functions (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT UNIQUE NOT NULL,
-    definition TEXT NOT NULL,  -- JSON строка
+    definition TEXT NOT NULL,  -- JSON ссылка на корневой узел в таблице nodes
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    description TEXT
+    description TEXT,
+    hash TEXT,  -- структурный хэш определения
+    arity INTEGER,
+    node_count INTEGER,  -- количество узлов дерева определения
+    size INTEGER,  -- размер определения в байтах
+    updated_at TIMESTAMP,  -- время последнего изменения (с миллисекундами)
+    rendered TEXT,  -- текстовая запись определения для полнотекстового поиска
+    content_hash TEXT  -- структурный хэш со связанными ссылками (ключ кэша результатов)
 );
 
+-- Полнотекстовый индекс functions_fts (FTS5) и триггеры его синхронизации
+-- создаются DatabaseManager, если SQLite поддерживает FTS5
+
+-- Узлы определений, общие для всех функций (ключ - структурный хэш)
+CREATE TABLE IF NOT EXISTS nodes (
+    hash TEXT PRIMARY KEY,
+    params TEXT NOT NULL,  -- JSON параметров узла без дочерних узлов
+    children TEXT NOT NULL  -- JSON массив хэшей дочерних узлов
+);
+
+-- Ребра между узлами - для поиска функций, содержащих поддерево
+CREATE TABLE IF NOT EXISTS node_edges (
+    parent TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    child TEXT NOT NULL,
+    PRIMARY KEY(parent, position)
+) WITHOUT ROWID;
+
+-- Индекс зависимостей: ссылки функций на другие функции по имени или хэшу
+CREATE TABLE IF NOT EXISTS function_dependencies (
+    function_id INTEGER NOT NULL,
+    target_name TEXT,
+    target_hash TEXT,
+    FOREIGN KEY(function_id) REFERENCES functions(id) ON DELETE CASCADE
+);
+
+-- История версий определений: версия хранит только узлы, которых не было
+-- в предыдущей версии, периодически - полный снимок. Версии переживают
+-- удаление функции (см. deleted_functions)
+CREATE TABLE IF NOT EXISTS function_versions (
+    function_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    snapshot INTEGER NOT NULL,  -- 1 - полный снимок, 0 - дельта
+    root_hash TEXT NOT NULL,  -- структурный хэш определения версии
+    nodes TEXT NOT NULL,  -- JSON массив узлов [хэш, параметры, хэши дочерних узлов]
+    description TEXT,
+    created_at TIMESTAMP,
+    PRIMARY KEY(function_id, version)
+) WITHOUT ROWID;
+
+-- Удаленные функции, версии которых сохранены: по имени функцию можно
+-- восстановить, а новая функция с тем же именем продолжает ее историю
+CREATE TABLE IF NOT EXISTS deleted_functions (
+    name TEXT PRIMARY KEY,
+    function_id INTEGER NOT NULL,  -- ID удаленной функции в function_versions
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Канонический хэш и поведенческий отпечаток определения (по хэшу
+-- содержимого, поэтому запись не устаревает при изменении функций).
+-- Запись с error и пустыми хэшами - определение, которое не удалось
+-- проверить (оно не проверяется повторно)
+CREATE TABLE IF NOT EXISTS function_fingerprints (
+    content_hash TEXT PRIMARY KEY,
+    canonical_hash TEXT,  -- структурный хэш после упрощений
+    fingerprint TEXT,  -- хэш значений на всех пробах (NULL - не все пробы вычислены)
+    probe_prefix TEXT,  -- хэш значений на первых пробах (NULL - не все вычислены)
+    probe_values TEXT,  -- JSON массив значений проб
+    error TEXT
+) WITHOUT ROWID;
+
 -- Таблица для истории вычислений
 CREATE TABLE IF NOT EXISTS history (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -16,6 +84,11 @@ CREATE TABLE IF NOT EXISTS history (
     arguments TEXT NOT NULL,  -- JSON массив аргументов
     result TEXT NOT NULL,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    steps INTEGER,  -- количество шагов вычисления
+    elapsed REAL,  -- время вычисления в секундах
+    depth INTEGER,  -- максимальная глубина вычисления
+    engine TEXT,  -- способ вычисления: simple, tracking, cache, table
+    cache_hit INTEGER,  -- 1, если результат взят из кэша
     FOREIGN KEY(function_id) REFERENCES functions(id) ON DELETE CASCADE
 );
 
@@ -28,8 +101,58 @@ CREATE TABLE IF NOT EXISTS primitives (
     name TEXT
 );
 
+-- Журнал медленных вычислений
+CREATE TABLE IF NOT EXISTS slow_evaluations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    function_id INTEGER,
+    arguments TEXT NOT NULL,  -- JSON массив аргументов
+    steps INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    elapsed REAL NOT NULL,  -- секунды
+    engine TEXT NOT NULL,
+    error TEXT,  -- NULL, если вычисление завершилось успешно
+    peak_memory INTEGER,  -- байты, только при учете памяти
+    trace_memory INTEGER,  -- байты, удерживаемые трассой шагов
+    largest_int_bits INTEGER,  -- разрядность наибольшего промежуточного значения
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(function_id) REFERENCES functions(id) ON DELETE CASCADE
+);
+
+-- Контрольные точки долгих вычислений
+CREATE TABLE IF NOT EXISTS checkpoints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    function_hash TEXT NOT NULL,  -- структурный хэш функции
+    arguments TEXT NOT NULL,  -- JSON массив аргументов
+    state TEXT NOT NULL,  -- JSON состояние активных рекурсий
+    steps INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Кэш результатов по структурному хэшу функции и аргументам
+CREATE TABLE IF NOT EXISTS result_cache (
+    function_hash TEXT NOT NULL,
+    arguments TEXT NOT NULL,  -- JSON массив аргументов
+    result TEXT NOT NULL,  -- шестнадцатеричная запись результата
+    size INTEGER NOT NULL,  -- размер записи в байтах
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL,  -- julianday последнего обращения
+    PRIMARY KEY(function_hash, arguments)
+);
+
 -- Индексы для ускорения поиска
 CREATE INDEX IF NOT EXISTS idx_functions_name ON functions(name);
-CREATE INDEX IF NOT EXISTS idx_history_function_id ON history(function_id);
-CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
-
+-- Составные индексы для постраничной выборки истории по ключу (timestamp, id)
+CREATE INDEX IF NOT EXISTS idx_history_timestamp_id ON history(timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_function_fingerprints_canonical ON function_fingerprints(canonical_hash);
+CREATE INDEX IF NOT EXISTS idx_function_fingerprints_fingerprint ON function_fingerprints(fingerprint);
+CREATE INDEX IF NOT EXISTS idx_function_fingerprints_prefix ON function_fingerprints(probe_prefix);
+-- Индексы истории по функции (с колонкой cache_hit) создаются после миграции
+CREATE INDEX IF NOT EXISTS idx_slow_evaluations_function_id ON slow_evaluations(function_id);
+CREATE INDEX IF NOT EXISTS idx_slow_evaluations_elapsed ON slow_evaluations(elapsed);
+CREATE INDEX IF NOT EXISTS idx_slow_evaluations_steps ON slow_evaluations(steps);
+CREATE INDEX IF NOT EXISTS idx_checkpoints_key ON checkpoints(function_hash, arguments, id);
+CREATE INDEX IF NOT EXISTS idx_result_cache_last_used ON result_cache(last_used);
+CREATE INDEX IF NOT EXISTS idx_node_edges_child ON node_edges(child);
+CREATE INDEX IF NOT EXISTS idx_function_dependencies_function ON function_dependencies(function_id);
+CREATE INDEX IF NOT EXISTS idx_function_dependencies_name ON function_dependencies(target_name);
+CREATE INDEX IF NOT EXISTS idx_function_dependencies_hash ON function_dependencies(target_hash);
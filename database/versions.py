@@ -0,0 +1,91 @@
+"""
+Дельта-кодирование истории версий определений функций.
+
+Определение разбивается на узлы со структурными хэшами (definition_nodes).
+Версия хранит только узлы, которых не было в предыдущей версии, а каждая
+SNAPSHOT_INTERVAL-я версия (и версия, дельта которой не меньше половины
+определения) - полный снимок. Чтобы восстановить версию, достаточно
+объединить узлы от ближайшего снимка до нее и собрать определение от
+корня.
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Tuple
+
+from core.prf import definition_from_parts
+
+# Максимальное количество версий между полными снимками
+SNAPSHOT_INTERVAL = 16
+
+# Узел версии: хэш -> (параметры, хэши дочерних узлов)
+VersionNodes = Dict[str, Tuple[Dict[str, Any], List[str]]]
+
+
+def encode_nodes(nodes: Iterable[tuple]) -> str:
+    """Сериализует узлы (хэш, параметры, хэши дочерних узлов) версии."""
+    return json.dumps([[node_hash, params, children] for node_hash, params, children in nodes],
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_nodes(text: str) -> VersionNodes:
+    """Разбирает узлы версии."""
+    return {node_hash: (params, children) for node_hash, params, children in json.loads(text)}
+
+
+def version_delta(nodes: List[tuple], previous: VersionNodes) -> List[tuple]:
+    """Возвращает узлы, которых нет в предыдущей версии."""
+    return [node for node in nodes if node[0] not in previous]
+
+
+def needs_snapshot(version: int, last_snapshot: int, delta_size: int, full_size: int) -> bool:
+    """
+    Решает, записывать ли версию полным снимком.
+
+    Args:
+        version: Номер новой версии
+        last_snapshot: Номер последнего снимка (0 - снимков нет)
+        delta_size: Количество узлов дельты
+        full_size: Количество узлов определения
+    """
+    return (not last_snapshot or version - last_snapshot >= SNAPSHOT_INTERVAL
+            or 2 * delta_size >= full_size)
+
+
+def build_definition(root_hash: str, nodes: VersionNodes) -> Dict[str, Any]:
+    """
+    Собирает определение из узлов версии без рекурсии.
+
+    Одинаковые поддеревья собираются один раз и разделяются.
+
+    Raises:
+        KeyError: Если узла нет среди узлов версии
+    """
+    built: Dict[str, Dict[str, Any]] = {}
+    stack = [(root_hash, False)]
+    while stack:
+        node_hash, expanded = stack.pop()
+        if node_hash in built:
+            continue
+        params, children = nodes[node_hash]
+        if children and not expanded:
+            stack.append((node_hash, True))
+            stack.extend((child, False) for child in children)
+            continue
+        built[node_hash] = definition_from_parts(params, [built[child] for child in children])
+    return built[root_hash]
+
+
+def reachable_nodes(root_hash: str, nodes: VersionNodes) -> List[tuple]:
+    """Возвращает узлы, достижимые из корня, в виде (хэш, параметры, хэши дочерних)."""
+    result = []
+    seen = set()
+    stack = [root_hash]
+    while stack:
+        node_hash = stack.pop()
+        if node_hash in seen:
+            continue
+        seen.add(node_hash)
+        params, children = nodes[node_hash]
+        result.append((node_hash, params, children))
+        stack.extend(children)
+    return result
@@ -92,15 +92,19 @@ class LoadFunctionDialog:
     """Диалог загрузки функции из базы данных."""
     
     def __init__(self, parent, functions: List[Dict[str, Any]], 
-                 on_load: Optional[Callable] = None):
+                 on_load: Optional[Callable] = None,
+                 on_search: Optional[Callable] = None):
         """
         Args:
             parent: Родительское окно
-            functions: Список функций из базы данных
+            functions: Список метаданных функций из базы данных
             on_load: Callback при загрузке
+            on_search: Функция поиска: запрос -> список метаданных функций
         """
         self.result = None
         self.on_load = on_load
+        self.on_search = on_search
+        self.functions = functions
         
         # Создаем модальное окно
         self.dialog = tk.Toplevel(parent)
@@ -109,6 +113,17 @@ class LoadFunctionDialog:
         self.dialog.grab_set()
         self.dialog.geometry("500x400")
         
+        # Поиск по имени, описанию и определению
+        if on_search:
+            search_frame = ttk.Frame(self.dialog)
+            search_frame.pack(fill="x", padx=5, pady=5)
+            ttk.Label(search_frame, text="Поиск:").pack(side="left")
+            self.search_var = tk.StringVar()
+            search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+            search_entry.pack(side="left", fill="x", expand=True, padx=5)
+            search_entry.bind("<Return>", lambda e: self._on_search())
+            ttk.Button(search_frame, text="Найти", command=self._on_search).pack(side="left")
+        
         # Список функций
         ttk.Label(self.dialog, text="Выберите функцию:").pack(pady=5)
         
@@ -116,11 +131,13 @@ class LoadFunctionDialog:
         frame.pack(fill="both", expand=True, padx=5, pady=5)
         
         # Treeview для списка функций
-        self.tree = ttk.Treeview(frame, columns=("description",), show="tree headings", height=10)
+        self.tree = ttk.Treeview(frame, columns=("arity", "description"), show="tree headings", height=10)
         self.tree.heading("#0", text="Имя функции")
+        self.tree.heading("arity", text="Арность")
         self.tree.heading("description", text="Описание")
-        self.tree.column("#0", width=200)
-        self.tree.column("description", width=250)
+        self.tree.column("#0", width=180)
+        self.tree.column("arity", width=70)
+        self.tree.column("description", width=200)
         
         scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
         self.tree.configure(yscrollcommand=scrollbar.set)
@@ -129,9 +146,7 @@ class LoadFunctionDialog:
         scrollbar.pack(side="right", fill="y")
         
         # Заполняем список
-        for func in functions:
-            desc = func.get("description", "") or ""
-            self.tree.insert("", "end", text=func["name"], values=(desc,))
+        self._fill(functions)
         
         # Кнопки
         button_frame = ttk.Frame(self.dialog)
@@ -143,6 +158,21 @@ class LoadFunctionDialog:
         # Двойной клик для загрузки
         self.tree.bind("<Double-1>", lambda e: self._on_load())
     
+    def _fill(self, functions: List[Dict[str, Any]]) -> None:
+        """Заполняет список функций."""
+        self.tree.delete(*self.tree.get_children())
+        for func in functions:
+            # Для результатов поиска показываем фрагмент с совпадением
+            desc = func.get("snippet") or func.get("description", "") or ""
+            arity = func.get("arity")
+            self.tree.insert("", "end", text=func["name"],
+                             values=("" if arity is None else arity, desc))
+    
+    def _on_search(self) -> None:
+        """Обработчик поиска."""
+        query = self.search_var.get().strip()
+        self._fill(self.on_search(query) if query else self.functions)
+    
     def _on_load(self) -> None:
         """Обработчик загрузки."""
         selection = self.tree.selection()
@@ -4,7 +4,7 @@
 
 import tkinter as tk
 from tkinter import ttk
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
 
@@ -18,14 +18,21 @@ class HistoryPanel(ttk.Frame):
         """
         super().__init__(parent)
         
+        # Курсор (timestamp, id) самой новой загруженной записи
+        self.cursor: Optional[Tuple[str, int]] = None
+        
         # Заголовок
         title_label = ttk.Label(self, text="История вычислений", font=("Arial", 12, "bold"))
         title_label.pack(pady=5)
         
+        # Сводка по всей истории (из предварительно агрегированной статистики)
+        self.summary_label = ttk.Label(self, text="", anchor="w", justify="left")
+        self.summary_label.pack(fill="x", pady=(0, 5))
+        
         # Список истории
         self.tree = ttk.Treeview(
             self,
-            columns=("function", "arguments", "result", "timestamp"),
+            columns=("function", "arguments", "result", "timestamp", "steps", "elapsed"),
             show="headings",
             height=10
         )
@@ -35,11 +42,15 @@ class HistoryPanel(ttk.Frame):
         self.tree.heading("arguments", text="Аргументы")
         self.tree.heading("result", text="Результат")
         self.tree.heading("timestamp", text="Время")
+        self.tree.heading("steps", text="Шагов")
+        self.tree.heading("elapsed", text="Длительность")
         
         self.tree.column("function", width=150)
         self.tree.column("arguments", width=100)
         self.tree.column("result", width=100)
         self.tree.column("timestamp", width=150)
+        self.tree.column("steps", width=80, anchor="e")
+        self.tree.column("elapsed", width=90, anchor="e")
         
         # Полоса прокрутки
         scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.tree.yview)
@@ -49,7 +60,18 @@ class HistoryPanel(ttk.Frame):
         self.tree.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
     
-    def add_entry(self, function_name: str, arguments: List[int], result: int) -> None:
+    @staticmethod
+    def _format_costs(steps: Optional[int], elapsed: Optional[float],
+                      cache_hit: Optional[bool] = None) -> Tuple[str, str]:
+        """Форматирует стоимость вычисления для колонок панели."""
+        if cache_hit:
+            return "", "кэш"
+        steps_str = str(steps) if steps is not None else ""
+        elapsed_str = f"{elapsed * 1000:.1f} мс" if elapsed is not None else ""
+        return steps_str, elapsed_str
+    
+    def add_entry(self, function_name: str, arguments: List[int], result: int,
+                  steps: Optional[int] = None, elapsed: Optional[float] = None) -> None:
         """
         Добавляет запись в историю.
         
@@ -57,6 +79,8 @@ class HistoryPanel(ttk.Frame):
             function_name: Имя функции
             arguments: Аргументы
             result: Результат
+            steps: Количество шагов вычисления
+            elapsed: Время вычисления в секундах
         """
         args_str = ", ".join(str(a) for a in arguments)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -64,7 +88,8 @@ class HistoryPanel(ttk.Frame):
         self.tree.insert(
             "",
             "end",
-            values=(function_name, args_str, str(result), timestamp)
+            values=(function_name, args_str, str(result), timestamp,
+                    *self._format_costs(steps, elapsed))
         )
         
         # Прокрутка к последней записи
@@ -72,36 +97,83 @@ class HistoryPanel(ttk.Frame):
         if children:
             self.tree.see(children[-1])
     
+    def _insert_entry(self, entry: Dict[str, Any], index: Any) -> None:
+        """Вставляет запись истории из базы данных в позицию index."""
+        function_name = entry.get("function_name", "Unknown")
+        arguments = entry.get("arguments", [])
+        result = entry.get("result", "")
+        timestamp = entry.get("timestamp", "")
+        
+        args_str = ", ".join(str(a) for a in arguments) if isinstance(arguments, list) else str(arguments)
+        
+        costs = self._format_costs(entry.get("steps"), entry.get("elapsed"), entry.get("cache_hit"))
+        
+        self.tree.insert(
+            "",
+            index,
+            values=(function_name, args_str, str(result), timestamp, *costs)
+        )
+    
     def load_history(self, history: List[Dict[str, Any]]) -> None:
         """
         Загружает историю из базы данных.
         
         Args:
-            history: Список записей истории
+            history: Список записей истории (от новых к старым)
         """
         # Очищаем текущую историю
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        self.clear()
         
         # Добавляем записи
         for entry in history:
-            function_name = entry.get("function_name", "Unknown")
-            arguments = entry.get("arguments", [])
-            result = entry.get("result", "")
-            timestamp = entry.get("timestamp", "")
-            
-            args_str = ", ".join(str(a) for a in arguments) if isinstance(arguments, list) else str(arguments)
-            
-            self.tree.insert(
-                "",
-                "end",
-                values=(function_name, args_str, str(result), timestamp)
-            )
+            self._insert_entry(entry, "end")
+        
+        if history:
+            self.cursor = (history[0]["timestamp"], history[0]["id"])
+    
+    def append_history(self, history: List[Dict[str, Any]], limit: Optional[int] = None) -> None:
+        """
+        Добавляет новые записи в начало списка, не перезагружая остальные.
+        
+        Args:
+            history: Новые записи истории (от старых к новым)
+            limit: Максимальное количество записей в панели
+        """
+        for entry in history:
+            self._insert_entry(entry, 0)
+        
+        if history:
+            self.cursor = (history[-1]["timestamp"], history[-1]["id"])
+        
+        if limit is not None:
+            for item in self.tree.get_children()[limit:]:
+                self.tree.delete(item)
+    
+    def show_summary(self, summary: Optional[Dict[str, Any]]) -> None:
+        """
+        Показывает сводку вычислений.
+        
+        Args:
+            summary: Сводка из DatabaseManager.get_history_summary (None - скрыть)
+        """
+        if not summary or not summary.get("calls"):
+            self.summary_label.config(text="")
+            return
+        
+        lines = [f"Вычислений: {summary['calls']} за {summary['days']} дн."]
+        if summary.get("avg_steps") is not None:
+            lines.append(f"Шагов: {summary['min_steps']}..{summary['max_steps']}, "
+                         f"в среднем {summary['avg_steps']:.0f}")
+        if summary.get("avg_elapsed") is not None:
+            lines.append(f"Время: в среднем {summary['avg_elapsed'] * 1000:.1f} мс, "
+                         f"максимум {summary['max_elapsed'] * 1000:.1f} мс")
+        self.summary_label.config(text="\n".join(lines))
     
     def clear(self) -> None:
         """Очищает историю."""
         for item in self.tree.get_children():
             self.tree.delete(item)
+        self.cursor = None
     
     def get_selected_entry(self) -> Optional[Dict[str, Any]]:
         """
@@ -6,11 +6,13 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 from typing import Optional, Dict, Any, List
 import json
+import threading
 
-from core.prf import PrimitiveFunction, function_from_dict, create_addition, create_multiplication, create_factorial
-from core.evaluator import Evaluator
+from core.prf import PrimitiveFunction, LazyFunction, function_from_dict, create_addition, create_multiplication, create_factorial
+from core.evaluator import Evaluator, CancellationToken, EvaluationCancelled
 from core.validator import Validator
 from database.db_manager import DatabaseManager
+from database.history_retention import RetentionPolicy
 from gui.canvas_widget import CanvasWidget
 from gui.history_panel import HistoryPanel
 from gui.dialogs import FunctionDialog, LoadFunctionDialog, SettingsDialog, show_about_dialog, show_help_dialog
@@ -29,19 +31,44 @@ class MainWindow:
         # Менеджер базы данных
         self.db_manager = DatabaseManager()
         
-        # Вычислитель
-        self.evaluator = Evaluator()
+        # Настройки
+        self.settings = {
+            "max_depth": 300000,
+            "max_steps": 100000000,
+            "slow_steps_threshold": 1000000,
+            "slow_time_threshold": 1.0,
+            "history_max_age_days": 365,
+            "history_max_rows_per_function": 10000,
+            "history_compaction_interval": 3600
+        }
+        
+        # Периодическое сжатие истории по политике хранения
+        self.db_manager.start_history_compaction(
+            RetentionPolicy(max_age_days=self.settings["history_max_age_days"],
+                            max_rows_per_function=self.settings["history_max_rows_per_function"]),
+            interval=self.settings["history_compaction_interval"]
+        )
+        
+        # Вычислитель (медленные вычисления попадают в журнал БД,
+        # результаты кэшируются в БД между сеансами)
+        self.evaluator = Evaluator(
+            slow_log=self.db_manager,
+            result_cache=self.db_manager,
+            value_tables=self.db_manager.value_tables(),
+            slow_steps_threshold=self.settings["slow_steps_threshold"],
+            slow_time_threshold=self.settings["slow_time_threshold"]
+        )
         
         # Текущая функция
         self.current_function: Optional[PrimitiveFunction] = None
         self.current_function_name: Optional[str] = None
         self.current_function_id: Optional[int] = None
         
-        # Настройки
-        self.settings = {
-            "max_depth": 300000,
-            "max_steps": 100000000
-        }
+        # Фоновое вычисление
+        self._compute_thread: Optional[threading.Thread] = None
+        self._cancel_token: Optional[CancellationToken] = None
+        self._compute_outcome: Optional[tuple] = None
+        self._compute_progress: Optional[tuple] = None
         
         self._create_menu()
         self._create_toolbar()
@@ -171,7 +198,13 @@ class MainWindow:
         self.args_entry.pack(fill="x", pady=2)
         self.args_entry.bind("<Return>", lambda e: self._compute_function())
         
-        ttk.Button(compute_frame, text="Вычислить", command=self._compute_function).pack(pady=5)
+        buttons_frame = ttk.Frame(compute_frame)
+        buttons_frame.pack(pady=5)
+        ttk.Button(buttons_frame, text="Вычислить", command=self._compute_function).pack(side="left", padx=2)
+        self.cancel_button = ttk.Button(
+            buttons_frame, text="Отмена", command=self._cancel_computation, state="disabled"
+        )
+        self.cancel_button.pack(side="left", padx=2)
         
         ttk.Label(compute_frame, text="Результат:").pack(anchor="w", pady=2)
         self.result_text = tk.Text(compute_frame, height=5, width=30, wrap="word")
@@ -238,8 +271,12 @@ class MainWindow:
     def _update_function_info(self) -> None:
         """Обновляет информацию о функции в панели параметров."""
         if self.current_function:
-            func_type = type(self.current_function).__name__
-            arity = self.current_function.arity()
+            function = self.current_function
+            if isinstance(function, LazyFunction):
+                # Строится только верхний узел, дочерние остаются ленивыми
+                function = function.resolve()
+            func_type = type(function).__name__
+            arity = function.arity()
             
             self.function_type_label.config(text=func_type)
             self.arity_label.config(text=str(arity))
@@ -302,13 +339,75 @@ class MainWindow:
             messagebox.showerror("Ошибка", error)
             return
         
-        # Вычисление
+        if self._compute_thread is not None and self._compute_thread.is_alive():
+            messagebox.showwarning("Предупреждение", "Вычисление уже выполняется")
+            return
+        
+        # Вычисление выполняется в фоновом потоке, чтобы окно не блокировалось
+        self.evaluator.max_depth = self.settings["max_depth"]
+        self.evaluator.max_steps = self.settings["max_steps"]
+        self._cancel_token = CancellationToken()
+        self._compute_outcome = None
+        self._compute_progress = None
+        
+        self._compute_thread = threading.Thread(
+            target=self._run_computation,
+            args=(self.current_function, args, self.current_function_id),
+            daemon=True
+        )
+        self._compute_thread.start()
+        self.cancel_button.config(state="normal")
+        self._update_status("Вычисление...")
+        self.root.after(100, self._poll_computation, args, self.current_function_id)
+    
+    def _run_computation(self, function: PrimitiveFunction, args: List[int],
+                         function_id: Optional[int]) -> None:
+        """Выполняет вычисление в фоновом потоке."""
+        try:
+            result = self.evaluator.evaluate(
+                function, args, track_steps=False,
+                function_id=function_id,
+                cancel_token=self._cancel_token,
+                progress_callback=self._on_compute_progress
+            )
+            self._compute_outcome = ("ok", result)
+        except Exception as e:
+            self._compute_outcome = ("error", e)
+    
+    def _on_compute_progress(self, steps: int, depth: int, fraction: Optional[float]) -> None:
+        """Запоминает прогресс вычисления (вызывается из фонового потока)."""
+        self._compute_progress = (steps, depth, fraction)
+    
+    def _cancel_computation(self) -> None:
+        """Отменяет текущее вычисление."""
+        if self._cancel_token is not None:
+            self._cancel_token.cancel()
+            self._update_status("Отмена вычисления...")
+    
+    def _poll_computation(self, args: List[int], function_id: Optional[int]) -> None:
+        """Отслеживает фоновое вычисление из главного потока."""
+        if self._compute_thread is not None and self._compute_thread.is_alive():
+            if self._compute_progress is not None:
+                steps, depth, fraction = self._compute_progress
+                progress = f", {fraction:.0%}" if fraction is not None else ""
+                self._update_status(f"Вычисление... шагов: {steps}, глубина: {depth}{progress}")
+            self.root.after(100, self._poll_computation, args, function_id)
+            return
+        
+        self.cancel_button.config(state="disabled")
+        status, value = self._compute_outcome or ("error", RuntimeError("No result"))
+        if status == "ok":
+            self._show_result(args, value, function_id)
+        elif isinstance(value, EvaluationCancelled):
+            self._update_status("Вычисление отменено")
+        elif isinstance(value, RecursionError):
+            messagebox.showerror("Ошибка", f"Превышена максимальная глубина рекурсии: {value}")
+        else:
+            messagebox.showerror("Ошибка", f"Ошибка вычисления: {value}")
+    
+    def _show_result(self, args: List[int], result: int, function_id: Optional[int]) -> None:
+        """Выводит результат вычисления и сохраняет его в историю."""
         try:
-            self.evaluator.max_depth = self.settings["max_depth"]
-            self.evaluator.max_steps = self.settings["max_steps"]
-            
-            result = self.evaluator.evaluate(self.current_function, args, track_steps=False)
-            
             # Выводим результат
             self.result_text.delete("1.0", "end")
             self.result_text.insert("1.0", f"Результат: {result}\n\n")
@@ -326,18 +425,18 @@ class MainWindow:
                     self.result_text.insert("end", f"  - {warning}\n")
             
             # Сохраняем в историю
-            if self.current_function_id:
-                self.db_manager.save_history(self.current_function_id, args, result)
-                self._refresh_history()
-            
-            # Добавляем в панель истории
-            func_name = self.current_function_name or "Unknown"
-            self.history_panel.add_entry(func_name, args, result)
+            if function_id:
+                self.db_manager.save_history(function_id, args, result,
+                                             **DatabaseManager.history_costs(stats))
+                self._update_history()
+            else:
+                # Добавляем в панель истории
+                func_name = self.current_function_name or "Unknown"
+                self.history_panel.add_entry(func_name, args, result,
+                                             steps=stats["total_steps"], elapsed=stats["elapsed"])
             
             self._update_status(f"Вычислено: {result}")
         
-        except RecursionError as e:
-            messagebox.showerror("Ошибка", f"Превышена максимальная глубина рекурсии: {e}")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Ошибка вычисления: {e}")
     
@@ -353,9 +452,10 @@ class MainWindow:
             return
         
         # Валидация
-        errors = Validator.validate(self.current_function)
+        errors = Validator.validate_detailed(self.current_function)
         if errors:
-            messagebox.showerror("Ошибка", f"Функция некорректна:\n" + "\n".join(errors))
+            messagebox.showerror("Ошибка", f"Функция некорректна:\n" + "\n".join(
+                f"{error.location}: {error.message}" for error in errors))
             return
         
         # Диалог сохранения
@@ -387,22 +487,28 @@ class MainWindow:
     
     def _load_function(self) -> None:
         """Загружает функцию из базы данных."""
-        functions = self.db_manager.list_functions()
+        # Для списка достаточно метаданных, определения разбираются только при загрузке
+        functions = self.db_manager.list_function_metadata()
         
         if not functions:
             messagebox.showinfo("Информация", "В базе данных нет сохраненных функций")
             return
         
-        dialog = LoadFunctionDialog(self.root, functions, on_load=None)
+        dialog = LoadFunctionDialog(self.root, functions, on_load=None,
+                                    on_search=self.db_manager.full_text_search)
         function_name = dialog.show()
         
         if function_name:
             try:
-                func_data = self.db_manager.load_function(name=function_name)
-                if func_data:
-                    self.current_function = function_from_dict(func_data["definition"])
-                    self.current_function_name = func_data["name"]
-                    self.current_function_id = func_data["id"]
+                metadata = self.db_manager.get_function_metadata(name=function_name)
+                function = (
+                    self.db_manager.load_function_object(function_id=metadata["id"], lazy=True)
+                    if metadata else None
+                )
+                if function:
+                    self.current_function = function
+                    self.current_function_name = metadata["name"]
+                    self.current_function_id = metadata["id"]
                     
                     self.canvas_widget.load_function(self.current_function)
                     self._update_function_info()
@@ -487,14 +593,41 @@ class MainWindow:
             except Exception as e:
                 messagebox.showerror("Ошибка", f"Не удалось экспортировать функцию: {e}")
     
+    # Количество записей в панели истории
+    HISTORY_PAGE_SIZE = 50
+    
     def _refresh_history(self) -> None:
         """Обновляет панель истории."""
         if self.current_function_id:
-            history = self.db_manager.get_history(function_id=self.current_function_id, limit=50)
+            history = self.db_manager.get_history(function_id=self.current_function_id,
+                                                  limit=self.HISTORY_PAGE_SIZE)
             self.history_panel.load_history(history)
         else:
-            history = self.db_manager.get_history(limit=50)
+            history = self.db_manager.get_history(limit=self.HISTORY_PAGE_SIZE)
             self.history_panel.load_history(history)
+        self._refresh_history_summary()
+    
+    def _refresh_history_summary(self) -> None:
+        """Обновляет сводку истории по предварительно агрегированной статистике."""
+        self.history_panel.show_summary(
+            self.db_manager.get_history_summary(self.current_function_id)
+        )
+    
+    def _update_history(self) -> None:
+        """Добавляет в панель историю, записанную после последнего обновления."""
+        if self.history_panel.cursor is None:
+            self._refresh_history()
+            return
+        history = self.db_manager.get_history_since(
+            self.history_panel.cursor, function_id=self.current_function_id,
+            limit=self.HISTORY_PAGE_SIZE
+        )
+        if len(history) >= self.HISTORY_PAGE_SIZE:
+            # Новых записей больше, чем помещается в панель
+            self._refresh_history()
+        else:
+            self.history_panel.append_history(history, limit=self.HISTORY_PAGE_SIZE)
+            self._refresh_history_summary()
     
     def _undo(self) -> None:
         """Отменяет последнее действие."""
@@ -119,6 +119,1495 @@ def test_serialization():
     print("✓ Serialization works correctly")
 
 
+def test_slow_log():
+    """Тестирует журнал медленных вычислений."""
+    print("\nТестирование журнала медленных вычислений...")
+    
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    evaluator = Evaluator(slow_log=db, slow_steps_threshold=50)
+    
+    evaluator.evaluate(create_addition(), [1, 1])
+    assert db.get_slow_evaluations() == [], "Fast evaluation should not be logged"
+    
+    evaluator.evaluate(create_multiplication(), [6, 7])
+    slow = db.get_slow_evaluations(order_by="steps")
+    assert len(slow) == 1, f"Expected 1 slow entry, got {len(slow)}"
+    assert slow[0]["arguments"] == [6, 7]
+    assert slow[0]["steps"] == evaluator.get_statistics()["total_steps"]
+    assert slow[0]["engine"] == "simple"
+    
+    top = db.get_top_slow_functions()
+    assert top[0]["count"] == 1
+    db.close()
+    print("✓ Slow evaluations are logged")
+
+
+def test_memory_accounting():
+    """Тестирует учет памяти и бюджет памяти."""
+    print("\nТестирование учета памяти...")
+    
+    from core.evaluator import MemoryBudgetExceeded
+    
+    evaluator = Evaluator(track_memory=True)
+    result = evaluator.evaluate(create_factorial(), [5], track_steps=True)
+    stats = evaluator.get_statistics()
+    assert result == 120
+    assert stats["largest_int_bits"] == (120).bit_length()
+    assert stats["peak_memory"] > 0 and stats["trace_memory"] > 0
+    print(f"✓ Peak memory: {stats['peak_memory']} bytes")
+    
+    evaluator = Evaluator(memory_budget=1024, memory_check_interval=10)
+    try:
+        evaluator.evaluate(create_factorial(), [5], track_steps=True)
+        assert False, "Memory budget should be exceeded"
+    except MemoryBudgetExceeded:
+        pass
+    assert evaluator.get_steps() == [], "Aborted evaluation should release its trace"
+    print("✓ Memory budget aborts evaluation")
+
+
+def test_hooks():
+    """Тестирует обработчики событий вычисления."""
+    print("\nТестирование обработчиков событий...")
+    
+    import io
+    import json
+    from core.hooks import JsonLinesSink, HistogramSink
+    
+    evaluator = Evaluator()
+    histogram = HistogramSink()
+    evaluator.add_sink(histogram)
+    assert evaluator.evaluate(create_addition(), [3, 4]) == 7
+    counts = histogram.summary()["counts"]
+    assert counts["recursion_iteration"]["PrimitiveRecursion"] == 3
+    assert counts["enter_node"] == counts["exit_node"]
+    print("✓ Histogram sink collects events")
+    
+    evaluator.remove_sink(histogram)
+    stream = io.StringIO()
+    evaluator.add_sink(JsonLinesSink(stream, events=["limit_exceeded"]))
+    evaluator.max_steps = 10
+    try:
+        evaluator.evaluate(create_multiplication(), [5, 5])
+        assert False, "Step limit should be exceeded"
+    except RecursionError:
+        pass
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [r["kind"] for r in records] == ["steps"]
+    print("✓ JSON lines sink records limit events")
+
+
+def test_cancellation():
+    """Тестирует отмену, срок и прогресс вычисления."""
+    print("\nТестирование отмены вычислений...")
+    
+    import time
+    from core.evaluator import CancellationToken, EvaluationCancelled, EvaluationTimeout
+    
+    evaluator = Evaluator(check_interval=100)
+    progress = []
+    result = evaluator.evaluate(
+        create_multiplication(), [30, 30],
+        progress_callback=lambda steps, depth, fraction: progress.append(fraction)
+    )
+    assert result == 900 and progress, "Progress should be reported"
+    assert all(0 <= f <= 1 for f in progress if f is not None)
+    print(f"✓ Progress reported {len(progress)} times")
+    
+    token = CancellationToken()
+    token.cancel()
+    try:
+        evaluator.evaluate(create_multiplication(), [30, 30], cancel_token=token)
+        assert False, "Evaluation should be cancelled"
+    except EvaluationCancelled:
+        pass
+    print("✓ Cancellation token stops evaluation")
+    
+    try:
+        evaluator.evaluate(create_factorial(), [10], deadline=time.monotonic() - 1)
+        assert False, "Evaluation should time out"
+    except EvaluationTimeout:
+        pass
+    print("✓ Deadline stops evaluation")
+
+
+def test_checkpoints():
+    """Тестирует возобновление вычисления с контрольной точки."""
+    print("\nТестирование контрольных точек...")
+    
+    from core.prf import function_hash
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    fact = create_factorial()
+    
+    # Прерываем вычисление по лимиту шагов после нескольких контрольных точек
+    evaluator = Evaluator(max_steps=20000, checkpoint_store=db, checkpoint_interval=500)
+    try:
+        evaluator.evaluate(fact, [7])
+        assert False, "Step limit should be exceeded"
+    except RecursionError:
+        pass
+    state = db.load_checkpoint(function_hash(fact), [7])
+    assert state and state["frames"], "Checkpoint should be saved"
+    
+    evaluator = Evaluator(checkpoint_store=db, checkpoint_interval=500)
+    assert evaluator.evaluate(fact, [7]) == 5040
+    assert evaluator.resumed_from is not None, "Evaluation should resume"
+    assert db.load_checkpoint(function_hash(fact), [7]) is None, "Checkpoint should be removed"
+    db.close()
+    print(f"✓ Resumed from step {evaluator.resumed_from}")
+
+
+def test_result_cache():
+    """Тестирует постоянный кэш результатов."""
+    print("\nТестирование кэша результатов...")
+    
+    from core.prf import function_hash
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    mult = create_multiplication()
+    db.save_function("mult", mult.to_dict())
+    
+    evaluator = Evaluator(result_cache=db)
+    assert evaluator.evaluate(mult, [12, 12]) == 144
+    assert not evaluator.cache_hit
+    assert evaluator.evaluate(create_multiplication(), [12, 12]) == 144
+    assert evaluator.cache_hit and evaluator.get_statistics()["total_steps"] == 0
+    # Попадание не пишет в базу: счетчик записывается со следующим сохранением
+    changes = db.conn.total_changes
+    assert db.get_cached_result(function_hash(mult), [12, 12]) == 144
+    assert db.conn.total_changes == changes and not db.conn.in_transaction
+    assert db.get_result_cache_stats()["hits"] == 2
+    db.save_cached_result(function_hash(mult), [1, 1], 1)
+    assert db.read_conn.execute("SELECT SUM(hits) FROM result_cache").fetchone()[0] == 2
+    print("✓ Repeated evaluation is served from the cache")
+    
+    # Изменение определения удаляет результаты старой версии
+    db.save_function("mult", create_addition().to_dict())
+    assert db.get_cached_result(function_hash(mult), [12, 12]) is None
+    print("✓ Changing the definition invalidates cached results")
+    
+    db.result_cache_max_bytes = 2000
+    for x in range(50):
+        evaluator.evaluate(create_addition(), [x, 1])
+    assert db.get_result_cache_stats()["bytes"] <= 2000
+    
+    # Повторное сохранение того же ключа не увеличивает учтенный размер
+    entries = db.read_conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+    for _ in range(100):
+        db.save_cached_result("h" * 64, [1, 2], 3)
+    assert db._result_cache_bytes == db._result_cache_size()
+    assert db.read_conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0] == entries + 1
+    db.close()
+    print("✓ Cache is evicted by size")
+
+
+def test_connection_pool():
+    """Тестирует пул соединений и режим WAL."""
+    print("\nТестирование пула соединений...")
+    
+    import os
+    import tempfile
+    import threading
+    from database.db_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "test.db"))
+        mode = db.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode.lower() == "wal", f"Expected WAL journal, got {mode}"
+        
+        function_id = db.save_function("add", create_addition().to_dict())
+        results = {}
+        
+        def worker():
+            # Другой поток получает собственные соединения
+            results["conn"] = db.conn
+            db.save_history(function_id, [1, 2], 3)
+            results["history"] = db.get_history(function_id)
+        
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        
+        assert results["conn"] is not db.conn, "Threads should not share connections"
+        assert len(results["history"]) == 1
+        assert len(db.get_history(function_id)) == 1, "Reader should see committed rows"
+        # Соединения завершившихся потоков закрываются
+        threads = [threading.Thread(target=db.get_history, args=(function_id,)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        assert db._pool.connection_count() == 2, db._pool.connection_count()
+        try:
+            db.read_conn.execute("DELETE FROM history")
+            assert False, "Read connection should be read-only"
+        except Exception:
+            pass
+        db.close()
+    
+    # Соединение базы в памяти одно на все потоки, доступ сериализуется
+    db = DatabaseManager(":memory:")
+    function_id = db.save_function("add", create_addition().to_dict())
+    errors = []
+    
+    def writer():
+        try:
+            for _ in range(20):
+                with db.conn:
+                    db.conn.execute("INSERT INTO history (function_id, arguments, result) "
+                                    "VALUES (?, '[1, 2]', 3)", (function_id,))
+                db.get_history(function_id)
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=writer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == [], errors
+    assert db.read_conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 80
+    assert db._pool.connection_count() == 1
+    db.close()
+    print("✓ Per-thread connections with WAL work")
+
+
+def test_async_history():
+    """Тестирует отложенную пакетную запись истории."""
+    print("\nТестирование отложенной записи истории...")
+    
+    import os
+    import tempfile
+    from database.db_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test.db")
+        db = DatabaseManager(path, async_history=True, history_batch_size=100)
+        function_id = db.save_function("add", create_addition().to_dict())
+        for x in range(250):
+            assert db.save_history(function_id, [x, 1], x + 1) is None
+        assert db.flush_history(timeout=5)
+        assert len(db.get_history(function_id, limit=1000)) == 250
+        
+        for x in range(10):
+            db.save_history(function_id, [x, 2], x + 2)
+        db.close()  # закрытие сбрасывает очередь
+        
+        db = DatabaseManager(path)
+        assert len(db.get_history(function_id, limit=1000)) == 260
+        db.close()
+        
+        # Неудачный пакет не теряется молча: flush() сообщает об ошибке,
+        # записи повторяются, а close() поднимает исключение
+        import sqlite3
+        from database.history_writer import HistoryWriteError
+        db = DatabaseManager(path, async_history=True)
+        db._history_writer.RETRY_DELAY = 0
+        other = sqlite3.connect(path)
+        other.execute("ALTER TABLE history RENAME TO history_hidden")
+        other.commit()
+        for x in range(5):
+            db.save_history(function_id, [x, 3], x + 3)
+        assert not db.flush_history(timeout=5), "Failed write must not report success"
+        assert db._history_writer.pending_failed == 5
+        other.execute("ALTER TABLE history_hidden RENAME TO history")
+        other.commit()
+        assert db.flush_history(timeout=5), "Failed batch should be retried"
+        assert len(db.get_history(function_id, limit=1000)) == 265
+        
+        other.execute("ALTER TABLE history RENAME TO history_hidden")
+        other.commit()
+        db.save_history(function_id, [0, 4], 4)
+        try:
+            db.close()
+            assert False, "Unwritten history should be reported on close"
+        except HistoryWriteError:
+            pass
+        other.execute("ALTER TABLE history_hidden RENAME TO history")
+        other.commit()
+        other.close()
+    print("✓ History is written in batches and flushed on close")
+
+
+def test_function_metadata():
+    """Тестирует списки метаданных и кэш разобранных функций."""
+    print("\nТестирование метаданных функций...")
+    
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    fact = create_factorial()
+    db.save_function("fact", fact.to_dict(), "factorial")
+    
+    metadata = db.list_function_metadata()
+    assert len(metadata) == 1 and "definition" not in metadata[0]
+    assert metadata[0]["arity"] == 1
+    assert metadata[0]["node_count"] > 10 and metadata[0]["size"] > 0
+    
+    first = db.load_function_object(name="fact")
+    assert db.load_function_object(name="fact") is first, "Parsed function should be cached"
+    db.save_function("fact", create_addition().to_dict())
+    reloaded = db.load_function_object(name="fact")
+    assert reloaded is not first and reloaded.arity() == 2, "Changed function should be reparsed"
+    db.close()
+    print("✓ Metadata listing and parsed-function cache work")
+
+
+def test_full_text_search():
+    """Тестирует полнотекстовый поиск по библиотеке функций."""
+    print("\nТестирование полнотекстового поиска...")
+    
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    db.save_function("factorial", create_factorial().to_dict(), "n! через умножение")
+    db.save_function("add", create_addition().to_dict(), "сложение двух чисел")
+    db.save_function("double", create_addition().to_dict(), "удвоение через add")
+    
+    results = db.full_text_search("add")
+    assert results[0]["name"] == "add", "Name matches should rank first"
+    assert {r["name"] for r in results} == {"add", "double"}
+    
+    # Поиск по текстовой записи определения и по префиксу слова
+    assert {r["name"] for r in db.full_text_search("projection")} == {"factorial", "add", "double"}
+    assert [r["name"] for r in db.full_text_search("умнож")] == ["factorial"]
+    
+    # Индекс синхронизируется при изменении и удалении
+    db.save_function("add", create_addition().to_dict(), "сумма")
+    assert db.full_text_search("сложение") == []
+    db.delete_function(db.get_function_metadata(name="double")["id"])
+    assert [r["name"] for r in db.full_text_search("add")] == ["add"]
+    assert db.full_text_search("\"*(") == []
+    db.close()
+    print("✓ Full-text search works")
+
+
+def test_history_pagination():
+    """Тестирует постраничную выборку истории по курсору."""
+    print("\nТестирование постраничной истории...")
+    
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    add_id = db.save_function("add", create_addition().to_dict())
+    fact_id = db.save_function("fact", create_factorial().to_dict())
+    for i in range(25):
+        db.save_history(add_id if i % 2 else fact_id, [i], i)
+    
+    # Постраничный обход без пропусков и повторов
+    seen, before = [], None
+    while True:
+        page = db.get_history(function_id=add_id, limit=5, before=before)
+        if not page:
+            break
+        seen.extend(entry["arguments"][0] for entry in page)
+        before = db.history_cursor(page[-1])
+    assert seen == list(range(23, 0, -2)), seen
+    
+    # Новые записи после курсора, от старых к новым
+    cursor = db.history_cursor(db.get_history(limit=1)[0])
+    assert db.get_history_since(cursor) == []
+    db.save_history(add_id, [100], 100)
+    db.save_history(fact_id, [101], 101)
+    assert [e["result"] for e in db.get_history_since(cursor)] == ["100", "101"]
+    assert [e["result"] for e in db.get_history_since(cursor, function_id=fact_id)] == ["101"]
+    
+    plan = " ".join(row["detail"] for row in db.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM history WHERE function_id = 1 "
+        "AND (timestamp, id) < ('9999', 0) ORDER BY timestamp DESC, id DESC"))
+    assert "idx_history_function_page" in plan and "TEMP B-TREE" not in plan, plan
+    
+    # Страница ключей выбирается только из индекса, строки читаются по id
+    statements = []
+    db.read_conn.set_trace_callback(statements.append)
+    db.get_history(function_id=add_id, limit=5, before=before or cursor)
+    db.read_conn.set_trace_callback(None)
+    page_sql = next(sql for sql in statements if "FROM history" in sql)
+    plan = " ".join(row["detail"] for row in db.read_conn.execute("EXPLAIN QUERY PLAN " + page_sql))
+    assert "COVERING INDEX idx_history_function_page" in plan, plan
+    db.close()
+    print("✓ Keyset history pagination works")
+
+
+def test_online_backup():
+    """Тестирует резервное копирование без закрытия соединений."""
+    print("\nТестирование резервного копирования...")
+    
+    import os
+    import tempfile
+    import time
+    import sqlite3
+    from database.backup import restore_backup, run_backup
+    from database.db_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "prf.db"))
+        function_id = db.save_function("add", create_addition().to_dict())
+        for i in range(200):
+            db.save_history(function_id, [i, i], 2 * i)
+        conn = db.conn
+        
+        steps = []
+        backup_path = os.path.join(tmp, "copy.db.gz")
+        assert db.backup_database(backup_path, pages=1,
+                                  progress=lambda done, total: steps.append((done, total)))
+        assert db.conn is conn, "Backup should not reopen connections"
+        assert len(steps) > 1 and steps[-1][0] == steps[-1][1]
+        
+        restored_path = os.path.join(tmp, "restored.db")
+        restore_backup(backup_path, restored_path)
+        restored = DatabaseManager(restored_path)
+        assert restored.load_function(name="add") is not None
+        assert len(restored.get_history(limit=1000)) == 200
+        restored.close()
+        
+        # Копия в фоне, пока продолжается запись
+        future = db.backup_database_async(os.path.join(tmp, "async.db"), pages=1)
+        db.save_history(function_id, [0, 0], 0)
+        assert future.result() is True
+        assert os.path.exists(os.path.join(tmp, "async.db"))
+        
+        # Фоновые копии выполняются одним потоком и не плодят соединения
+        connections = db._pool.connection_count()
+        futures = [db.backup_database_async(os.path.join(tmp, f"async{i}.db")) for i in range(5)]
+        assert all(f.result() for f in futures)
+        assert db._pool.connection_count() == connections
+        
+        # Запись на каждом шаге перезапускает копирование: после лимита
+        # перезапусков оставшиеся страницы копируются за один шаг
+        writer = sqlite3.connect(os.path.join(tmp, "prf.db"))
+        writer.execute("CREATE TABLE scratch(x)")
+        steps = []
+        
+        def write_between_steps(done, total):
+            steps.append(done)
+            writer.execute("INSERT INTO scratch VALUES (?)", (done,))
+            writer.commit()
+        
+        source = sqlite3.connect(os.path.join(tmp, "prf.db"))
+        run_backup(source, os.path.join(tmp, "busy.db"), pages=1,
+                   progress=write_between_steps, max_restarts=3)
+        assert len(steps) <= 6, steps
+        copy = sqlite3.connect(os.path.join(tmp, "busy.db"))
+        assert copy.execute("SELECT count(*) FROM history").fetchone()[0] == 201
+        copy.close()
+        try:
+            run_backup(source, os.path.join(tmp, "none.db"), pages=0)
+            assert False, "non-positive page count accepted"
+        except ValueError:
+            pass
+        source.close()
+        writer.close()
+        
+        # Плановые копии с ротацией
+        backups = os.path.join(tmp, "backups")
+        scheduler = db.start_backup_schedule(backups, interval=3600, keep=2)
+        for _ in range(4):
+            assert scheduler.run_once()
+            time.sleep(0.001)
+        assert len(os.listdir(backups)) == 2
+        assert scheduler.last_backup.endswith(".db.gz")
+        db.close()
+    print("✓ Online backup works")
+
+
+def test_streaming_import_export():
+    """Тестирует потоковый экспорт и пакетный импорт библиотеки функций."""
+    print("\nТестирование потокового импорта и экспорта...")
+    
+    import gzip
+    import json
+    import os
+    import tempfile
+    from database.db_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        source = DatabaseManager(":memory:")
+        for i in range(30):
+            source.save_function(f"add{i}", create_addition().to_dict(), f"copy {i}")
+        source.save_function("fact", create_factorial().to_dict(), "factorial")
+        
+        path = os.path.join(tmp, "library.jsonl.gz")
+        assert source.export_functions_jsonl(path) == 31
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert len(lines) == 31 and json.loads(lines[-1])["name"] == "fact"
+        
+        # Некорректные и битые записи пропускаются
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            f.write(json.dumps({"name": "bad", "definition": {
+                "type": "primitive_recursion",
+                "g": {"type": "zero"}, "h": {"type": "zero"}}}) + "\n")
+            f.write("{not json\n")
+        
+        target = DatabaseManager(":memory:")
+        target.save_function("fact", create_addition().to_dict(), "old")
+        created = target.get_function_metadata(name="fact")["created_at"]
+        assert target.import_functions_jsonl(path, batch_size=8, workers=2) == 31
+        
+        fact = target.get_function_metadata(name="fact")
+        assert fact["description"] == "factorial" and fact["arity"] == 1
+        assert fact["created_at"] == created, "Upsert should keep the creation time"
+        assert target.get_function_metadata(name="bad") is None
+        assert len(target.list_function_metadata()) == 31
+        assert target.full_text_search("factorial")[0]["name"] == "fact"
+        
+        # Повторный импорт не меняет неизменившиеся функции
+        updated = fact["updated_at"]
+        assert target.import_functions_jsonl(path, workers=1) == 31
+        assert target.get_function_metadata(name="fact")["updated_at"] == updated
+        source.close()
+        target.close()
+    print("✓ Streaming import and export work")
+
+
+def test_node_storage():
+    """Тестирует хранение определений общими узлами."""
+    print("\nТестирование хранения узлов...")
+    
+    import json
+    import os
+    import sqlite3
+    import tempfile
+    from core.prf import structural_hash
+    from database.db_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prf.db")
+        # База старого формата с определением, сохраненным целиком
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE functions (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "name TEXT UNIQUE NOT NULL, definition TEXT NOT NULL, "
+                     "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, description TEXT)")
+        conn.execute("INSERT INTO functions (name, definition) VALUES (?, ?)",
+                     ("add", json.dumps(create_addition().to_dict())))
+        conn.commit()
+        conn.close()
+        
+        db = DatabaseManager(path)
+        db.save_function("mult", create_multiplication().to_dict())
+        db.save_function("fact", create_factorial().to_dict())
+        
+        # Сложение хранится один раз, хотя входит во все три функции
+        stats = db.get_node_stats()
+        assert stats["nodes"] < stats["logical_nodes"], stats
+        stored = db.conn.execute("SELECT definition FROM functions WHERE name = 'fact'").fetchone()[0]
+        assert len(stored) < 100, "Functions should reference their root node"
+        
+        for name, factory in (("add", create_addition), ("mult", create_multiplication),
+                              ("fact", create_factorial)):
+            assert db.load_function(name=name)["definition"] == factory().to_dict()
+        assert db.load_function_object(name="fact").evaluate([4]) == 24
+        
+        containing = db.find_functions_containing(create_addition().to_dict())
+        assert [f["name"] for f in containing] == ["add", "fact", "mult"]
+        mult_hash = structural_hash(create_multiplication().to_dict())
+        assert [f["name"] for f in db.find_functions_containing(mult_hash)] == ["fact", "mult"]
+        
+        # Узлы удаленных функций собираются отдельно
+        db.delete_function(db.get_function_metadata(name="fact")["id"])
+        assert db.collect_unused_nodes() > 0
+        assert db.load_function(name="mult")["definition"] == create_multiplication().to_dict()
+        assert db.collect_unused_nodes() == 0
+        db.close()
+    print("✓ Node storage works")
+
+
+def test_function_references():
+    """Тестирует ссылки на сохраненные функции и индекс зависимостей."""
+    print("\nТестирование ссылок на функции...")
+    
+    import json
+    from core.prf import Reference, Composition, Successor, function_from_dict, function_hash
+    from database.db_manager import DatabaseManager
+    
+    ref = function_from_dict({"type": "reference", "name": "add", "arity": 2})
+    assert isinstance(ref, Reference) and ref.arity() == 2
+    assert ref.to_dict() == {"type": "reference", "name": "add", "arity": 2}
+    
+    db = DatabaseManager(":memory:")
+    db.save_function("add", create_addition().to_dict())
+    
+    # Встроенная копия сложения заменяется ссылкой
+    mult_inline = create_multiplication().to_dict()
+    mult_linked = db.link_definition(mult_inline, exclude_name="mult")
+    assert "reference" in json.dumps(mult_linked)
+    mult_id = db.save_function("mult", mult_linked)
+    fact_id = db.save_function("fact", db.link_definition(create_factorial().to_dict(), "fact"))
+    inline_size = len(json.dumps(create_factorial().to_dict(), ensure_ascii=False))
+    assert db.get_function_metadata(name="fact")["size"] < inline_size * 0.6
+    assert db.get_dependencies(fact_id) == [{"name": "mult", "hash": None}]
+    assert [f["name"] for f in db.get_dependents("add")] == ["fact", "mult"]
+    assert [f["name"] for f in db.get_dependents("add", transitive=False)] == ["mult"]
+    
+    # Связанная функция вычисляется и хэшируется как встроенная копия
+    mult = db.load_function_object(name="mult")
+    assert function_hash(mult) == function_hash(create_multiplication())
+    assert Evaluator().evaluate(mult, [6, 7]) == 42
+    assert Evaluator().evaluate(db.load_function_object(name="fact"), [5]) == 120
+    tracking = Evaluator()
+    assert tracking.evaluate(mult, [2, 3], track_steps=True) == 6
+    plain = Evaluator()
+    plain.evaluate(create_multiplication(), [2, 3], track_steps=True)
+    assert tracking.step_counter == plain.step_counter
+    
+    # Изменение функции перезагружает только зависимые функции
+    fact = db.load_function_object(name="fact")
+    succ_add = Composition(Successor(), [create_addition()]).to_dict()
+    db.save_function("add", succ_add)
+    assert db.load_function_object(name="fact") is not fact
+    assert Evaluator().evaluate(db.load_function_object(name="mult"), [2, 3]) == 8
+    
+    # Ссылка по хэшу закрепляет версию
+    pinned = {"type": "reference", "hash": function_hash(create_multiplication()), "arity": 2}
+    db.save_function("mult_v1", create_multiplication().to_dict())
+    db.save_function("pinned", pinned)
+    assert Evaluator().evaluate(db.load_function_object(name="pinned"), [2, 3]) == 6
+    
+    # Циклы и неизвестные ссылки
+    db.save_function("loop", {"type": "reference", "name": "loop", "arity": 1})
+    db.save_function("dangling", {"type": "reference", "name": "missing", "arity": 1})
+    for name in ("loop", "dangling"):
+        try:
+            db.load_function_object(name=name)
+            assert False, f"{name} should not link"
+        except ValueError:
+            pass
+    
+    # Неразрешимые функции не перезагружаются при сохранении других функций
+    loads = []
+    load = db.load_function_object
+    db.load_function_object = lambda **kwargs: loads.append(kwargs) or load(**kwargs)
+    db.save_function("other", {"type": "reference", "name": "add", "arity": 2})
+    db._import_records([{"name": "more", "definition": create_addition().to_dict()}], workers=1)
+    unresolved = {db.get_function_metadata(name=name)["id"] for name in ("loop", "dangling")}
+    assert loads and not unresolved & {kwargs.get("function_id") for kwargs in loads}, loads
+    # Сохранение цели ссылки связывает зависимую функцию
+    db.save_function("missing", Successor().to_dict())
+    assert db.conn.execute(
+        "SELECT content_hash FROM functions WHERE name = 'dangling'").fetchone()[0] is not None
+    del db.load_function_object
+    
+    # Потоки загружают и вытесняют одни и те же функции одновременно
+    import sys
+    import threading
+    db.function_cache_size = 1
+    db.node_cache_size = 2
+    errors = []
+    
+    def loader():
+        try:
+            for _ in range(50):
+                for name in ("fact", "mult", "add"):
+                    assert db.load_function_object(name=name) is not None
+        except Exception as e:
+            errors.append(e)
+    
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=loader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == [], errors
+    db.close()
+    
+    # Изменение цели ссылки другим процессом обновляет связанную функцию
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prf.db")
+        db = DatabaseManager(path)
+        db.save_function("add", create_addition().to_dict())
+        db.save_function("mult", db.link_definition(create_multiplication().to_dict(), "mult"))
+        assert Evaluator().evaluate(db.load_function_object(name="mult"), [2, 3]) == 6
+        other = DatabaseManager(path)
+        other.save_function("add", succ_add)
+        other.close()
+        assert Evaluator().evaluate(db.load_function_object(name="mult"), [2, 3]) == 8
+        db.close()
+    print("✓ Function references work")
+
+
+def test_binary_codec():
+    """Тестирует двоичный формат определений."""
+    print("\nТестирование двоичного формата...")
+    
+    import json
+    import os
+    import tempfile
+    from core.codec import (CodecError, encode_definition, decode_definition,
+                            encode_function, decode_function)
+    from database.db_manager import DatabaseManager
+    
+    for factory in (create_addition, create_multiplication, create_factorial):
+        definition = factory().to_dict()
+        data = encode_definition(definition)
+        assert decode_definition(data) == definition
+        assert encode_function(factory()) == data
+        assert len(data) * 10 < len(json.dumps(definition))
+    assert Evaluator().evaluate(decode_function(encode_function(create_factorial())), [4]) == 24
+    
+    reference = {"type": "reference", "name": "сложение", "arity": 2}
+    assert decode_definition(encode_definition(reference)) == reference
+    
+    # Повторяющееся поддерево записывается обратной ссылкой
+    mult = create_multiplication().to_dict()
+    pair = {"type": "composition", "f": create_addition().to_dict(), "g_list": [mult, mult]}
+    assert len(encode_definition(pair)) < 2 * len(encode_definition(mult))
+    assert decode_definition(encode_definition(pair)) == pair
+    
+    # Глубокие определения кодируются без рекурсии
+    deep = {"type": "projection", "n": 1, "i": 1}
+    for _ in range(100000):
+        deep = {"type": "composition", "f": {"type": "successor"}, "g_list": [deep]}
+    decoded = decode_definition(encode_definition(deep))
+    for _ in range(100000):
+        decoded = decoded["g_list"][0]
+    assert decoded == {"type": "projection", "n": 1, "i": 1}
+    
+    for bad in (b"", b"JSON", b"PRF\x09\x00", b"PRF\x01\x04\x01", b"PRF\x01\x00\x00"):
+        try:
+            decode_definition(bad)
+            assert False, f"{bad!r} should not decode"
+        except CodecError:
+            pass
+    
+    # Двоичная библиотека функций
+    source = DatabaseManager(":memory:")
+    source.save_function("add", create_addition().to_dict(), "addition")
+    source.save_function("mult", create_multiplication().to_dict())
+    source.save_function("fact", create_factorial().to_dict(), "")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ("library.prfl", "library.prfl.gz"):
+            path = os.path.join(tmp, name)
+            assert source.export_functions_binary(path) == 3
+            target = DatabaseManager(":memory:")
+            assert target.import_functions_binary(path, workers=1) == 3
+            for function in source.list_function_metadata():
+                copy = target.load_function(name=function["name"])
+                assert copy["description"] == function["description"]
+                assert copy["definition"] == source.load_function(name=function["name"])["definition"]
+            assert Evaluator().evaluate(target.load_function_object(name="fact"), [5]) == 120
+            target.close()
+    source.close()
+    print("✓ Binary codec works")
+
+
+def test_deep_serialization():
+    """Тестирует сериализацию очень глубоких определений без рекурсии."""
+    print("\nТестирование глубоких определений...")
+    
+    import json
+    import sys
+    from core.prf import function_from_dict, structural_hash
+    from core.serialization import (dumps_definition, loads_definition, loads,
+                                    definition_to_flat, definition_from_flat)
+    
+    limit = sys.getrecursionlimit()
+    for factory in (create_addition, create_multiplication, create_factorial):
+        definition = factory().to_dict()
+        assert dumps_definition(definition) == json.dumps(definition)
+        assert loads_definition(dumps_definition(definition, flat=True)) == definition
+        assert loads(json.dumps(definition, indent=2)) == definition
+        flat = definition_to_flat(definition)
+        assert "children" in flat["nodes"][flat["root"]]
+        assert definition_from_flat(flat) == definition
+    # Одинаковые поддеревья плоского формата записываются один раз
+    mult = create_multiplication().to_dict()
+    pair = {"type": "composition", "f": create_addition().to_dict(), "g_list": [mult, mult]}
+    flat = definition_to_flat(pair)
+    assert len(flat["nodes"]) == len(definition_to_flat(mult)["nodes"]) + 1
+    restored = definition_from_flat(flat)
+    assert restored == pair and restored["g_list"][0] is restored["g_list"][1]
+    
+    # Ссылки на еще не построенные узлы и неверный корень отклоняются
+    successor = {"type": "successor"}
+    for nodes, root in (([{"type": "composition", "children": [1]}, successor], 0),
+                        ([successor], 1), ([successor], "0")):
+        try:
+            definition_from_flat({"format": "prf-nodes", "version": 1, "root": root, "nodes": nodes})
+            assert False, f"{nodes} with root {root!r} should not load"
+        except ValueError:
+            pass
+    
+    depth = 100000
+    deep = {"type": "projection", "n": 2, "i": 2}
+    for _ in range(depth):
+        deep = {"type": "composition", "f": {"type": "successor"}, "g_list": [deep]}
+    text = dumps_definition(deep)
+    
+    loaded = loads_definition(text)
+    function = function_from_dict(loaded)
+    assert function.arity() == 2
+    assert dumps_definition(function.to_dict()) == text
+    
+    flat_loaded = loads_definition(dumps_definition(deep, flat=True))
+    assert structural_hash(flat_loaded) == structural_hash(deep)
+    
+    for bad in ('{"type": "zero"', '{"format": "prf-nodes", "version": 1, "root": 0, '
+                '"nodes": [{"type": "composition", "children": [0]}]}'):
+        try:
+            loads_definition(bad)
+            assert False, f"{bad} should not load"
+        except ValueError:
+            pass
+    assert sys.getrecursionlimit() == limit
+    print("✓ Deep serialization works")
+
+
+def test_lazy_functions():
+    """Тестирует ленивое построение узлов функции."""
+    print("\nТестирование ленивых узлов...")
+    
+    import os
+    import tempfile
+    from core.prf import (LazyFunction, Composition, function_hash, function_children,
+                          function_node_hashes)
+    from database.db_manager import DatabaseManager
+    
+    fact = LazyFunction(create_factorial().to_dict())
+    assert fact.arity() == 1 and not fact.is_built()
+    assert fact.to_dict() == create_factorial().to_dict()
+    
+    # Обращение к дочерним узлам строит только один уровень
+    g, h = function_children(fact)
+    assert fact.is_built() and isinstance(g, LazyFunction) and isinstance(h, LazyFunction)
+    assert not h.is_built() and h.arity() == 2 and g.arity() == 0
+    
+    assert Evaluator().evaluate(fact, [4]) == 24
+    assert function_hash(fact) == function_hash(create_factorial())
+    steps = Evaluator()
+    assert steps.evaluate(LazyFunction(create_multiplication().to_dict()), [2, 3], track_steps=True) == 6
+    plain = Evaluator()
+    plain.evaluate(create_multiplication(), [2, 3], track_steps=True)
+    assert steps.step_counter == plain.step_counter
+    
+    # Глубокая цепочка: для арности узлы не строятся
+    deep = {"type": "projection", "n": 1, "i": 1}
+    for _ in range(50000):
+        deep = {"type": "composition", "f": {"type": "successor"}, "g_list": [deep]}
+    lazy = LazyFunction(deep)
+    assert lazy.arity() == 1 and not lazy.is_built()
+    assert isinstance(lazy.resolve(), Composition)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "prf.db")
+        db = DatabaseManager(path)
+        db.save_function("add", create_addition().to_dict())
+        db.save_function("mult", db.link_definition(create_multiplication().to_dict(), "mult"))
+        db.close()
+        
+        db = DatabaseManager(path)
+        mult = db.load_function_object(name="mult", lazy=True)
+        assert isinstance(mult, LazyFunction) and mult.arity() == 2 and not mult.is_built()
+        # Хэш известен из базы: для кэша результатов узлы не строятся
+        assert function_hash(mult) == function_hash(create_multiplication())
+        assert not mult.is_built()
+        assert mult.to_dict() == db.load_function(name="mult")["definition"]
+        
+        # Узлы читаются по одному при построении
+        loaded = []
+        load_node_parts = db._load_node_parts
+        db._load_node_parts = lambda node_hash: loaded.append(node_hash) or load_node_parts(node_hash)
+        add = db.load_function_object(name="add", lazy=True)
+        g, h = function_children(add)
+        assert len(loaded) == 1 and not h.is_built()
+        assert h.known_hash == function_hash(create_addition().h)
+        assert function_hash(add) == function_hash(create_addition()) and len(loaded) == 1
+        assert Evaluator().evaluate(add, [2, 3]) == 5
+        del db._load_node_parts
+        
+        assert Evaluator().evaluate(mult, [6, 7]) == 42
+        
+        # Ответ из кэша не строит ленивую функцию ради контрольных точек,
+        # а при вычислении хэши узлов рекурсии вычисляются по мере входа в них
+        evaluator = Evaluator(result_cache=db, checkpoint_store=db, checkpoint_interval=1)
+        assert evaluator.evaluate(mult, [6, 7]) == 42 and not evaluator.cache_hit
+        fresh = db.load_function_object(name="mult", lazy=True)
+        assert evaluator.evaluate(fresh, [6, 7]) == 42 and evaluator.cache_hit
+        assert not fresh.is_built()
+        fresh = db.load_function_object(name="mult", lazy=True)
+        assert evaluator.evaluate(fresh, [3, 4]) == 12 and not evaluator.cache_hit
+        assert evaluator._node_hashes
+        assert set(evaluator._node_hashes.values()) <= set(function_node_hashes(create_multiplication()).values())
+        
+        # Полностью построенная функция из кэша возвращается как есть
+        built = db.load_function_object(name="mult")
+        assert db.load_function_object(name="mult", lazy=True) is built
+        db.close()
+    print("✓ Lazy functions work")
+
+
+def test_function_versions():
+    """Тестирует дельта-кодированную историю версий функций."""
+    print("\nТестирование истории версий...")
+    
+    import json
+    import os
+    import tempfile
+    from core.prf import Composition, Successor, structural_hash
+    from database.db_manager import DatabaseManager
+    from database.versions import SNAPSHOT_INTERVAL
+    
+    db = DatabaseManager(":memory:")
+    definitions = []
+    function = create_multiplication()
+    for _ in range(SNAPSHOT_INTERVAL + 4):
+        definitions.append(function.to_dict())
+        db.save_function("f", function.to_dict(), "plus one")
+        function = Composition(Successor(), [function])
+    # Повторное сохранение без изменений не создает версию
+    db.save_function("f", definitions[-1], "plus one")
+    
+    versions = db.get_versions(name="f")
+    assert [v["version"] for v in versions] == list(range(len(definitions), 0, -1))
+    snapshots = [v["version"] for v in versions if v["snapshot"]]
+    assert snapshots == [SNAPSHOT_INTERVAL + 1, 1], snapshots
+    full = next(v for v in versions if v["version"] == 1)["stored_nodes"]
+    assert all(v["stored_nodes"] <= 2 for v in versions if not v["snapshot"])
+    assert full > 2
+    for number, definition in enumerate(definitions, 1):
+        assert db.load_version(number, name="f")["definition"] == definition
+    
+    # Время создания не сбрасывается при изменении функции
+    created = db.get_function_metadata(name="f")["created_at"]
+    db.save_function("f", create_addition().to_dict(), "addition")
+    assert db.get_function_metadata(name="f")["created_at"] == created
+    
+    # Откат создает новую версию
+    latest = db.rollback_function(3, name="f")
+    assert latest == len(definitions) + 2
+    assert db.load_function(name="f")["definition"] == definitions[2]
+    assert db.get_function_metadata(name="f")["description"] == "plus one"
+    
+    # Сжатие оставляет последние версии восстановимыми
+    assert db.compact_versions(keep=3) == latest - 3
+    remaining = db.get_versions(name="f")
+    assert [v["version"] for v in remaining] == [latest, latest - 1, latest - 2]
+    assert remaining[-1]["snapshot"]
+    assert structural_hash(db.load_version(latest - 1, name="f")["definition"]) == \
+        structural_hash(create_addition().to_dict())
+    assert db.load_version(1, name="f") is None
+    
+    # Импорт записывает версии только изменившихся функций
+    db.save_function("g", create_addition().to_dict())
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "library.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for name, definition in (("f", definitions[2]), ("g", create_multiplication().to_dict()),
+                                     ("h", create_factorial().to_dict())):
+                f.write(json.dumps({"name": name, "description": "plus one" if name == "f" else None,
+                                    "definition": definition}) + "\n")
+        assert db.import_functions_jsonl(path, workers=1) == 3
+    assert len(db.get_versions(name="f")) == 3
+    assert [v["version"] for v in db.get_versions(name="g")] == [2, 1]
+    assert db.load_version(1, name="g")["definition"] == create_addition().to_dict()
+    assert db.load_version(1, name="h")["definition"] == create_factorial().to_dict()
+    
+    # Версии удаленной функции сохраняются: ее можно восстановить откатом
+    versions = db.get_versions(name="f")
+    db.delete_function(name="f")
+    assert db.get_function_metadata(name="f") is None
+    assert db.get_versions(name="f") == versions
+    oldest, newest = versions[-1], versions[0]
+    restored = db.load_version(oldest["version"], name="f")
+    assert restored["hash"] == oldest["hash"]
+    assert db.rollback_function(oldest["version"], name="f") == newest["version"] + 1
+    assert db.load_function(name="f")["definition"] == restored["definition"]
+    assert len(db.get_versions(name="f")) == len(versions) + 1
+    # Новая функция с именем удаленной продолжает ее историю, в том числе при импорте
+    db.delete_function(name="g")
+    db.save_function("g", create_factorial().to_dict())
+    assert [v["version"] for v in db.get_versions(name="g")] == [3, 2, 1]
+    db.delete_function(name="h")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "library.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"name": "h", "definition": create_addition().to_dict()}) + "\n")
+        assert db.import_functions_jsonl(path, workers=1) == 1
+    assert [v["version"] for v in db.get_versions(name="h")] == [2, 1]
+    assert db.read_conn.execute("SELECT COUNT(*) FROM deleted_functions").fetchone()[0] == 0
+    db.close()
+    print("✓ Function versions work")
+
+
+def test_history_retention():
+    """Тестирует политику хранения истории и сводную статистику."""
+    print("\nТестирование хранения истории...")
+    
+    import time
+    from database.db_manager import DatabaseManager
+    from database.history_retention import RetentionPolicy
+    
+    db = DatabaseManager(":memory:")
+    add_id = db.save_function("add", create_addition().to_dict())
+    fact_id = db.save_function("fact", create_factorial().to_dict())
+    for i in range(30):
+        db.save_history(add_id, [i % 4, 1], i % 4 + 1, steps=10 + i, elapsed=0.001 * (i + 1))
+    db.save_history(fact_id, [3], 6)
+    # Старые записи с явной отметкой времени
+    db.conn.executemany(
+        "INSERT INTO history (function_id, arguments, result, steps, timestamp) "
+        "VALUES (?, ?, ?, ?, datetime('now', '-40 days'))",
+        [(add_id, "[9, 9]", "18", 5)] * 3
+    )
+    db.conn.commit()
+    
+    today = db.get_history_stats(function_id=add_id)[0]
+    assert (today["calls"], today["argument_sets"]) == (30, 4), today
+    assert (today["min_steps"], today["max_steps"], today["avg_steps"]) == (10, 39, 24.5)
+    assert abs(today["max_elapsed"] - 0.03) < 1e-9
+    fact_stats = db.get_history_stats(function_id=fact_id)[0]
+    assert fact_stats["calls"] == 1 and fact_stats["avg_steps"] is None
+    assert db.get_history_summary(add_id)["calls"] == 33
+    
+    # Политика хранения удаляет записи, но не статистику
+    removed = db.compact_history(RetentionPolicy(max_age_days=30, max_rows_per_function=10))
+    assert removed == 23, removed
+    kept = db.get_history(function_id=add_id, limit=100)
+    assert [e["steps"] for e in kept] == list(range(39, 29, -1))
+    assert len(db.get_history(function_id=fact_id)) == 1
+    summary = db.get_history_summary(add_id)
+    assert (summary["calls"], summary["days"], summary["min_steps"]) == (33, 2, 5), summary
+    assert db.get_history_summary()["calls"] == 34
+    
+    # Пересчет по оставшимся записям
+    db.rebuild_history_rollup()
+    assert db.get_history_summary(add_id)["calls"] == 10
+    
+    # Фоновое сжатие
+    for i in range(5):
+        db.save_history(fact_id, [i], 1)
+    compactor = db.start_history_compaction(RetentionPolicy(max_rows_per_function=2), interval=0.01)
+    deadline = time.time() + 5
+    while len(db.get_history(function_id=fact_id)) > 2 and time.time() < deadline:
+        time.sleep(0.01)
+    db.stop_history_compaction()
+    assert len(db.get_history(function_id=fact_id)) == 2
+    assert compactor.total_removed >= 4
+    db.close()
+    print("✓ History retention and rollup statistics work")
+
+
+def test_history_costs():
+    """Тестирует запись стоимости вычислений и поиск регрессий."""
+    print("\nТестирование стоимости вычислений в истории...")
+    
+    import json
+    from database.db_manager import DatabaseManager
+    
+    db = DatabaseManager(":memory:")
+    add_id = db.save_function("add", create_addition().to_dict())
+    
+    evaluator = Evaluator(result_cache=db)
+    result = evaluator.evaluate(create_addition(), [2, 3])
+    db.save_history(add_id, [2, 3], result, **DatabaseManager.history_costs(evaluator.get_statistics()))
+    result = evaluator.evaluate(create_addition(), [2, 3])
+    db.save_history(add_id, [2, 3], result, **DatabaseManager.history_costs(evaluator.get_statistics()))
+    computed, cached = db.get_history(function_id=add_id)[::-1]
+    assert computed["steps"] > 0 and computed["depth"] > 0 and computed["engine"] == "simple"
+    assert computed["cache_hit"] is False and cached["cache_hit"] is True
+    assert cached["engine"] == "cache"
+    # Результаты из кэша не входят в стоимость
+    assert len(db.get_cost_history(add_id)) == 1
+    assert len(db.get_cost_history(add_id, [2, 3], include_cache_hits=True)) == 2
+    stats = db.get_history_stats(add_id)[0]
+    assert stats["calls"] == 2 and stats["min_steps"] == stats["max_steps"] == computed["steps"]
+    
+    # Базовый период: 20 дней назад, проверяемый - сегодня
+    old_rows = [(add_id, json.dumps([n, 1]), "0", 100, 0.01, 5, "simple", 0) for n in range(3)]
+    db.conn.executemany(
+        "INSERT INTO history (function_id, arguments, result, steps, elapsed, depth, engine, "
+        "cache_hit, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, datetime('now', '-20 days'))",
+        old_rows
+    )
+    db.conn.commit()
+    db.save_history(add_id, [0, 1], 1, steps=100, elapsed=0.05, depth=5, engine="tracking",
+                    cache_hit=False)
+    db.save_history(add_id, [1, 1], 2, steps=100, elapsed=0.011, depth=5, engine="simple",
+                    cache_hit=False)
+    db.save_history(add_id, [2, 1], 3, steps=1, elapsed=1.0, depth=5, engine="cache",
+                    cache_hit=True)
+    
+    regressions = db.find_performance_regressions("elapsed", recent_days=7, baseline_days=30)
+    assert [(r["arguments"], r["engine"]) for r in regressions] == [([0, 1], "tracking")], regressions
+    assert abs(regressions[0]["ratio"] - 5.0) < 1e-9
+    assert db.find_performance_regressions("steps", function_id=add_id) == []
+    assert db.find_performance_regressions("elapsed", recent_days=7, baseline_days=5) == []
+    try:
+        db.find_performance_regressions("result")
+        assert False, "unknown metric accepted"
+    except ValueError:
+        pass
+    
+    plan = " ".join(row["detail"] for row in db.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM history WHERE function_id = 1 AND arguments = '[1]' "
+        "AND timestamp >= '2000' ORDER BY timestamp"))
+    assert "idx_history_function_costs" in plan and "TEMP B-TREE" not in plan, plan
+    
+    # Страница стоимости с фильтром по кэшу выбирается только из индекса
+    for arguments, index in (([0, 1], "costs"), (None, "page")):
+        statements = []
+        db.read_conn.set_trace_callback(statements.append)
+        db.get_cost_history(add_id, arguments, limit=3)
+        db.read_conn.set_trace_callback(None)
+        page_sql = next(sql for sql in statements if "FROM history" in sql)
+        plan = " ".join(row["detail"] for row in db.read_conn.execute("EXPLAIN QUERY PLAN " + page_sql))
+        assert f"COVERING INDEX idx_history_function_{index}" in plan, plan
+    db.close()
+    print("✓ Evaluation costs are recorded in history")
+
+
+def test_value_tables():
+    """Тестирует предвычисленные таблицы значений, отображенные в память."""
+    print("\nТестирование таблиц значений...")
+    
+    import os
+    import tempfile
+    from core.tables import TableError, ValueTable, ValueTableSet, write_value_table, table_index
+    from database.db_manager import DatabaseManager
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "prf.db"))
+        db.save_function("add", create_addition().to_dict())
+        db.save_function("fact", create_factorial().to_dict())
+        add_path = db.precompute_table(32, name="add")
+        db.precompute_table(6, name="fact")
+        assert os.path.dirname(add_path) == os.path.join(tmp, "prf.tables")
+        
+        tables = db.value_tables()
+        assert len(tables) == 2
+        evaluator = Evaluator(value_tables=tables)
+        add = db.load_function_object(name="add")
+        assert evaluator.evaluate(add, [17, 25]) == 42
+        assert evaluator.get_statistics()["engine"] == "table"
+        assert evaluator.evaluate(add, [31, 31]) == 62
+        # Вне области таблицы функция вычисляется
+        assert evaluator.evaluate(add, [40, 2]) == 42
+        assert evaluator.get_statistics()["engine"] == "simple"
+        assert evaluator.evaluate(db.load_function_object(name="fact"), [5]) == 120
+        assert evaluator.cache_hit
+        
+        # Таблица со значениями переменной длины
+        big_path = os.path.join(tmp, "big.prft")
+        values = [3 ** (a + 2 * b) << 70 for b in range(4) for a in range(4)]
+        write_value_table(big_path, values, 2, 4, "f" * 64)
+        table = ValueTable(big_path)
+        assert table.width == 0 and table.get([3, 2]) == 3 ** 7 << 70 and table.get([4, 0]) is None
+        assert table_index([3, 2], 4) == 11
+        table.close()
+        
+        # Значения пишутся потоком: маленькие блоки, сужение записей и
+        # переход к переменной длине посреди таблицы
+        import core.tables
+        chunk, core.tables._CHUNK = core.tables._CHUNK, 3
+        try:
+            stream_path = os.path.join(tmp, "stream.prft")
+            write_value_table(stream_path, (a * 7 for a in range(25)), 2, 5, "e" * 64)
+            table = ValueTable(stream_path)
+            assert table.width == 1 and [table.get([a % 5, a // 5]) for a in range(25)] == [a * 7 for a in range(25)]
+            table.close()
+            mixed = [a if a != 11 else 2 ** 100 for a in range(25)]
+            write_value_table(stream_path, iter(mixed), 2, 5, "e" * 64)
+            table = ValueTable(stream_path)
+            assert table.width == 0 and [table.get([a % 5, a // 5]) for a in range(25)] == mixed
+            table.close()
+            try:
+                write_value_table(stream_path, iter(range(24)), 2, 5, "e" * 64)
+                assert False, "Short table should be rejected"
+            except TableError:
+                pass
+            assert not [f for f in os.listdir(tmp) if f.endswith((".partial", ".data"))]
+        finally:
+            core.tables._CHUNK = chunk
+        assert ValueTableSet(os.path.join(tmp, "missing")).lookup("f" * 64, [0, 0]) is None
+        db.close()
+    print("✓ Memory-mapped value tables work")
+
+
+def _shared_cache_worker(cache, args):
+    """Вычисляет умножение с общим кэшем в процессе пула."""
+    evaluator = Evaluator(result_cache=cache)
+    return evaluator.evaluate(create_multiplication(), args), evaluator.cache_hit
+
+
+def test_shared_result_cache():
+    """Тестирует кэш результатов в разделяемой памяти."""
+    print("\nТестирование кэша в разделяемой памяти...")
+    
+    import multiprocessing
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+    from core.shared_cache import SharedResultCache, result_key
+    
+    cache = SharedResultCache(slots=256)
+    try:
+        # Результат, вычисленный процессом пула, доступен родителю и наоборот
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(1, mp_context=context) as executor:
+            assert executor.submit(_shared_cache_worker, cache, [6, 7]).result() == (42, False)
+            evaluator = Evaluator(result_cache=cache)
+            assert evaluator.evaluate(create_multiplication(), [6, 7]) == 42 and evaluator.cache_hit
+            cache.save_cached_result("x" * 64, [1], 2 ** 300)
+            assert cache.get_cached_result("x" * 64, [1]) == 2 ** 300
+            # Результат больше слота не кэшируется
+            assert not cache.put(result_key("x" * 64, [2]), 2 ** 1000)
+            assert cache.get_stats()["entries"] == 2
+        cache.clear()
+        assert cache.get_cached_result("x" * 64, [1]) is None
+    finally:
+        cache.unlink()
+    
+    # Вытеснение внутри корзины: давно не использованный слот
+    small = SharedResultCache(slots=4)
+    small_name, lock_path = small.name, small._locks.path
+    try:
+        for i in range(4):
+            small.save_cached_result("h", [i], i)
+        small.get_cached_result("h", [0])
+        small.save_cached_result("h", [4], 4)
+        assert [small.get_cached_result("h", [i]) for i in range(5)] == [0, None, 2, 3, 4]
+    finally:
+        # Закрытие владельца безымянного сегмента удаляет сегмент и блокировки
+        small.close()
+    assert not os.path.exists(lock_path)
+    try:
+        shared_memory.SharedMemory(name=small_name)
+        assert False, "owner close() left the segment behind"
+    except FileNotFoundError:
+        pass
+    
+    # Кэш второго уровня и подключение по имени
+    backing = {}
+    
+    class Backing:
+        def get_cached_result(self, function_hash, arguments):
+            return backing.get((function_hash, tuple(arguments)))
+        
+        def save_cached_result(self, function_hash, arguments, result):
+            backing[(function_hash, tuple(arguments))] = result
+    
+    named = SharedResultCache(name=f"prf-test-{os.getpid()}", slots=16, backing=Backing())
+    try:
+        backing[("h", (5,))] = 25
+        other = SharedResultCache(name=named.name)
+        assert other.slots == 16 and other.get_cached_result("h", [5]) is None
+        assert named.get_cached_result("h", [5]) == 25
+        assert other.get_cached_result("h", [5]) == 25
+        other.save_cached_result("h", [6], 36)
+        assert named.get_cached_result("h", [6]) == 36 and ("h", (6,)) not in backing
+        other.close()
+    finally:
+        named.unlink()
+    print("✓ Shared-memory result cache works")
+
+
+def test_function_fingerprints():
+    """Тестирует канонические хэши, отпечатки и поиск дубликатов."""
+    print("\nТестирование поиска дубликатов...")
+    
+    from core.prf import Composition, function_hash
+    from core.fingerprint import canonical_hash, behaviour_fingerprint, UNKNOWN
+    import database.db_manager as db_manager
+    from database.db_manager import DatabaseManager
+    
+    add = create_addition()
+    wrapped = Composition(Projection(2, 2), [Projection(2, 1), create_addition()])
+    swapped = Composition(create_addition(), [Projection(2, 2), Projection(2, 1)])
+    double = Composition(create_addition(), [Projection(2, 1), Projection(2, 1)])
+    
+    assert canonical_hash(add) == function_hash(add)
+    assert canonical_hash(wrapped) == canonical_hash(add)
+    assert canonical_hash(swapped) != canonical_hash(add)
+    assert behaviour_fingerprint(swapped)["fingerprint"] == behaviour_fingerprint(add)["fingerprint"]
+    # 2x совпадает с x + y на пробах с равными аргументами
+    assert behaviour_fingerprint(double)["prefix"] == behaviour_fingerprint(add)["prefix"]
+    assert behaviour_fingerprint(double)["fingerprint"] != behaviour_fingerprint(add)["fingerprint"]
+    # Пробы сверх ограничения шагов не вычисляются, а отпечаток с ними не совпадает ни с чем
+    fact = behaviour_fingerprint(create_factorial())
+    assert UNKNOWN in fact["values"] and fact["fingerprint"] is None
+    assert fact["prefix"] is not None
+    assert behaviour_fingerprint(create_factorial(), step_budget=1)["prefix"] is None
+    
+    db = DatabaseManager(":memory:")
+    db.save_function("add", add.to_dict())
+    db.save_function("wrapped", wrapped.to_dict())
+    db.save_function("swapped", swapped.to_dict())
+    db.save_function("double", double.to_dict())
+    db.save_function("mult", create_multiplication().to_dict())
+    db.save_function("fact", create_factorial().to_dict())
+    db.save_function("fact_copy", create_factorial().to_dict())
+    # Сохранение не вычисляет отпечатки: их вычисляет первый поиск
+    assert db.read_conn.execute("SELECT COUNT(*) FROM function_fingerprints").fetchone()[0] == 0
+    assert db.update_fingerprints() == 6
+    
+    # Повторный поиск без изменений только читает индексы
+    changes = db.conn.total_changes
+    matches = {entry["name"]: entry["match"] for entry in db.find_duplicates(name="add")}
+    assert matches == {"wrapped": "canonical", "swapped": "behaviour"}
+    matches = {entry["name"]: entry["match"] for entry in db.find_duplicates(name="add", near=True)}
+    assert matches == {"wrapped": "canonical", "swapped": "behaviour", "double": "near"}
+    assert db.find_duplicates(name="mult") == []
+    assert db.find_duplicates(name="fact") == [
+        {"id": db.get_function_metadata(name="fact_copy")["id"], "name": "fact_copy",
+         "match": "identical"}
+    ]
+    
+    groups = db.find_duplicate_groups("behaviour")
+    assert [[entry["name"] for entry in group["functions"]] for group in groups] == \
+        [["add", "swapped", "wrapped"]]
+    assert [len(group["functions"]) for group in db.find_duplicate_groups("canonical")] == [2, 2]
+    assert db.conn.total_changes == changes
+    # Отпечаток новой функции вычисляется при следующем поиске
+    db.save_function("first", Composition(Successor(), [Projection(2, 1)]).to_dict())
+    assert {entry["name"] for entry in db.find_duplicates(name="add", near=True)} == \
+        {"wrapped", "swapped", "double"}
+    assert db.read_conn.execute("SELECT COUNT(*) FROM function_fingerprints").fetchone()[0] == 7
+    db.delete_function(db.get_function_metadata(name="first")["id"])
+    
+    plan = " ".join(row[-1] for row in db.read_conn.execute(
+        "EXPLAIN QUERY PLAN SELECT content_hash FROM function_fingerprints WHERE fingerprint = 'x'"))
+    assert "idx_function_fingerprints_fingerprint" in plan, plan
+    
+    # Отпечатки удаленных функций удаляются
+    db.delete_function(db.get_function_metadata(name="mult")["id"])
+    assert db.read_conn.execute("SELECT COUNT(*) FROM function_fingerprints").fetchone()[0] == 5
+    
+    # Ошибка проверки запоминается и не повторяется
+    def failing(function):
+        raise ValueError("probe failed")
+    
+    original, db_manager.behaviour_fingerprint = db_manager.behaviour_fingerprint, failing
+    try:
+        db.save_function("mult", create_multiplication().to_dict())
+        assert db.find_duplicates(name="mult") == []
+    finally:
+        db_manager.behaviour_fingerprint = original
+    row = db.read_conn.execute(
+        "SELECT p.* FROM function_fingerprints p JOIN functions f ON f.content_hash = p.content_hash "
+        "WHERE f.name = 'mult'").fetchone()
+    assert row["error"] == "probe failed" and row["fingerprint"] is None
+    assert db.update_fingerprints() == 0
+    assert db.find_duplicates(name="mult") == []
+    db.close()
+    print("✓ Duplicate detection works")
+
+
+def test_dag_validation():
+    """Тестирует однопроходную валидацию с путями к ошибкам."""
+    print("\nТестирование валидации общих поддеревьев...")
+    
+    from core.prf import Composition, PrimitiveRecursion, LazyFunction, function_from_dict, function_hash
+    from core.validator import ValidationError
+    
+    # 2^200 путей, но 201 различный узел
+    shared = Projection(1, 1)
+    for _ in range(200):
+        shared = Composition(create_addition(), [shared, shared])
+    assert Validator.validate(shared) == []
+    # Проверки узлов запоминаются по структурному хэшу
+    assert function_hash(create_addition()) in Validator._results
+    
+    # Глубокое определение проверяется без рекурсии
+    deep = Successor()
+    for _ in range(5000):
+        deep = Composition(Successor(), [deep])
+    assert Validator.is_valid(deep)
+    
+    broken = Composition(create_addition(), [Projection(2, 1), Projection(2, 2)])
+    broken.g_list[1] = Projection(3, 1)
+    outer = PrimitiveRecursion(Projection(1, 1), Composition(broken, [Projection(3, 1), Projection(3, 2)]))
+    errors = Validator.validate_detailed(outer)
+    assert [error.path for error in errors] == [("h", "f")], errors
+    assert isinstance(errors[0], ValidationError)
+    assert errors[0].location == "h.f"
+    assert Validator.validate(outer) == [
+        "Composition: all g functions must have same arity, g[1] has arity 3, expected 2"
+    ]
+    # Ошибка общего поддерева сообщается один раз
+    twice = Composition(create_addition(), [broken, broken])
+    assert [error.location for error in Validator.validate_detailed(twice)] == ["g[0]"]
+    
+    cycle = Composition(Successor(), [Projection(1, 1)])
+    cycle.g_list[0] = cycle
+    errors = Validator.validate_detailed(cycle)
+    assert [(error.message, error.location) for error in errors] == \
+        [("Circular dependency detected", "g[0]")]
+    
+    # Непостроенный ленивый узел проверяется только по арности и не
+    # запоминается, поэтому не скрывает ошибки того же поддерева
+    data = Composition(Projection(2, 1), [Zero(), Projection(2, 1)]).to_dict()
+    expected = Validator.validate(function_from_dict(data))
+    assert expected and "g[1] has arity 2" in expected[0], expected
+    Validator._results.clear()
+    assert Validator.validate(LazyFunction(data)) == []
+    assert Validator.validate(function_from_dict(data)) == expected
+    print("✓ DAG validation works")
+
+
+def test_recursion_depth():
+    """Тестирует смысл ограничения и статистики глубины в обоих режимах."""
+    print("\nТестирование глубины рекурсии...")
+    
+    # Без отслеживания шагов итерации рекурсии не увеличивают глубину
+    evaluator = Evaluator()
+    assert evaluator.evaluate(create_addition(), [3, 4]) == 7
+    assert evaluator.get_statistics()["max_depth"] == 2
+    assert evaluator.evaluate(create_addition(), [3000, 4]) == 3004
+    assert evaluator.get_statistics()["max_depth"] == 2
+    assert Evaluator(max_depth=2).evaluate(create_addition(), [3000, 4]) == 3004
+    try:
+        Evaluator(max_depth=1).evaluate(create_addition(), [3, 4])
+        assert False, "Node nesting should exceed max_depth"
+    except RecursionError:
+        pass
+    # Количество итераций ограничивает max_steps
+    try:
+        Evaluator(max_steps=1000).evaluate(create_addition(), [3000, 4])
+        assert False, "Iterations should exceed max_steps"
+    except RecursionError:
+        pass
+    
+    # При отслеживании шагов каждый уровень рекурсии увеличивает глубину
+    tracking = Evaluator()
+    tracking.evaluate(create_addition(), [3, 4], track_steps=True)
+    assert tracking.get_statistics()["max_depth"] == 4
+    evaluator.evaluate(create_addition(), [3, 4])
+    assert tracking.step_counter == evaluator.step_counter
+    try:
+        Evaluator(max_depth=3).evaluate(create_addition(), [3, 4], track_steps=True)
+        assert False, "Tracked recursion should exceed max_depth"
+    except RecursionError:
+        pass
+    
+    # Цикл итераций выбирается при запуске по наличию обработчиков
+    evaluator.evaluate(create_addition(), [3, 4])
+    assert evaluator._iterate == evaluator._iterate_plain
+    evaluator.add_hook("recursion_iteration", lambda *event: None)
+    evaluator.evaluate(create_addition(), [3, 4])
+    assert evaluator._iterate == evaluator._iterate_hooked
+    
+    # Шаг режима отслеживания тоже выбирается при запуске
+    tracking.evaluate(create_addition(), [3, 4], track_steps=True)
+    assert tracking._track == tracking._track_node
+    iterations = []
+    tracking.add_hook("recursion_iteration", lambda rec, i, total, acc, depth: iterations.append((i, acc)))
+    assert tracking.evaluate(create_addition(), [3, 4], track_steps=True) == 7
+    assert tracking._track == tracking._track_hooked
+    assert iterations == [(1, 5), (2, 6), (3, 7)], iterations
+    print("✓ Depth limits match the evaluation mode")
+
+
 if __name__ == "__main__":
     try:
         test_basic_functions()
@@ -127,6 +1616,32 @@ if __name__ == "__main__":
         test_factorial()
         test_validation()
         test_serialization()
+        test_slow_log()
+        test_memory_accounting()
+        test_hooks()
+        test_recursion_depth()
+        test_cancellation()
+        test_checkpoints()
+        test_result_cache()
+        test_connection_pool()
+        test_async_history()
+        test_function_metadata()
+        test_full_text_search()
+        test_history_pagination()
+        test_online_backup()
+        test_streaming_import_export()
+        test_node_storage()
+        test_function_references()
+        test_binary_codec()
+        test_deep_serialization()
+        test_lazy_functions()
+        test_function_versions()
+        test_history_retention()
+        test_history_costs()
+        test_value_tables()
+        test_shared_result_cache()
+        test_function_fingerprints()
+        test_dag_validation()
         
         print("\n" + "="*50)
         print("Все тесты пройдены успешно! ✓")
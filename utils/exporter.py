@@ -3,7 +3,7 @@
 """
 
 from typing import Optional
-from core.prf import PrimitiveFunction, Zero, Successor, Constant, Projection, Composition, PrimitiveRecursion
+from core.prf import PrimitiveFunction, Zero, Successor, Constant, Projection, Composition, PrimitiveRecursion, Reference, LazyFunction
 
 
 def export_to_latex(function: PrimitiveFunction, name: Optional[str] = None) -> str:
@@ -65,6 +65,12 @@ def _function_to_latex(function: PrimitiveFunction) -> str:
         h_latex = _function_to_latex(function.h)
         return f"\\text{{Recursion}}({g_latex}, {h_latex})"
     
+    elif isinstance(function, Reference):
+        return f"\\text{{{function.label()}}}"
+    
+    elif isinstance(function, LazyFunction):
+        return _function_to_latex(function.resolve())
+    
     else:
         return str(function)
 
@@ -3,7 +3,7 @@
 """
 
 from typing import Optional
-from core.prf import PrimitiveFunction, Composition, PrimitiveRecursion
+from core.prf import PrimitiveFunction, Composition, PrimitiveRecursion, LazyFunction
 
 
 def visualize_function(function: PrimitiveFunction, output_path: Optional[str] = None) -> Optional[str]:
@@ -40,6 +40,8 @@ def visualize_function(function: PrimitiveFunction, output_path: Optional[str] =
 
 def _add_node_to_graph(dot, function: PrimitiveFunction, node_id: str, parent_id: Optional[str] = None) -> None:
     """Рекурсивно добавляет узлы в граф."""
+    if isinstance(function, LazyFunction):
+        function = function.resolve()
     func_type = type(function).__name__
     label = f"{func_type}\\narity: {function.arity()}"
     
@@ -1,13 +1,50 @@
 from flask import Flask, render_template, jsonify, request
+import atexit
 import json
+import math
 import sys
 import os
+import threading
+import time
 
 # Добавляем путь к модулям
 sys.path.append('/app')
 
 app = Flask(__name__)
 
+# Кэш результатов в разделяемой памяти, общий для всех воркеров на машине
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+# Верхняя граница времени вычисления, которое может запросить клиент (секунды)
+MAX_COMPUTE_TIMEOUT = float(os.environ.get('PRF_MAX_COMPUTE_TIMEOUT', 30))
+
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            # Параллельные первые запросы не должны подключаться к сегменту дважды
+            if _result_cache is None:
+                from core.shared_cache import SharedResultCache
+                cache = SharedResultCache(name=os.environ.get('PRF_SHARED_CACHE', 'prf-results'))
+                atexit.register(_close_result_cache)
+                _result_cache = cache
+    return _result_cache
+
+
+def _close_result_cache():
+    """Отключается от кэша; создавший сегмент процесс удаляет его."""
+    global _result_cache
+    with _result_cache_lock:
+        cache, _result_cache = _result_cache, None
+    if cache is None:
+        return
+    if cache._owner:
+        cache.unlink()
+    else:
+        cache.close()
+
 
 @app.route('/')
 def index():
@@ -18,12 +55,24 @@ def index():
 def compute():
     data = request.json
     # Здесь вызываешь твой вычислитель
-    from core.evaluator import Evaluator
-    from core.function_factory import create_addition
+    from core.evaluator import Evaluator, EvaluationCancelled
+    from core.prf import create_addition
 
-    evaluator = Evaluator()
+    evaluator = Evaluator(result_cache=get_result_cache())
     add_func = create_addition()
-    result = evaluator.evaluate(add_func, data['args'])
+    # Ограничиваем время вычисления, чтобы долгий запрос не занимал воркер
+    try:
+        timeout = float(data.get('timeout', 10))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'timeout must be a number'}), 400
+    if not math.isfinite(timeout):
+        timeout = MAX_COMPUTE_TIMEOUT
+    timeout = min(max(timeout, 0.0), MAX_COMPUTE_TIMEOUT)
+    try:
+        result = evaluator.evaluate(add_func, data['args'],
+                                    deadline=time.monotonic() + timeout)
+    except EvaluationCancelled as e:
+        return jsonify({'error': str(e)}), 408
 
     return jsonify({'result': result})
 